@@ -5,13 +5,16 @@
 功能说明:
 1. 自动检测当前目录下所有视频文件
 2. 跳过已经是9:16比例的视频
-3. 【新增】检查视频时长，如果超过60秒则截取前14秒作为新原视频
+3. 【新增】检查视频时长，如果超过60秒则按关键帧的画面变化与亮度选取最佳的14秒片段
+   (避开片头与黑场)，在输入端用 -ss / -t 截取，不写中间文件
 4. 【新增】如果视频比例在1:1和16:9之间(1.0-1.78)，顺时针旋转90度
 5. 对于其他比例的视频，使用双步处理方案:
-   - 第一步: 先裁剪掉所有黑色填充区域
+   - 第一步: 先裁剪掉所有黑色填充区域 (按关键帧抽样 cropdetect，结果随探测缓存保存)
    - 第二步: 独立处理前景层，应用边缘渐变羽化，并保存为带透明通道的临时文件
    - 第三步: 将处理好的前景层叠加到背景模糊层上
    - 智能降级: 当主方案失败时自动回退到pad+模糊方案
+   - 默认以单个滤镜图流式完成截取、旋转、缩放、羽化与叠加，不写中间文件；
+     失败时 (或 --two-step) 回退到上述写 ProRes 临时文件的双步方案
 6. 使用指定路径的FFmpeg和GPU加速进行视频处理和编码
 7. 输出到output目录，保持原文件名
 """
@@ -24,11 +27,24 @@ import platform
 import time
 import logging
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, Iterator, List, Tuple, Optional, Any
 import ffmpeg  # type: ignore
 import re
 import tempfile
-import shutil
+import argparse
+
+from ve_cache import get_probe_cache, video_stream
+from ve_crop import detect_crop
+from ve_discover import iter_videos
+from ve_encoders import probe_encoders
+from ve_locate import locate_ffmpeg
+from ve_mask import feather_mask_path
+from ve_resources import Admission, Demand, ResourceModel
+from ve_scene import select_window
+from ve_scheduler import JobScheduler
+from ve_scratch import ScratchPool
+from ve_supervisor import run_ffmpeg
+from ve_trace import enable_tracing, finish_tracing, span
 
 # 配置日志
 logging.basicConfig(
@@ -45,18 +61,19 @@ logger = logging.getLogger(__name__)
 VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov',
                     '.mkv', '.flv', '.wmv', '.m4v', '.webm']
 TARGET_RATIO = 9/16  # 9:16 (0.5625)
-MAX_VRAM_USAGE = 4 * 1024 * 1024 * 1024  # 4GB in bytes
 OUTPUT_DIR = "output"
 FEATHER_WIDTH = 30  # 边缘渐变宽度（像素）
-TEMP_DIR = "temp_processing"  # 临时文件目录
+TEMP_DIR = "temp_processing"  # 临时文件根目录 (每个任务一个子目录)
 MAX_DURATION = 60.0  # 超过此秒数的视频需要裁剪
-TRIM_DURATION = 14.0  # 裁剪后保留的时长（秒）
+TRIM_DURATION = 14.0  # 截取后保留的时长（秒）
+STDERR_LOG_LINES = 40  # 失败时打印的 stderr 末尾行数
+PRORES_BYTES_PER_PIXEL = 1.0  # ProRes 4444 中间文件每像素每帧的大致字节数 (用于 tmpfs 预算)
 
 
 class FFmpegManager:
     """管理FFmpeg组件和路径"""
 
-    def __init__(self):
+    def __init__(self, use_shm: bool = False):
         """初始化FFmpeg管理器"""
         # 获取当前脚本所在目录
         self.base_dir = Path(__file__).parent.absolute()
@@ -71,23 +88,24 @@ class FFmpegManager:
         self.components = {}
         # GPU加速支持状态
         self.cuda_support = False
+        # 各阶段实测资源占用 (process_all_videos 中创建)，用于并发任务的准入预测
+        self.resources: Optional[ResourceModel] = None
 
         logger.info(f"🔧 FFmpeg管理器初始化:")
         logger.info(f"  基础目录: {self.base_dir}")
         logger.info(f"  FFmpeg目录: {self.ffmpeg_dir}")
         logger.info(f"  操作系统: {platform.system()} {platform.release()}")
         logger.info(f"  边缘渐变宽度: {FEATHER_WIDTH}像素")
-        logger.info(f"  时长控制: 超过{MAX_DURATION}秒的视频截取前{TRIM_DURATION}秒")
+        logger.info(f"  时长控制: 超过{MAX_DURATION}秒的视频截取最佳的{TRIM_DURATION}秒片段")
 
-        # 确保临时目录存在
-        os.makedirs(TEMP_DIR, exist_ok=True)
+        # 每个任务使用独立的临时子目录，引用计数归零时删除；启动时清理崩溃遗留的目录
+        self.scratch = ScratchPool(TEMP_DIR, use_shm=use_shm)
+        self.scratch.sweep()
 
     def __del__(self):
-        """清理临时文件"""
+        """清理本进程尚未释放的临时目录 (不影响其它进程的任务)"""
         try:
-            if os.path.exists(TEMP_DIR):
-                shutil.rmtree(TEMP_DIR)
-                logger.info(f"🧹 清理临时目录: {TEMP_DIR}")
+            self.scratch.close()
         except Exception as e:
             logger.warning(f"⚠️ 清理临时目录时出错: {str(e)}")
 
@@ -101,6 +119,13 @@ class FFmpegManager:
         components = {}
 
         if not self.ffmpeg_dir.exists():
+            # 没有 ffmpeg 子目录时按统一顺序定位 (诊断文件 / 程序目录 / PATH，结果缓存)
+            paths = locate_ffmpeg(self.base_dir)
+            if paths.ffmpeg:
+                components = {'ffmpeg': Path(paths.ffmpeg), 'ffprobe': Path(paths.ffprobe)}
+                logger.info(f"✅ 找到FFmpeg组件 ({paths.source}): {paths.ffmpeg}")
+                self.components = components
+                return components
             logger.error(f"❌ FFmpeg目录不存在: {self.ffmpeg_dir}")
             return components
 
@@ -186,22 +211,13 @@ class FFmpegManager:
             return False
 
         try:
-            # 通过执行命令检查编码器支持 - 安全可靠的方式
-            cmd = [str(ffmpeg_path), '-hide_banner', '-encoders']
-            result = subprocess.run(
-                cmd, capture_output=True, text=True, check=True)
-
-            # 检查输出中是否包含CUDA/NVENC支持
-            output = result.stdout.lower()
-
-            cuda_support = 'cuvid' in output or 'cuda' in output
-            nvenc_support = 'nvenc' in output
+            # 实际试编码 1 帧 (结果按 ffmpeg 文件缓存)，编译进了 NVENC 但没有显卡时也能正确判断
+            nvenc_support = probe_encoders(ffmpeg_path, ['h264_nvenc'])['h264_nvenc']
 
             logger.info("✅ CUDA加速支持检查完成:")
-            logger.info(f"  CUDA解码: {'✅ 支持' if cuda_support else '❌ 不支持'}")
-            logger.info(f"  NVENC编码: {'✅ 支持' if nvenc_support else '❌ 不支持'}")
+            logger.info(f"  NVENC编码: {'✅ 可用' if nvenc_support else '❌ 不可用'}")
 
-            self.cuda_support = cuda_support or nvenc_support
+            self.cuda_support = nvenc_support
             return self.cuda_support
 
         except Exception as e:
@@ -225,11 +241,9 @@ class FFmpegManager:
                 logger.error("❌ 未找到ffprobe组件")
                 return {}
 
-            # 使用ffprobe获取视频信息
-            probe = ffmpeg.probe(
-                str(video_path),
-                cmd=str(ffprobe_path)
-            )
+            # 使用ffprobe获取视频信息 (同一文件未变化时直接命中缓存)
+            with span('probe', file=video_path.name):
+                probe = get_probe_cache().probe(video_path, ffprobe_path)
 
             # 找到视频流
             video_stream = next(
@@ -304,8 +318,9 @@ class FFmpegManager:
                 f"📊 视频信息 - {video_path.name}: {json.dumps(video_info, indent=2)}")
             return video_info
 
-        except ffmpeg.Error as e:
-            stderr = e.stderr.decode() if e.stderr else str(e)
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode(
+                'utf-8', errors='replace') if e.stderr else str(e)
             logger.error(f"❌ FFprobe错误获取视频信息 {video_path}: {stderr}")
         except Exception as e:
             logger.error(f"❌ 获取视频信息失败 {video_path}: {str(e)}")
@@ -313,97 +328,102 @@ class FFmpegManager:
 
         return {}
 
-    def trim_video(self, input_path: Path, output_path: Path, duration: float) -> bool:
+    def run_output(self, output, total_frames: int = 0, stage: str = 'ffmpeg',
+                   target: Optional[Path] = None,
+                   profile: Optional[Tuple[str, int, int]] = None) -> None:
         """
-        截取视频的前duration秒
-        
-        Args:
-            input_path: 输入视频路径
-            output_path: 输出视频路径
-            duration: 要截取的时长（秒）
-        
-        Returns:
-            bool: 是否成功
-        """
-        try:
-            ffmpeg_path = self.get_component_path('ffmpeg')
-            if not ffmpeg_path:
-                logger.error("❌ 未找到ffmpeg组件")
-                return False
+        运行 ffmpeg-python 构建的输出
 
-            # 获取原始视频信息
-            video_info = self.get_video_info(input_path)
-            if not video_info:
-                logger.error(f"❌ 无法获取原始视频信息: {input_path}")
-                return False
+        不用 .run(capture_stderr=True) (会把整个 stderr 留在内存里)，而是编译成命令行
+        交给 ve_supervisor：读线程同时排空两个管道，stderr 只保留末尾，
+        并按 -progress 的帧率判定卡滞。失败时与 .run() 一样抛出 ffmpeg.Error。
 
-            logger.info(f"✂️ 开始截取视频: 保留前{duration}秒")
-            logger.info(f"   原始时长: {video_info['duration']:.2f}秒")
-
-            input_stream = ffmpeg.input(str(input_path))
-
-            # 构建输出参数
-            output_args = {
-                't': duration,  # 截取时长
-                'c:v': 'libx264',
-                'crf': '23',
-                'preset': 'fast',
-                'movflags': '+faststart'
-            }
-
-            # 处理音频
-            if video_info.get('has_audio', False):
-                audio_codec = video_info.get('audio_codec', '')
-                # 尝试保留原始音频格式，或转为通用格式
-                if audio_codec in ['aac', 'mp3']:
-                    output_args['c:a'] = 'copy'
-                else:
-                    output_args['c:a'] = 'aac'
-                    output_args['b:a'] = '128k'
-                logger.info("🔊 保留/转换音频流")
-
-            # 构建输出
-            output = (
-                input_stream
-                .output(str(output_path), **output_args)
-            )
-
-            # 执行命令
-            output.run(
-                cmd=str(ffmpeg_path),
-                overwrite_output=True,
-                capture_stdout=True,
-                capture_stderr=True
-            )
-
-            # 验证截取结果
-            trimmed_info = self.get_video_info(output_path)
-            if trimmed_info:
-                actual_duration = trimmed_info.get('duration', 0)
-                logger.info(f"✅ 视频截取成功! 实际时长: {actual_duration:.2f}秒")
-                return True
+        Args:
+            output: ffmpeg-python 的输出节点
+            total_frames: 预计总帧数，0 表示未知
+            stage: 追踪中的阶段名 (ve_trace)
+            target: 输出文件，计入追踪的写出字节数
+            profile: (变体, 源宽, 源高)，成功后登记本阶段的实测资源占用
+        """
+        cmd = (output.global_args('-progress', 'pipe:1', '-nostats')
+               .compile(cmd=str(self.get_component_path('ffmpeg')), overwrite_output=True))
+        with span(stage) as sp:
+            result = run_ffmpeg(cmd, total_frames)
+            sp.status = result.returncode
+            if target is not None:
+                sp.output(target)
+        if result.ok and profile and self.resources:
+            self.resources.record(*profile, result.usage)
+        if not result.ok:
+            reason = "卡滞已强制结束\n" if result.stalled else ""
+            stderr = reason + result.stderr_text(STDERR_LOG_LINES)
+            raise ffmpeg.Error('ffmpeg', b'', stderr.encode('utf-8'))
+
+    @staticmethod
+    def variant(stage: str, use_cuda: bool = False) -> str:
+        """资源记录的变体：处理阶段 + 是否使用 NVENC"""
+        return f"prefect-{stage}-{'cuda' if use_cuda else 'cpu'}"
+
+    def predict_demand(self, width: int, height: int, use_cuda: bool,
+                       two_step: bool = False) -> Demand:
+        """
+        按历史实测预测一个视频任务的资源占用
 
-            logger.error(f"❌ 无法验证截取后的视频: {output_path}")
-            return False
+        流式方案只有一个进程；双步方案各阶段依次运行，取各阶段的最大值
+        (ProRes 4444 前景与羽化阶段的内存占用通常最高)
+        """
+        if self.resources is None:
+            return Demand(0.0, 0.0)
+        if not two_step:
+            return self.resources.predict(self.variant('streaming', use_cuda), width, height)
+        stages = [self.resources.predict(self.variant(stage), width, height)
+                  for stage in ('rotate', 'fg_prores', 'feather')]
+        stages.append(self.resources.predict(self.variant('final_encode', use_cuda),
+                                             width, height))
+        return Demand(max(d.mem_mb for d in stages), max(d.cores for d in stages))
+
+    def find_black_borders(self, input_path: Path, video_info: Dict[str, Any]):
+        """
+        检测黑边 (只解码几个位置的关键帧，结果随探测缓存保存)
 
-        except ffmpeg.Error as e:
-            stderr = e.stderr.decode(
-                'utf-8', errors='replace') if e.stderr else str(e)
-            logger.error(f"❌ FFmpeg截取失败 ({input_path}):")
-            logger.error(f"标准错误: {stderr}")
-            return False
-        except Exception as e:
-            logger.error(f"❌ 截取视频时出错 ({input_path}): {str(e)}")
-            logger.exception("详细错误信息:")
-            return False
+        Returns:
+            (裁剪矩形或 None, 裁剪后宽, 裁剪后高, 裁剪后显示比例)
+        """
+        width, height = video_info['width'], video_info['height']
+        with span('cropdetect', file=input_path.name):
+            crop = detect_crop(input_path, self.get_component_path('ffmpeg'),
+                               self.get_component_path('ffprobe'))
+        if crop is None:
+            return None, width, height, video_info['display_ratio']
+        logger.info(f"🔲 裁掉黑边: {width}x{height} -> {crop.w}x{crop.h} (x={crop.x}, y={crop.y})")
+        return crop, crop.w, crop.h, crop.w * video_info.get('sar_ratio', 1.0) / crop.h
+
+    def trim_args(self, input_path: Path, duration: float) -> Dict[str, float]:
+        """
+        超长视频的输入端截取参数 (-ss / -t)，不超过 MAX_DURATION 时为空
 
-    def create_feathered_foreground(self, input_stream, orig_w, orig_h, original_ratio, target_width, target_height):
+        起点由 ve_scene 按关键帧的画面变化与亮度选取 (避开片头与黑场)，结果随探测缓存保存
         """
-        创建羽化处理的前景层，返回带透明通道的流
+        if duration <= MAX_DURATION:
+            return {}
+        with span('select_window', file=input_path.name):
+            start = select_window(input_path, duration, TRIM_DURATION,
+                                  self.get_component_path('ffmpeg'),
+                                  self.get_component_path('ffprobe'))
+        logger.info(
+            f"✂️ 检测到视频时长 ({duration:.2f}秒) 超过{MAX_DURATION}秒限制，"
+            f"截取 {start:.2f}秒 起的{TRIM_DURATION}秒")
+        return {'ss': start, 't': TRIM_DURATION} if start > 0 else {'t': TRIM_DURATION}
+
+    @staticmethod
+    def foreground_geometry(orig_w: int, orig_h: int, original_ratio: float,
+                            target_width: int, target_height: int) -> Tuple[int, int, int, int]:
         """
-        logger.info(f"✨ 开始独立处理前景层...")
+        计算前景层缩放后的尺寸与在画布中的位置
 
-        # 计算前景层的缩放参数
+        Returns:
+            Tuple[int, int, int, int]: (缩放宽, 缩放高, pad_x, pad_y)
+        """
         if original_ratio > TARGET_RATIO:
             # 宽视频 (如16:9, 1:1) - 横向视频
             scaled_width = target_width
@@ -412,12 +432,6 @@ class FFmpegManager:
             pad_y = (target_height - scaled_height) // 2
             logger.info(
                 f"📏 横向视频缩放: {orig_w}x{orig_h} -> {scaled_width}x{scaled_height}, 定位: ({pad_x}, {pad_y})")
-
-            # 缩放前景
-            fg_scaled = (
-                input_stream
-                .filter('scale', w=scaled_width, h=scaled_height)
-            )
         else:
             # 高视频 (如3:4, 4:5) - 纵向视频
             scaled_height = target_height
@@ -426,15 +440,96 @@ class FFmpegManager:
             pad_y = 0
             logger.info(
                 f"📏 纵向视频缩放: {orig_w}x{orig_h} -> {scaled_width}x{scaled_height}, 定位: ({pad_x}, {pad_y})")
+        return scaled_width, scaled_height, pad_x, pad_y
 
-            # 缩放前景
-            fg_scaled = (
-                input_stream
-                .filter('scale', w=scaled_width, h=scaled_height)
-            )
+    @staticmethod
+    def apply_feather(stream, width: int, height: int, fps: float = 25.0):
+        """
+        给前景加边缘渐变羽化：预生成的灰度遮罩作为循环图片输入，经 alphamerge 合并，
+        替代逐帧逐像素求值的 geq 表达式
+
+        Args:
+            stream: 已缩放到 width x height 的前景流
+            width, height: 前景尺寸
+            fps: 遮罩输入的帧率，与前景一致
+        """
+        mask_path = feather_mask_path(width, height, FEATHER_WIDTH)
+        mask = ffmpeg.input(str(mask_path), loop=1, framerate=fps).video.filter('format', 'gray')
+        # shortest=1: 遮罩是无限循环输入，前景结束时一并结束
+        return ffmpeg.filter([stream.filter('format', 'rgba'), mask], 'alphamerge', shortest=1)
+
+    @staticmethod
+    def build_output_args(use_cuda: bool, has_audio: bool, audio_codec: Optional[str]) -> Dict[str, Any]:
+        """根据CUDA支持与音频编码构建最终编码参数"""
+        output_args = {}
+        if use_cuda:
+            logger.info("⚡ 启用NVIDIA GPU硬件加速编码")
+            output_args.update({
+                'c:v': 'h264_nvenc',
+                'preset': 'p7',
+                'profile:v': 'main',
+                'b:v': '8M',
+                'maxrate': '10M',
+                'bufsize': '16M',
+                'rc': 'vbr_hq',
+            })
+        else:
+            output_args.update({
+                'c:v': 'libx264',
+                'preset': 'slow',
+                'crf': '23',
+                'movflags': '+faststart'
+            })
+
+        # 仅当有音频流时才添加音频参数
+        if has_audio:
+            # 检查音频编解码器是否支持
+            if audio_codec in ['aac', 'mp3', 'opus', 'ac3']:
+                # 保留原始音频
+                output_args.update({
+                    'c:a': 'copy'
+                })
+                logger.info("🔊 保留原始音频流 (直接复制)")
+            else:
+                # 重新编码为AAC
+                output_args.update({
+                    'c:a': 'aac',
+                    'b:a': '128k'
+                })
+                logger.info("🔊 重新编码音频为AAC格式")
+        return output_args
+
+    def create_feathered_foreground(self, input_stream, orig_w, orig_h, original_ratio, target_width, target_height,
+                                    fps: float = 25.0, scratch=None, duration: float = 0.0,
+                                    size: Optional[Tuple[int, int]] = None):
+        """
+        创建羽化处理的前景层，返回带透明通道的流
 
-        # 保存为临时文件，带透明通道
-        temp_fg_path = Path(TEMP_DIR) / f"temp_fg_{int(time.time())}.mov"
+        中间文件写入任务自己的临时目录 scratch (ScratchSpace)，
+        返回的前景文件由调用方在最终合成后随目录一起释放；
+        size 为源视频宽高时登记各阶段的实测资源占用
+        """
+        logger.info(f"✨ 开始独立处理前景层...")
+
+        # 计算前景层的缩放参数
+        scaled_width, scaled_height, pad_x, pad_y = self.foreground_geometry(
+            orig_w, orig_h, original_ratio, target_width, target_height)
+
+        # 缩放前景
+        fg_scaled = (
+            input_stream
+            .filter('scale', w=scaled_width, h=scaled_height)
+        )
+
+        # 保存为临时文件，带透明通道 (预计大小足够小时可放在 tmpfs)
+        if scratch is None:
+            scratch = self.scratch.create("fg")
+        else:
+            scratch.acquire()
+        estimate = int(scaled_width * scaled_height * fps * max(duration, 1.0)
+                       * PRORES_BYTES_PER_PIXEL)
+        temp_fg_path = scratch.file("fg.mov", estimate)
+        frames = int(fps * duration)
 
         try:
             logger.info(f"💾 保存缩放后的前景到临时文件: {temp_fg_path}")
@@ -452,13 +547,8 @@ class FFmpegManager:
                 .output(str(temp_fg_path), **output_args)
             )
 
-            ffmpeg_path = self.get_component_path('ffmpeg')
-            output.run(
-                cmd=str(ffmpeg_path),
-                overwrite_output=True,
-                capture_stdout=True,
-                capture_stderr=True
-            )
+            self.run_output(output, frames, 'fg_prores', temp_fg_path,
+                            (self.variant('fg_prores'), *size) if size else None)
 
             logger.info("✅ 前景缩放保存成功")
 
@@ -469,28 +559,12 @@ class FFmpegManager:
             try:
                 logger.info(f"🎨 应用边缘渐变羽化: {FEATHER_WIDTH}像素")
 
-                # 创建alpha渐变表达式 - 基于实际内容区域
-                alpha_expr = (
-                    f'if(lt(X,{FEATHER_WIDTH}), X/{FEATHER_WIDTH}, '
-                    f'if(gt(X,W-{FEATHER_WIDTH}), (W-X)/{FEATHER_WIDTH}, '
-                    f'if(lt(Y,{FEATHER_WIDTH}), Y/{FEATHER_WIDTH}, '
-                    f'if(gt(Y,H-{FEATHER_WIDTH}), (H-Y)/{FEATHER_WIDTH}, 1))))*255'
-                )
-
-                # 应用羽化效果
-                fg_feathered = (
-                    fg_input
-                    .filter('format', 'rgba')  # 确保有alpha通道
-                    .filter('geq',
-                            r='r(X,Y)',
-                            g='g(X,Y)',
-                            b='b(X,Y)',
-                            a=alpha_expr)
-                )
+                # 应用羽化效果 (预生成遮罩 + alphamerge)
+                fg_feathered = self.apply_feather(
+                    fg_input, scaled_width, scaled_height, fps)
 
                 # 保存羽化后的前景
-                temp_feathered_path = Path(
-                    TEMP_DIR) / f"temp_fg_feathered_{int(time.time())}.mov"
+                temp_feathered_path = scratch.file("fg_feathered.mov", estimate)
                 logger.info(f"💾 保存羽化后的前景到临时文件: {temp_feathered_path}")
 
                 output = (
@@ -498,12 +572,8 @@ class FFmpegManager:
                     .output(str(temp_feathered_path), **output_args)
                 )
 
-                output.run(
-                    cmd=str(ffmpeg_path),
-                    overwrite_output=True,
-                    capture_stdout=True,
-                    capture_stderr=True
-                )
+                self.run_output(output, frames, 'feather', temp_feathered_path,
+                                (self.variant('feather'), *size) if size else None)
 
                 logger.info("✅ 前景羽化保存成功")
 
@@ -532,8 +602,7 @@ class FFmpegManager:
                 )
 
                 # 保存降级方案的前景
-                temp_blurred_path = Path(
-                    TEMP_DIR) / f"temp_fg_blurred_{int(time.time())}.mov"
+                temp_blurred_path = scratch.file("fg_blurred.mov", estimate)
                 logger.info(f"💾 保存降级方案前景到临时文件: {temp_blurred_path}")
 
                 output = (
@@ -541,12 +610,8 @@ class FFmpegManager:
                     .output(str(temp_blurred_path), **output_args)
                 )
 
-                output.run(
-                    cmd=str(ffmpeg_path),
-                    overwrite_output=True,
-                    capture_stdout=True,
-                    capture_stderr=True
-                )
+                self.run_output(output, frames, 'feather_fallback', temp_blurred_path,
+                                (self.variant('feather'), *size) if size else None)
 
                 # 重新读取并定位
                 fg_blurred_input = ffmpeg.input(str(temp_blurred_path))
@@ -559,21 +624,142 @@ class FFmpegManager:
                 return fg_positioned, temp_blurred_path
 
         finally:
-            # 清理临时文件
-            if temp_fg_path.exists():
-                try:
-                    temp_fg_path.unlink()
-                    logger.debug(f"🧹 已清理临时文件: {temp_fg_path}")
-                except Exception as e:
-                    logger.warning(f"⚠️ 清理临时文件失败 {temp_fg_path}: {str(e)}")
+            # 缩放后的中间文件已不再需要，尽早释放 (tmpfs 预算随之归还)
+            scratch.remove(temp_fg_path)
+            logger.debug(f"🧹 已清理临时文件: {temp_fg_path}")
+            scratch.release()
+
+    def process_video(self, input_path: Path, output_path: Path, target_width: int, target_height: int,
+                      use_cuda: bool = False, two_step: bool = False) -> bool:
+        """
+        处理视频：默认使用单滤镜图流式方案，失败或显式指定 two_step 时使用双步 ProRes 方案
+        """
+        with span('process_video', cat='video', file=input_path.name) as sp:
+            ok = False
+            if not two_step:
+                with span('streaming') as st:
+                    ok = self.process_video_streaming(input_path, output_path, target_width,
+                                                      target_height, use_cuda)
+                    st.status = 'ok' if ok else 'failed'
+                if not ok:
+                    logger.warning("🔄 流式方案失败，回退到双步 ProRes 方案")
+            if not ok:
+                with span('two_step', fallback=not two_step) as st:
+                    ok = self.process_video_two_step(input_path, output_path, target_width,
+                                                     target_height, use_cuda)
+                    st.status = 'ok' if ok else 'failed'
+            sp.status = 'ok' if ok else 'failed'
+            sp.output(output_path)
+            return ok
+
+    def process_video_streaming(self, input_path: Path, output_path: Path, target_width: int, target_height: int, use_cuda: bool = False) -> bool:
+        """
+        单滤镜图流式方案：截取 (-t)、旋转、缩放、羽化、叠加全部在一个 ffmpeg 进程内完成，
+        不产生任何中间文件
+        """
+        try:
+            ffmpeg_path = self.get_component_path('ffmpeg')
+            if not ffmpeg_path:
+                logger.error("❌ 未找到ffmpeg组件")
+                return False
+
+            video_info = self.get_video_info(input_path)
+            if not video_info:
+                logger.error(f"❌ 无法获取视频信息: {input_path}")
+                return False
+
+            has_audio = video_info['has_audio']
+            duration = video_info.get('duration', 0)
+            source_size = (video_info['width'], video_info['height'])
+            # 先裁掉黑边，旋转判断与前景尺寸都按裁剪后的画面计算
+            crop, orig_w, orig_h, original_ratio = self.find_black_borders(input_path, video_info)
+
+            # 时长控制：在输入端用 -ss / -t 截取，无需中间文件
+            input_args = self.trim_args(input_path, duration)
+            if input_args:
+                duration = TRIM_DURATION
+
+            input_stream = ffmpeg.input(str(input_path), **input_args)
+            video = input_stream.video
+            if crop:
+                video = video.filter('crop', crop.w, crop.h, crop.x, crop.y)
+
+            # 智能旋转：比例在1:1和16:9之间时顺时针旋转90度，宽高与比例随之互换
+            if 1.0 <= original_ratio <= 16/9:
+                logger.info(
+                    f"🔄 检测到视频比例 {original_ratio:.4f} 在1:1和16:9之间，顺时针旋转90度")
+                video = video.filter('transpose', 1)
+                orig_w, orig_h = orig_h, orig_w
+                original_ratio = 1 / original_ratio
+
+            logger.info(f"\n{'='*60}")
+            logger.info(f"🎥 处理视频 (单图流式): {input_path.name}")
+            logger.info(
+                f"🎯 原始分辨率: {orig_w}x{orig_h} (比例: {original_ratio:.4f})")
+            logger.info(f"⏱️  视频时长: {duration:.2f}秒")
+            logger.info(f"🎯 目标分辨率: {target_width}x{target_height}")
+            logger.info(f"🚀 {'使用CUDA加速' if use_cuda else '使用CPU处理'}")
+
+            split_streams = video.filter_multi_output('split')
+
+            # 背景流: 放大以填充整个目标区域，然后模糊
+            bg = (
+                split_streams[0]
+                .filter('scale', w=target_width, h=target_height, force_original_aspect_ratio='increase')
+                .filter('crop', target_width, target_height)
+                .filter('gblur', sigma=15)
+            )
 
-    def process_video(self, input_path: Path, output_path: Path, target_width: int, target_height: int, use_cuda: bool = False) -> bool:
+            # 前景流: 缩放 -> 边缘渐变羽化 -> 透明填充定位
+            scaled_width, scaled_height, pad_x, pad_y = self.foreground_geometry(
+                orig_w, orig_h, original_ratio, target_width, target_height)
+            fg = self.apply_feather(
+                split_streams[1].filter('scale', w=scaled_width, h=scaled_height),
+                scaled_width, scaled_height, video_info.get('fps', 25.0)
+            ).filter('pad', w=target_width, h=target_height, x=pad_x, y=pad_y, color='black@0')
+
+            streams = [bg.overlay(fg)]
+            if has_audio:
+                streams.append(input_stream.audio)
+            output_args = self.build_output_args(
+                use_cuda, has_audio, video_info.get('audio_codec', ''))
+
+            logger.info("🚀 开始视频合成 (无中间文件)...")
+            start_time = time.time()
+            self.run_output(ffmpeg.output(*streams, str(output_path), **output_args),
+                            int(duration * video_info.get('fps', 25.0)), 'final_encode',
+                            output_path, (self.variant('streaming', use_cuda), *source_size))
+            elapsed_time = time.time() - start_time
+
+            if not output_path.exists():
+                logger.error(f"❌ 输出文件未创建: {output_path}")
+                return False
+            output_size = output_path.stat().st_size / (1024 * 1024)
+            logger.info(f"✅ 视频处理成功! 耗时: {elapsed_time:.2f}秒")
+            logger.info(f"💾 输出文件: {output_path} ({output_size:.2f} MB)")
+            if output_size < 0.1:  # 小于100KB，可能有问题
+                logger.warning("⚠️ 输出文件异常小，可能存在处理问题")
+            return True
+
+        except ffmpeg.Error as e:
+            stderr = e.stderr.decode(
+                'utf-8', errors='replace') if e.stderr else str(e)
+            logger.error(f"❌ FFmpeg流式处理失败 ({input_path}):")
+            logger.error(f"标准错误: {stderr}")
+            return False
+        except Exception as e:
+            logger.error(f"❌ 流式处理视频时出错 ({input_path}): {str(e)}")
+            logger.exception("详细错误信息:")
+            return False
+
+    def process_video_two_step(self, input_path: Path, output_path: Path, target_width: int, target_height: int, use_cuda: bool = False) -> bool:
         """
         使用双步处理方案处理视频：先单独处理前景层（包括羽化），再叠加到背景
         【新增】时长控制 + 智能旋转
+        (备用方案：会写出旋转、ProRes 前景等中间文件)
         """
-        temp_trimmed_path = None  # 用于存储可能的临时截取文件
-        temp_rotated_path = None  # 用于存储可能的临时旋转文件
+        # 本任务的全部中间文件都在独立目录中，结束时整体释放
+        scratch = self.scratch.create(input_path.stem)
         try:
             ffmpeg_path = self.get_component_path('ffmpeg')
             if not ffmpeg_path:
@@ -586,41 +772,17 @@ class FFmpegManager:
                 logger.error(f"❌ 无法获取视频信息: {input_path}")
                 return False
 
-            orig_w, orig_h = video_info['width'], video_info['height']
             has_audio = video_info['has_audio']
-            original_ratio = video_info['display_ratio']
             duration = video_info.get('duration', 0)
+            # 各阶段的资源记录都按源视频宽高登记 (与准入预测使用的键一致)
+            source_size = (video_info['width'], video_info['height'])
+            # 第一步: 检测黑边
+            crop, orig_w, orig_h, original_ratio = self.find_black_borders(input_path, video_info)
 
-            # 【新增】检查视频时长，如果超过60秒则截取前14秒
-            if duration > MAX_DURATION:
-                logger.info(
-                    f"✂️ 检测到视频时长 ({duration:.2f}秒) 超过{MAX_DURATION}秒限制")
-                logger.info(f"   将截取前{TRIM_DURATION}秒作为新原视频进行处理")
-
-                # 创建临时截取文件
-                temp_trimmed_path = Path(
-                    TEMP_DIR) / f"trimmed_{int(time.time())}_{input_path.name}"
-
-                # 截取视频
-                if self.trim_video(input_path, temp_trimmed_path, TRIM_DURATION):
-                    # 用截取后的文件作为新的输入
-                    input_path = temp_trimmed_path
-
-                    # 重新获取视频信息
-                    video_info = self.get_video_info(input_path)
-                    if not video_info:
-                        logger.error(f"❌ 无法获取截取后视频的信息: {input_path}")
-                        return False
-
-                    # 更新信息
-                    orig_w, orig_h = video_info['width'], video_info['height']
-                    has_audio = video_info['has_audio']
-                    original_ratio = video_info['display_ratio']
-                    duration = video_info.get('duration', 0)
-
-                    logger.info(f"✅ 截取成功! 新视频时长: {duration:.2f}秒")
-                else:
-                    logger.warning("⚠️ 视频截取失败，继续使用原始视频")
+            # 【新增】超过60秒的视频选取最佳的14秒片段，在输入端截取 (不写中间文件)
+            input_args = self.trim_args(input_path, duration)
+            if input_args:
+                duration = TRIM_DURATION
 
             # 【新增】检查是否需要旋转 (比例在1:1和16:9之间)
             needs_rotation = 1.0 <= original_ratio <= 16/9  # 1.0 至 1.78
@@ -631,12 +793,16 @@ class FFmpegManager:
                     f"🔄 检测到视频比例 {original_ratio:.4f} 在1:1和16:9之间，顺时针旋转90度")
 
                 # 创建临时文件
-                temp_rotated_path = Path(
-                    TEMP_DIR) / f"rotated_{int(time.time())}_{input_path.name}"
-
-                # 旋转视频
-                input_stream = ffmpeg.input(str(input_path))
-                rotated_stream = input_stream.video.filter(
+                temp_rotated_path = scratch.file(f"rotated_{input_path.name}")
+
+                # 旋转视频 (同时完成截取)
+                input_stream = ffmpeg.input(str(input_path), **input_args)
+                video = input_stream.video
+                if crop:
+                    # 旋转的同时裁掉黑边，后续步骤直接使用裁剪后的画面
+                    video = video.filter('crop', crop.w, crop.h, crop.x, crop.y)
+                    crop = None
+                rotated_stream = video.filter(
                     'transpose', 1)  # 1 = 顺时针旋转90度
 
                 # 保存旋转后的视频
@@ -657,17 +823,14 @@ class FFmpegManager:
                 )
 
                 # 执行命令
-                output.run(
-                    cmd=str(ffmpeg_path),
-                    overwrite_output=True,
-                    capture_stdout=True,
-                    capture_stderr=True
-                )
+                self.run_output(output, int(duration * video_info.get('fps', 25.0)), 'rotate',
+                                temp_rotated_path, (self.variant('rotate'), *source_size))
 
                 logger.info(f"✅ 旋转后的视频已保存到临时文件: {temp_rotated_path}")
 
-                # 用旋转后的文件作为新的输入
+                # 用旋转后的文件作为新的输入 (已截取)
                 input_path = temp_rotated_path
+                input_args = {}
 
                 # 重新获取视频信息
                 video_info = self.get_video_info(input_path)
@@ -693,10 +856,13 @@ class FFmpegManager:
             logger.info(f"🚀 {'使用CUDA加速' if use_cuda else '使用CPU处理'}")
 
             # 创建输入流
-            input_stream = ffmpeg.input(str(input_path))
+            input_stream = ffmpeg.input(str(input_path), **input_args)
 
-            # 将输入流分成两个副本，一个用于背景，一个用于前景
-            split_streams = input_stream.video.filter_multi_output('split')
+            # 将输入流分成两个副本，一个用于背景，一个用于前景 (尚未裁掉的黑边在此裁掉)
+            video = input_stream.video
+            if crop:
+                video = video.filter('crop', crop.w, crop.h, crop.x, crop.y)
+            split_streams = video.filter_multi_output('split')
 
             # 背景流: 放大以填充整个目标区域，然后模糊
             bg = (
@@ -713,50 +879,19 @@ class FFmpegManager:
                 orig_w, orig_h,
                 original_ratio,
                 target_width,
-                target_height
+                target_height,
+                video_info.get('fps', 25.0),
+                scratch,
+                duration,
+                size=source_size
             )
 
             # 合成最终视频
             output_video = bg.overlay(fg_processed)
 
             # 根据CUDA支持选择编码器
-            output_args = {}
-            if use_cuda:
-                logger.info("⚡ 启用NVIDIA GPU硬件加速编码")
-                output_args.update({
-                    'c:v': 'h264_nvenc',
-                    'preset': 'p7',
-                    'profile:v': 'main',
-                    'b:v': '8M',
-                    'maxrate': '10M',
-                    'bufsize': '16M',
-                    'rc': 'vbr_hq',
-                })
-            else:
-                output_args.update({
-                    'c:v': 'libx264',
-                    'preset': 'slow',
-                    'crf': '23',
-                    'movflags': '+faststart'
-                })
-
-            # 仅当有音频流时才添加音频参数
-            if has_audio:
-                # 检查音频编解码器是否支持
-                audio_codec = video_info.get('audio_codec', '')
-                if audio_codec in ['aac', 'mp3', 'opus', 'ac3']:
-                    # 保留原始音频
-                    output_args.update({
-                        'c:a': 'copy'
-                    })
-                    logger.info("🔊 保留原始音频流 (直接复制)")
-                else:
-                    # 重新编码为AAC
-                    output_args.update({
-                        'c:a': 'aac',
-                        'b:a': '128k'
-                    })
-                    logger.info("🔊 重新编码音频为AAC格式")
+            output_args = self.build_output_args(
+                use_cuda, has_audio, video_info.get('audio_codec', ''))
 
             logger.info(f"⚙️ 构建最终FFmpeg命令...")
             start_time = time.time()
@@ -769,12 +904,8 @@ class FFmpegManager:
 
             # 执行命令
             logger.info("🚀 开始视频最终合成...")
-            output.run(
-                cmd=str(ffmpeg_path),
-                overwrite_output=True,
-                capture_stdout=True,
-                capture_stderr=True
-            )
+            self.run_output(output, int(duration * video_info.get('fps', 25.0)), 'final_encode',
+                            output_path, (self.variant('final_encode', use_cuda), *source_size))
 
             elapsed_time = time.time() - start_time
 
@@ -791,14 +922,6 @@ class FFmpegManager:
                 logger.error(f"❌ 输出文件未创建: {output_path}")
                 return False
 
-            # 清理最终使用的临时文件
-            if 'temp_fg_path' in locals() and temp_fg_path.exists():
-                try:
-                    temp_fg_path.unlink()
-                    logger.debug(f"🧹 已清理最终临时文件: {temp_fg_path}")
-                except Exception as e:
-                    logger.warning(f"⚠️ 清理最终临时文件失败 {temp_fg_path}: {str(e)}")
-
             return True
 
         except ffmpeg.Error as e:
@@ -813,23 +936,9 @@ class FFmpegManager:
             logger.exception("详细错误信息:")
             return False
         finally:
-            # 清理临时截取文件
-            if temp_trimmed_path and temp_trimmed_path.exists():
-                try:
-                    temp_trimmed_path.unlink()
-                    logger.debug(f"🧹 已清理临时截取文件: {temp_trimmed_path}")
-                except Exception as e:
-                    logger.warning(
-                        f"⚠️ 清理临时截取文件失败 {temp_trimmed_path}: {str(e)}")
-
-            # 清理临时旋转文件（如果有）
-            if temp_rotated_path and temp_rotated_path.exists():
-                try:
-                    temp_rotated_path.unlink()
-                    logger.debug(f"🧹 已清理临时旋转文件: {temp_rotated_path}")
-                except Exception as e:
-                    logger.warning(
-                        f"⚠️ 清理临时旋转文件失败 {temp_rotated_path}: {str(e)}")
+            # 释放本任务的临时目录 (截取、旋转、前景等中间文件)
+            scratch.release()
+            logger.debug(f"🧹 已清理任务临时目录: {scratch.name}")
 
 
 # 全局FFmpeg管理器实例
@@ -887,27 +996,19 @@ def setup_environment() -> None:
     logger.info(f"📁 确保临时目录存在: {TEMP_DIR}")
 
 
-def get_video_files() -> List[Path]:
+def iter_video_files() -> Iterator[Path]:
     """
-    获取当前目录下所有视频文件
-    
-    Returns:
-        List[Path]: 视频文件路径列表
-    """
-    current_dir = Path.cwd()
-    video_files = []
+    逐个产出当前目录下的视频文件 (跳过空文件)
 
-    for ext in VIDEO_EXTENSIONS:
-        for file in current_dir.glob(f"*{ext}"):
-            if file.is_file() and file.stat().st_size > 0:  # 确保文件不为空
-                video_files.append(file)
+    边遍历边产出，调用方拿到一个文件就可以提交任务；
+    元数据由各任务自己探测 (命中缓存时不启动 ffprobe)，与目录遍历同时进行
 
-    logger.info(f"🎬 找到 {len(video_files)} 个视频文件:")
-    for file in video_files:
-        size_mb = file.stat().st_size / (1024 * 1024)
-        logger.info(f"  - {file.name} ({size_mb:.2f} MB)")
-
-    return video_files
+    Yields:
+        Path: 视频文件路径
+    """
+    for file in iter_videos(Path.cwd(), VIDEO_EXTENSIONS, min_size=1):
+        logger.info(f"🎬 发现视频: {file.name}")
+        yield file
 
 
 def is_target_ratio(ratio: float) -> bool:
@@ -960,38 +1061,13 @@ def calculate_target_resolution(original_width: int, original_height: int, origi
     return target_width, target_height
 
 
-def estimate_vram_usage(width: int, height: int, duration: float, fps: float) -> int:
-    """
-    估算处理视频所需的VRAM
-    
-    Args:
-        width: 视频宽度
-        height: 视频高度
-        duration: 视频时长(秒)
-        fps: 帧率
-    
-    Returns:
-        int: 估算的VRAM使用量(字节)
-    """
-    # 估算每帧内存使用 (RGB格式)
-    bytes_per_frame = width * height * 3
-    # 估算处理所需帧数 (通常是缓冲2秒)
-    frames_needed = min(60, int(fps * 2))  # 最多60帧
-    # 总估算 (2倍额外开销)
-    estimated_vram = bytes_per_frame * frames_needed * 2
-
-    logger.debug(f"📊 估算VRAM使用: {estimated_vram/(1024*1024):.2f} MB "
-                 f"(分辨率: {width}x{height}, 缓冲帧数: {frames_needed})")
-
-    return estimated_vram
-
-
-def process_single_video(input_path: Path) -> bool:
+def process_single_video(input_path: Path, two_step: bool = False) -> bool:
     """
     处理单个视频文件的主函数
     
     Args:
         input_path: 输入视频文件路径
+        two_step: 是否强制使用双步 ProRes 中间文件方案
     
     Returns:
         bool: 处理是否成功
@@ -1029,64 +1105,78 @@ def process_single_video(input_path: Path) -> bool:
     # 5-6. 处理视频并导出
     output_path = Path(OUTPUT_DIR) / input_path.name
 
-    # 使用全局已检测的CUDA支持状态
+    # 使用全局已检测的CUDA支持状态 (NVENC 会话数由调度器限流，
+    # 内存占用由 process_all_videos 按实测记录做准入)
     use_cuda = ffmpeg_manager.cuda_support
 
-    # 估算VRAM使用
-    fps = video_info.get('fps', 30.0)
-    estimated_vram = estimate_vram_usage(
-        video_info['width'],
-        video_info['height'],
-        duration,
-        fps
-    )
-
-    if use_cuda and estimated_vram > MAX_VRAM_USAGE:
-        logger.warning(f"⚠️ 估算VRAM使用 ({estimated_vram/(1024*1024*1024):.2f}GB) "
-                       f"超过限制 ({MAX_VRAM_USAGE/(1024*1024*1024):.2f}GB)")
-        logger.warning("⚠️ 禁用CUDA加速以避免显存溢出")
-        use_cuda = False
-
     return ffmpeg_manager.process_video(
         input_path,
         output_path,
         target_width,
         target_height,
-        use_cuda
+        use_cuda,
+        two_step
     )
 
 
-def process_all_videos() -> None:
+def process_all_videos(max_workers: Optional[int] = None, two_step: bool = False,
+                       mem_budget: Optional[float] = None) -> None:
     """
     处理所有视频文件
+
+    Args:
+        max_workers: 同时处理的视频数，None 为按编码器自动计算
+            (每个任务的中间文件在独立的临时目录中，可安全并发)
+        two_step: 是否强制使用双步 ProRes 中间文件方案
+        mem_budget: 并发任务的内存预算 (MB)，None 为可用内存的 80%，0 为不限
     """
     logger.info("🚀 开始处理所有视频文件")
 
-    # 获取所有视频文件
-    video_files = get_video_files()
-
-    if not video_files:
-        logger.warning("⚠️ 未找到任何视频文件")
-        return
+    # 最终编码器由 process_single_video 决定，此处按检测结果占用对应的并发名额
+    encoder = 'h264_nvenc' if ffmpeg_manager.cuda_support else 'libx264'
 
-    # 处理每个视频文件
-    success_count = 0
-    total_count = len(video_files)
+    # 按各阶段历史实测的内存 / CPU 占用预测每个视频的需求，放得下时才开始
+    # (ProRes 4444 前景等阶段可能占用数 GB，并发时不再把机器推进 swap)
+    ffmpeg_manager.resources = ResourceModel()
+    probe_cache = get_probe_cache()
+    ffprobe_path = ffmpeg_manager.get_component_path('ffprobe')
 
-    for i, video_file in enumerate(video_files, 1):
+    def predict(video_file: Path) -> Demand:
+        try:
+            stream = video_stream(probe_cache.probe(video_file, ffprobe_path)) or {}
+            width, height = int(stream.get('width', 0)), int(stream.get('height', 0))
+        except Exception:
+            width = height = 0  # 探测失败时按默认值预测，任务内会再报告错误
+        return ffmpeg_manager.predict_demand(width, height, ffmpeg_manager.cuda_support,
+                                             two_step)
+
+    def run_job(job, video_file: Path, index: int) -> bool:
         logger.info(f"\n{'='*80}")
-        logger.info(f"🔄 处理进度: {i}/{total_count}")
+        logger.info(f"🔄 处理第 {index} 个视频: {video_file.name}")
 
         try:
             # 处理视频
-            if process_single_video(video_file):
-                success_count += 1
-            else:
-                logger.error(f"❌ 处理失败: {video_file.name}")
+            with scheduler.encoder_slot(encoder):
+                if process_single_video(video_file, two_step):
+                    return True
+            logger.error(f"❌ 处理失败: {video_file.name}")
 
         except Exception as e:
             logger.error(f"❌ 处理 {video_file.name} 时发生未预期错误: {str(e)}")
             logger.exception("详细错误信息:")
+        return False
+
+    # 边遍历目录边提交任务，第一个视频不必等整个目录扫描完
+    total_count = 0
+    with JobScheduler(max_workers=max_workers, admission=Admission(mem_budget)) as scheduler:
+        for total_count, video_file in enumerate(iter_video_files(), 1):
+            scheduler.submit(video_file.name, run_job, video_file, total_count,
+                             demand=predict(video_file))
+        success_count = sum(1 for ok in scheduler.wait() if ok)
+
+    if not total_count:
+        logger.warning("⚠️ 未找到任何视频文件")
+        return
 
     # 总结
     logger.info(f"\n{'='*80}")
@@ -1094,13 +1184,12 @@ def process_all_videos() -> None:
     logger.info(f"✅ 成功处理: {success_count}/{total_count} 个视频")
     logger.info(f"📁 输出目录: {os.path.abspath(OUTPUT_DIR)}")
 
-    # 最终清理临时目录
-    try:
-        if os.path.exists(TEMP_DIR):
-            shutil.rmtree(TEMP_DIR)
-            logger.info(f"🧹 最终清理临时目录: {TEMP_DIR}")
-    except Exception as e:
-        logger.warning(f"⚠️ 最终清理临时目录时出错: {str(e)}")
+    # 各任务的临时目录已随任务释放，这里只清理仍未释放的 (异常退出的任务)
+    ffmpeg_manager.scratch.close()
+
+    # 临时截取/旋转文件已删除，同步清掉它们的元数据缓存
+    probe_cache.prune()
+    logger.info(f"📊 元数据缓存: 命中 {probe_cache.hits} 次, 调用 ffprobe {probe_cache.spawns} 次")
 
     if success_count < total_count:
         logger.warning("⚠️ 部分视频处理失败，请查看日志了解详情")
@@ -1108,26 +1197,40 @@ def process_all_videos() -> None:
         logger.info("🎉 所有视频处理成功！")
 
     logger.info("✅ 所有视频处理完成!")
+    finish_tracing(logger)
 
 
-def main() -> None:
+def main(max_workers: Optional[int] = None, two_step: bool = False,
+         shm_budget_mb: int = 0, trace: Optional[str] = None,
+         mem_budget: Optional[float] = None) -> None:
     """
     主函数
+
+    Args:
+        max_workers: 同时处理的视频数
+        two_step: 是否强制使用双步 ProRes 中间文件方案
+        shm_budget_mb: 大于 0 时中间文件优先放在 /dev/shm，最多占用这么多 MB
+        trace: 开启分阶段追踪，批次结束时把 Chrome trace 写入此文件
+        mem_budget: 并发任务的内存预算 (MB)，None 为可用内存的 80%，0 为不限
     """
+    if trace:
+        enable_tracing(trace)
+    if shm_budget_mb > 0:
+        ffmpeg_manager.scratch = ScratchPool(TEMP_DIR, use_shm=True,
+                                             shm_budget=shm_budget_mb << 20)
     try:
         # 设置环境
         setup_environment()
 
         # 处理所有视频
-        process_all_videos()
+        process_all_videos(max_workers, two_step, mem_budget)
 
     except KeyboardInterrupt:
         logger.info("\n🛑 操作被用户中断")
-        # 清理临时文件
+        # 清理本进程的临时目录
         try:
-            if os.path.exists(TEMP_DIR):
-                shutil.rmtree(TEMP_DIR)
-                logger.info(f"🧹 中断时清理临时目录: {TEMP_DIR}")
+            ffmpeg_manager.scratch.close()
+            logger.info(f"🧹 中断时清理临时目录: {TEMP_DIR}")
         except Exception as e:
             logger.warning(f"⚠️ 中断时清理临时目录出错: {str(e)}")
         sys.exit(1)
@@ -1135,13 +1238,24 @@ def main() -> None:
         logger.exception(f"💥 严重错误: {str(e)}")
         # 尝试清理临时文件
         try:
-            if os.path.exists(TEMP_DIR):
-                shutil.rmtree(TEMP_DIR)
-                logger.info(f"🧹 错误时清理临时目录: {TEMP_DIR}")
+            ffmpeg_manager.scratch.close()
+            logger.info(f"🧹 错误时清理临时目录: {TEMP_DIR}")
         except Exception as cleanup_e:
             logger.warning(f"⚠️ 错误时清理临时目录出错: {str(cleanup_e)}")
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="视频自动处理程序 (前景羽化 + 背景模糊)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="同时处理的视频数 (默认按编码器并发上限自动计算)")
+    parser.add_argument('--two-step', action='store_true',
+                        help="使用双步 ProRes 中间文件方案 (默认单滤镜图流式处理)")
+    parser.add_argument('--shm', type=int, nargs='?', const=2048, default=0, metavar='MB',
+                        help="双步方案的中间文件优先放在 /dev/shm，最多占用 MB (默认 2048)")
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help="记录各阶段耗时，结束时输出汇总并写出 Chrome trace JSON")
+    parser.add_argument('--mem-budget', type=int, default=None, metavar='MB',
+                        help="并发任务的内存预算 (默认为可用内存的 80%%，0 为不限)")
+    args = parser.parse_args()
+    main(args.jobs, args.two_step, args.shm, args.trace, args.mem_budget)
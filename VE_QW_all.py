@@ -1,100 +1,114 @@
 import os
-import subprocess
-import json
 import logging
-import re
+import argparse
 from tqdm import tqdm
 
+from ve_cache import get_probe_cache, video_stream
+from ve_encoders import encoder_args, global_args, pick_encoder, upload_outputs
+from ve_locate import locate_ffmpeg
+from ve_filtergraph import FAST_BG_FACTOR, WallpaperLayout, build_graph
+from ve_progress import estimate_total_frames
+from ve_supervisor import run_ffmpeg
+from ve_trace import enable_tracing, finish_tracing, span
+
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - [%(levelname)s] - %(message)s')
 
 
 class VideoWallpaperPerfectFeatherEngine:
-    def __init__(self, diag_file='ffmpeg_full_diagnostics.json'):
+    def __init__(self, diag_file='ffmpeg_full_diagnostics.json', bg_downscale=1):
+        self.bg_downscale = bg_downscale  # >1 時背景先縮小再模糊 (快速背景)
+        self.encoder = 'h264_nvenc'  # run() 中按實際探測結果替換
         self.ffmpeg_path = "ffmpeg.exe"
         self.ffprobe_path = "ffprobe.exe"
-        if os.path.exists(diag_file):
-            with open(diag_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.ffmpeg_path = data['components']['ffmpeg']['path']
-                self.ffprobe_path = data['components']['ffprobe']['path']
+        # 診斷文件優先, 其次 ./ffmpeg/bin、PATH、限深掃描 (結果緩存)
+        paths = locate_ffmpeg(os.getcwd(), diag_file=diag_file)
+        if paths.ffmpeg:
+            self.ffmpeg_path, self.ffprobe_path = paths.ffmpeg, paths.ffprobe
 
     def get_video_meta(self, path):
         try:
-            cmd = [self.ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
-                   '-show_entries', 'stream=width,height,nb_frames', '-of', 'json', path]
-            res = subprocess.check_output(cmd).decode('utf-8')
-            v_data = json.loads(res)['streams'][0]
-            frames = v_data.get('nb_frames')
-            return int(v_data['width']), int(v_data['height']), int(frames) if frames and frames != 'N/A' else 0
+            probe = get_probe_cache().probe(path, self.ffprobe_path)
+            v_data = video_stream(probe)
+            frames = estimate_total_frames(path, probe, self.ffprobe_path)
+            return int(v_data['width']), int(v_data['height']), frames
         except:
             return None
 
-    def build_cmd(self, input_path, out_path, rotate, w, h, target_h):
-        # 數值校準
-        sw, sh, sth = (w//2)*2, (h//2)*2, (target_h//2)*2
-        trans = "transpose=1" if rotate else "copy"
-
-        # 濾鏡邏輯重構：
-        # 1. 將前景縮放後的結果命名為 [fg_main]
-        # 2. 根據 [fg_main] 的尺寸動態生成遮罩，確保 100% 對齊
-        # 3. 強制使用 yuva420p 像素格式以保留 Alpha 羽化通道
-        filters = (
-            f"[0:v]{trans},setsar=1[raw];"
-            f"[raw]split=2[bg_src][fg_src];"
-            # 背景層：強制填充畫布並極度模糊
-            f"[bg_src]scale={sw}:{sth}:force_original_aspect_ratio=increase,crop={sw}:{sth},gblur=sigma=20[bg];"
-            # 前景層：保持比例
-            f"[fg_src]scale={sw}:{sh}:force_original_aspect_ratio=decrease,format=yuva420p[fg_main];"
-            # 動態遮罩：直接利用 fg_main 的尺寸 (iw, ih)
-            f"color=c=black:s={sw}x{sh}[m_temp];"
-            f"[m_temp]scale=iw:ih,drawbox=x=20:y=20:w=iw-40:h=ih-40:t=fill:c=white,boxblur=50:2,format=gray[mask_final];"
-            # 合併羽化：前景 + 遮罩
-            f"[fg_main][mask_final]alphamerge[fg_feathered];"
-            # 疊加：在 overlay 中開啟 format=auto 以支援透明度渲染
-            f"[bg][fg_feathered]overlay=x=(W-w)/2:y=(H-h)/2:shortest=1:format=auto,format=yuv420p[outv]"
-        )
+    def build_cmd(self, input_path, out_path, layout):
+        # 濾鏡邏輯 (ve_filtergraph, inset 風格):
+        # 1. 前景縮放後動態生成內縮白框遮罩，確保 100% 對齊
+        # 2. 強制使用 yuva420p 像素格式以保留 Alpha 羽化通道
+        # 3. 在 overlay 中開啟 format=auto 以支援透明度渲染
+        graph = build_graph(layout)
+        filters, labels = upload_outputs(graph.graph, graph.outputs, self.encoder)
+        if self.encoder == 'h264_nvenc':
+            video_args = ['-c:v', 'h264_nvenc', '-preset', 'p4', '-tune', 'hq', '-b:v', '10M']
+        else:
+            video_args = encoder_args(self.encoder)
 
         return [
             self.ffmpeg_path, '-y', '-progress', 'pipe:1', '-nostats', '-loglevel', 'error',
-            '-i', input_path,
+            *global_args(self.encoder), '-i', input_path,
             '-filter_complex', filters,
-            '-map', '[outv]',
-            '-c:v', 'h264_nvenc', '-preset', 'p4', '-tune', 'hq', '-b:v', '10M',
+            '-map', labels[0],
+            *video_args,
             *(['-map', '0:a?', '-c:a', 'copy']),
             out_path
         ]
 
     def run(self):
+        # 編碼器能力只探測一次 (按 ffmpeg 文件緩存), 沒有可用顯卡時直接用 CPU
+        self.encoder = pick_encoder(self.ffmpeg_path)
+        logging.info(f"編碼器: {self.encoder}")
         files = [f for f in os.listdir(
             '.') if f.lower().endswith(('.mp4', '.mov'))]
         for f in files:
-            meta = self.get_video_meta(f)
+            with span('probe', file=f):
+                meta = self.get_video_meta(f)
             if not meta:
                 continue
             ow, oh, total_f = meta
             rotate = ow > oh
-            w, h = (oh, ow) if rotate else (ow, oh)
 
             for label, ratio in [('9x20', 9/20), ('5x11', 5/11)]:
-                th = int(w / ratio)
                 os.makedirs(f"output/{label}", exist_ok=True)
                 out = f"output/{label}/{f}"
-                cmd = self.build_cmd(os.path.abspath(f), out, rotate, w, h, th)
+                layout = WallpaperLayout(ow, oh, rotate=rotate, ratio=ratio,
+                                         feather=20, feather_style='inset',
+                                         bg_downscale=self.bg_downscale)
+                cmd = self.build_cmd(os.path.abspath(f), out, layout)
 
                 print(f"\n🚀 正在渲染 (羽化增強版): {f} -> {label}")
                 with tqdm(total=total_f, unit='f') as pbar:
-                    proc = subprocess.Popen(
-                        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
                     last_f = 0
-                    for line in proc.stdout:
-                        m = re.search(r'frame=(\d+)', line)
-                        if m:
-                            curr_f = int(m.group(1))
-                            pbar.update(curr_f - last_f)
-                            last_f = curr_f
-                    proc.wait()
+
+                    def on_progress(snap):
+                        nonlocal last_f
+                        pbar.update(snap.frame - last_f)
+                        pbar.set_postfix_str(snap.describe(), refresh=False)
+                        last_f = snap.frame
+
+                    with span('encode', file=f, ratio=label) as sp:
+                        result = run_ffmpeg(cmd, total_f, on_progress)
+                        sp.status = result.returncode
+                        sp.output(out)
+                if result.stalled:
+                    logging.error(f"FFmpeg 卡滯已強制結束: {f} -> {label}")
+                elif not result.ok:
+                    logging.error(
+                        f"FFmpeg 錯誤 (返回值 {result.returncode}):\n{result.stderr_text()}")
+        finish_tracing(logging.getLogger())
 
 
 if __name__ == "__main__":
-    VideoWallpaperPerfectFeatherEngine().run()
+    parser = argparse.ArgumentParser(description="批量製作羽化豎屏壁紙")
+    parser.add_argument('--fast-bg', type=int, nargs='?', const=FAST_BG_FACTOR,
+                        default=1, metavar='N',
+                        help=f"快速背景: 背景縮小到 1/N 再模糊 (不填 N 時為 {FAST_BG_FACTOR})")
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help="記錄各階段耗時, 結束時輸出匯總並寫出 Chrome trace JSON")
+    args = parser.parse_args()
+    if args.trace:
+        enable_tracing(args.trace)
+    VideoWallpaperPerfectFeatherEngine(bg_downscale=args.fast_bg).run()
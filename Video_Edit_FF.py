@@ -27,11 +27,20 @@ import subprocess
 import sys
 import json
 import math
-import glob
 import shlex
 import logging
+import time
+import argparse
 from pathlib import Path
 
+from ve_cache import get_probe_cache, video_stream
+from ve_discover import iter_videos
+from ve_filtergraph import FAST_BG_FACTOR, WallpaperLayout, build_graph
+from ve_progress import estimate_total_frames
+from ve_scheduler import JobScheduler
+from ve_supervisor import run_ffmpeg
+from ve_trace import enable_tracing, finish_tracing, span
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -43,6 +52,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+PROGRESS_LOG_INTERVAL = 5.0  # 进度日志的最小间隔 (秒)
+
 
 def check_ffmpeg():
     """检查ffmpeg和ffprobe是否可用"""
@@ -60,18 +71,11 @@ def check_ffmpeg():
 def get_video_info(file_path):
     """获取视频信息，包括分辨率和时长"""
     try:
-        cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height,duration',
-            '-of', 'json',
-            file_path
-        ]
-        result = subprocess.run(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-        info = json.loads(result.stdout)
-        stream_info = info['streams'][0]
+        # 未变化的文件直接命中 .ve_cache 中的元数据缓存
+        stream_info = video_stream(get_probe_cache().probe(file_path, 'ffprobe'))
+        if stream_info is None:
+            logger.error(f"未找到视频流 '{file_path}'")
+            return None
         return {
             'width': int(stream_info['width']),
             'height': int(stream_info['height']),
@@ -93,41 +97,25 @@ def is_valid_aspect_ratio(width, height):
     return (abs(ratio - target_ratio_9_16) < tolerance) or (abs(ratio - target_ratio_16_9) < tolerance)
 
 
-def process_video(input_path, output_path, width, height):
-    """处理不符合比例的视频"""
+def process_video(input_path, output_path, width, height, bg_downscale=1):
+    """处理不符合比例的视频 (bg_downscale > 1 时使用快速背景模糊)"""
     try:
-        # 计算比例
-        ratio = width / height
-        target_ratio = 9 / 16  # 9:16比例
-
-        # 确定新画布尺寸
-        if ratio > target_ratio:
-            # 宽度为主
-            new_width = width
-            new_height = int(width / target_ratio)
-        else:
-            # 高度为主
-            new_height = height
-            new_width = int(height * target_ratio)
-
-        # 确保尺寸为偶数 (FFmpeg要求)
-        new_width = new_width if new_width % 2 == 0 else new_width + 1
-        new_height = new_height if new_height % 2 == 0 else new_height + 1
-
-        # 构建FFmpeg命令
-        # 重新设计滤镜链:
+        # 画布: 9:16，宽度为主或高度为主由 ve_filtergraph 按比例计算 (contain)
+        # 滤镜链:
         # 1. 背景层(轨道01)放大并模糊
         # 2. 前景层(轨道02)保持原比例，不强制缩放，直接居中放置
+        layout = WallpaperLayout(width, height, ratio=9 / 16, feather=0, fit='contain',
+                                 bg_downscale=bg_downscale)
+        graph = build_graph(layout)
+
+        # 构建FFmpeg命令 (进度从 stdout 的 -progress 块读取)
         cmd = [
             'ffmpeg',
             '-y',  # 覆盖输出文件
+            '-progress', 'pipe:1', '-nostats',
             '-i', input_path,
-            '-filter_complex',
-            f'[0:v]scale={new_width}:{new_height}:force_original_aspect_ratio=increase,crop={new_width}:{new_height}[bg_raw];'
-            f'[bg_raw]gblur=sigma=20[bg];'
-            f'[0:v]scale=w={new_width}:h={new_height}:force_original_aspect_ratio=decrease[fg];'
-            f'[bg][fg]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)/2[out]',
-            '-map', '[out]',
+            '-filter_complex', graph.graph,
+            '-map', graph.outputs[0],
             '-map', '0:a?',  # 如果有音频则复制
             '-c:v', 'libx264',
             '-preset', 'medium',
@@ -139,28 +127,24 @@ def process_video(input_path, output_path, width, height):
 
         logger.info(f"执行命令: {' '.join([shlex.quote(arg) for arg in cmd])}")
 
-        # 执行命令
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-
-        # 读取stderr以显示进度
-        while True:
-            line = process.stderr.readline()
-            if not line and process.poll() is not None:
-                break
-            if line:
-                if "time=" in line:
-                    logger.info(
-                        f"处理中: {os.path.basename(input_path)} - {line.strip()}")
+        # 执行命令: 读线程同时排空 stdout / stderr，stderr 只保留末尾用于报错
+        name = os.path.basename(input_path)
+        last_log = 0.0
+
+        def on_progress(snap):
+            nonlocal last_log
+            now = time.monotonic()
+            if now - last_log >= PROGRESS_LOG_INTERVAL or snap.finished:
+                last_log = now
+                logger.info(f"处理中: {name} - 第 {snap.frame} 帧 "
+                            f"({snap.percent}%) {snap.describe()}")
+
+        result = run_ffmpeg(cmd, estimate_total_frames(input_path), on_progress)
 
         # 检查返回码
-        if process.returncode != 0:
-            stdout, stderr = process.communicate()
-            logger.error(f"FFmpeg处理失败 '{input_path}':\n{stderr}")
+        if not result.ok:
+            reason = "卡滞已强制结束" if result.stalled else f"返回值 {result.returncode}"
+            logger.error(f"FFmpeg处理失败 '{input_path}' ({reason}):\n{result.stderr_text()}")
             return False
 
         logger.info(f"成功处理: '{input_path}' -> '{output_path}'")
@@ -170,9 +154,13 @@ def process_video(input_path, output_path, width, height):
         return False
 
 
-def main():
-    """主函数"""
+def main(max_workers=None, bg_downscale=1, recursive=False, trace=None):
+    """主函数，max_workers 为同时处理的视频数 (默认按 CPU 核心数计算)，
+    recursive 为 True 时同时处理子目录中的视频 (输出保持相对目录结构)，
+    trace 为文件路径时记录各阶段耗时并写出 Chrome trace"""
     logger.info("开始视频处理...")
+    if trace:
+        enable_tracing(trace)
 
     # 检查FFmpeg
     if not check_ffmpeg():
@@ -191,34 +179,17 @@ def main():
     video_extensions = ['.mp4', '.avi', '.mov',
                         '.mkv', '.flv', '.wmv', '.webm']
 
-    # 获取所有视频文件
-    video_files = []
-    for ext in video_extensions:
-        video_files.extend(glob.glob(os.path.join(current_dir, f'*{ext}')))
-        video_files.extend(
-            glob.glob(os.path.join(current_dir, f'*{ext.upper()}')))
-
-    if not video_files:
-        logger.warning("未找到视频文件。支持的格式: " + ", ".join(video_extensions))
-        sys.exit(0)
-
-    logger.info(f"找到 {len(video_files)} 个视频文件进行处理")
-
-    processed_count = 0
-    skipped_count = 0
-    error_count = 0
-
-    # 处理每个视频文件
-    for video_file in video_files:
+    def process_job(job, video_file):
+        """调度器任务：处理单个视频文件，返回 'processed' / 'skipped' / 'error'"""
         file_name = os.path.basename(video_file)
         logger.info(f"处理文件: {file_name}")
 
         # 获取视频信息
-        video_info = get_video_info(video_file)
+        with span('probe', file=file_name):
+            video_info = get_video_info(video_file)
         if not video_info:
             logger.error(f"无法获取视频信息: {file_name}")
-            error_count += 1
-            continue
+            return 'error'
 
         width = video_info['width']
         height = video_info['height']
@@ -227,17 +198,35 @@ def main():
         # 检查比例
         if is_valid_aspect_ratio(width, height):
             logger.info(f"视频 '{file_name}' 已符合9:16或16:9比例，跳过处理")
-            skipped_count += 1
-            continue
-
-        # 构建输出路径
-        output_file = os.path.join(output_dir, file_name)
-
-        # 处理视频
-        if process_video(video_file, output_file, width, height):
-            processed_count += 1
-        else:
-            error_count += 1
+            return 'skipped'
+
+        # 构建输出路径 (递归模式下保持相对目录结构)
+        output_file = os.path.join(output_dir, os.path.relpath(video_file, current_dir))
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+        # 处理视频 (libx264，占用 CPU 编码并发名额)
+        with scheduler.encoder_slot('libx264'), span('encode', file=file_name) as sp:
+            ok = process_video(video_file, output_file, width, height, bg_downscale)
+            sp.status = 'ok' if ok else 'failed'
+            sp.output(output_file)
+        return 'processed' if ok else 'error'
+
+    # 边遍历目录边提交任务，第一个视频不必等整个目录扫描完
+    with JobScheduler(max_workers=max_workers) as scheduler:
+        logger.info(f"并发任务数: {scheduler.max_workers}")
+        found = 0
+        for video_file in iter_videos(current_dir, video_extensions, recursive=recursive):
+            scheduler.submit(video_file.name, process_job, str(video_file))
+            found += 1
+        if not found:
+            logger.warning("未找到视频文件。支持的格式: " + ", ".join(video_extensions))
+            sys.exit(0)
+        logger.info(f"找到 {found} 个视频文件")
+        results = scheduler.wait()
+
+    processed_count = results.count('processed')
+    skipped_count = results.count('skipped')
+    error_count = len(results) - processed_count - skipped_count
 
     # 打印摘要
     logger.info("\n处理完成!")
@@ -245,11 +234,23 @@ def main():
     logger.info(f"已跳过: {skipped_count} 个文件 (符合比例要求)")
     logger.info(f"处理失败: {error_count} 个文件")
     logger.info(f"输出目录: {output_dir}")
+    finish_tracing(logger)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量把视频合成为9:16竖屏 (背景模糊)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="同时处理的视频数 (默认按 CPU 核心数自动计算)")
+    parser.add_argument('--fast-bg', type=int, nargs='?', const=FAST_BG_FACTOR,
+                        default=1, metavar='N',
+                        help=f"快速背景：背景缩小到 1/N 再模糊 (不填 N 时为 {FAST_BG_FACTOR})")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help="同时处理子目录中的视频")
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help="记录各阶段耗时，结束时输出汇总并写出 Chrome trace JSON")
+    args = parser.parse_args()
     try:
-        main()
+        main(args.jobs, args.fast_bg, args.recursive, args.trace)
     except KeyboardInterrupt:
         logger.info("程序被用户中断")
         sys.exit(1)
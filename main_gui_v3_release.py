@@ -1,20 +1,36 @@
 import sys
 import os
-import subprocess
 import json
-import re
 import ctypes
 import time
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from ve_cache import PROBE_WORKERS, get_probe_cache, video_stream
+from ve_discover import iter_videos
+from ve_encoders import (SOFTWARE_FALLBACK, encoder_args, encoder_failed, forget_encoder,
+                         global_args, pick_encoder, upload_outputs)
+from ve_filtergraph import (FAST_BG_FACTOR, WallpaperLayout, build_graph,
+                            build_multi_graph)
+from ve_progress import estimate_total_frames
+from ve_locate import locate_ffmpeg
+from ve_manifest import (RenderManifest, commit_output, discard_output,
+                         params_digest, partial_path, sweep_partials)
+from ve_resources import Admission, ResourceModel
+from ve_scheduler import JobScheduler, default_encoder_limits
+from ve_supervisor import run_ffmpeg
+from ve_trace import finish_tracing, span
+
 # 确保 PyQt6 环境完整
 try:
     from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
-                                 QLineEdit, QPushButton, QProgressBar, QTextEdit,
-                                 QLabel, QFileDialog, QSystemTrayIcon, QMenu, QStyle, QMessageBox)
-    from PyQt6.QtCore import Qt, QThread, pyqtSignal, QEvent, QSize
-    from PyQt6.QtGui import QIcon, QTextCursor, QFont, QPalette, QColor, QAction
+                                 QLineEdit, QPushButton, QProgressBar, QPlainTextEdit,
+                                 QLabel, QFileDialog, QSystemTrayIcon, QMenu, QStyle, QMessageBox,
+                                 QSpinBox, QCheckBox)
+    from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal, QEvent, QSize
+    from PyQt6.QtGui import QIcon, QFont, QPalette, QColor, QAction
 except ImportError:
     print("环境错误：请执行 pip install PyQt6")
     sys.exit(1)
@@ -40,91 +56,275 @@ def get_resource_path(relative_path):
 # 1. 核心处理线程 (含卡死监控与缓冲区修补)
 # ==========================================
 
+# 输出比例 (标签, 宽/高) 与扫描的扩展名
+RATIOS = [('9x20', 9/20), ('5x11', 5/11)]
+VIDEO_EXTS = ('.mp4', '.mov', '.mkv', '.avi', '.wmv')
+
+# 编码参数：启动时探测出最快的可用编码器，运行失败再回退 CPU
+GPU_ARGS = ['-c:v', 'h264_nvenc', '-preset', 'p4', '-rc:v', 'vbr', '-b:v', '10M']
+CPU_ARGS = ['-c:v', 'libx264', '-preset', 'veryfast']
+
+# 界面刷新：每个任务的进度最多每 0.1 秒发送一次，日志区最多保留的行数
+PROGRESS_INTERVAL = 0.1
+LOG_MAX_LINES = 5000
+
 
 class VideoWorker(QThread):
     log_signal = pyqtSignal(str)          # 日志回调
+    job_progress_signal = pyqtSignal(str, object)  # 单任务进度 (名称, ProgressSnapshot；None 表示结束)
     total_progress_signal = pyqtSignal(int)  # 进度条回调
     error_signal = pyqtSignal(str)        # 报错回调
     finished_signal = pyqtSignal()        # 完成回调
 
-    def __init__(self, work_dir):
+    def __init__(self, work_dir, single_pass=True, max_workers=None, fast_bg=False):
         super().__init__()
         self.work_dir = Path(work_dir)
         self.is_running = True
+        self.single_pass = single_pass  # 一次解码同时输出全部比例
+        self.max_workers = max_workers  # 并发任务数，None 为按编码器自动计算
+        # 快速背景：背景缩小后再模糊，最后放大回画布
+        self.bg_downscale = FAST_BG_FACTOR if fast_bg else 1
+        self.scheduler = None
+        self.manifest = None
+        self.encoder = None  # 启动时探测出的首选编码器
+        self.resources = None  # 实测资源占用记录，用于准入控制
+        self.lock = threading.Lock()
+        self.completed_tasks = 0
+        self.total_sub_tasks = 0
         self.ffmpeg_path = None
         self.ffprobe_path = None
 
     def find_ffmpeg(self):
-        """ 搜索当前目录下的 FFmpeg 组件 """
+        """ 定位 FFmpeg 组件 (程序目录 / PATH / 限深扫描，结果缓存) """
         base_path = Path(sys.executable).parent if getattr(
             sys, 'frozen', False) else Path(__file__).parent.resolve()
-        for p in base_path.rglob("*.exe"):
-            if p.name.lower() == "ffmpeg.exe":
-                self.ffmpeg_path = str(p)
-            elif p.name.lower() == "ffprobe.exe":
-                self.ffprobe_path = str(p)
-
-        import shutil
-        if not self.ffmpeg_path:
-            self.ffmpeg_path = shutil.which("ffmpeg")
-        if not self.ffprobe_path:
-            self.ffprobe_path = shutil.which("ffprobe")
-
-    def create_progress_bar_text(self, percent, length=35):
+        paths = locate_ffmpeg(base_path)
+        self.ffmpeg_path, self.ffprobe_path = paths.ffmpeg, paths.ffprobe
+        if paths.ffmpeg:
+            self.log_signal.emit(f">>> FFmpeg: {paths.ffmpeg} ({paths.source})\n")
+
+    @staticmethod
+    def create_progress_bar_text(percent, length=35):
         """ 信息区模拟进度条 """
         filled_len = int(length * percent // 100)
         bar = '█' * filled_len + '░' * (length - filled_len)
         return f"|{bar}| {percent}%"
 
-    def run_ffmpeg_task(self, cmd, total_frames):
-        """ 关键：带看门狗与行缓冲的执行逻辑 """
-        si = subprocess.STARTUPINFO()
-        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-        # 合并 stderr 解决缓冲区卡死
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding='utf-8',
-            errors='ignore',
-            bufsize=1,
-            startupinfo=si
-        )
-
-        last_frame_count = -1
-        last_active_time = time.time()
-
-        while True:
-            if not self.is_running:
-                process.terminate()
-                return False
+    def variant(self, encoder):
+        """ 资源记录的滤镜图变体：输出方式、编码器与背景缩小倍数都会影响内存和 CPU 占用 """
+        mode = 'single' if self.single_pass else 'ratio'
+        return f"gui-{mode}-{encoder}-bg{self.bg_downscale}"
+
+    def run_ffmpeg_task(self, cmd, total_frames, name="", profile=None):
+        """ 由 ve_supervisor 监督执行：读线程排空输出，按实际帧率判定卡死并结束进程树；
+        profile 为 (变体, 宽, 高) 时成功后登记实测资源占用；返回 SupervisedResult """
+        last_emit = 0.0
 
-            line = process.stdout.readline()
-            if not line and process.poll() is not None:
+        def on_progress(snap):
+            # 合并高频进度，避免大量并发任务占满界面线程
+            nonlocal last_emit
+            now = time.monotonic()
+            if now - last_emit >= PROGRESS_INTERVAL or snap.finished:
+                last_emit = now
+                self.job_progress_signal.emit(name, snap)
+
+        try:
+            result = run_ffmpeg(cmd, total_frames, on_progress,
+                                should_stop=lambda: not self.is_running)
+        finally:
+            # 通知界面移除该任务的进度行
+            self.job_progress_signal.emit(name, None)
+
+        if result.stalled:
+            self.log_signal.emit(f"\n[!] 警告：{name} 发现进度卡滞，已强制结束")
+        elif not result.ok and not result.cancelled:
+            self.log_signal.emit(
+                f"\n[!] {name} FFmpeg 返回 {result.returncode}:\n{result.stderr_text(5)}")
+        if result.ok and profile and self.resources:
+            self.resources.record(*profile, result.usage)
+        return result
+
+    @staticmethod
+    def video_args(encoder):
+        """ NVENC / x264 沿用原有参数，其它硬件编码器取 ve_encoders 中的同档参数 """
+        if encoder == 'h264_nvenc':
+            return GPU_ARGS
+        if encoder == 'libx264':
+            return CPU_ARGS
+        return encoder_args(encoder)
+
+    def build_encode_cmd(self, v_path, filter_str, outputs, encoder):
+        """ 一个输入、一个滤镜图、若干 (-map 标签, 输出文件) """
+        filter_str, labels = upload_outputs(
+            filter_str, [label for label, _ in outputs], encoder)
+        cmd = [self.ffmpeg_path, '-y', '-progress', 'pipe:1', '-nostats',
+               *global_args(encoder), '-i', str(v_path), '-filter_complex', filter_str]
+        for label, (_, target_file) in zip(labels, outputs):
+            cmd += ['-map', label, *self.video_args(encoder),
+                    '-map', '0:a?', '-c:a', 'copy', str(target_file)]
+        return cmd
+
+    def output_params(self, layout, encoder):
+        """ 单个输出的参数摘要：滤镜、编码器或其参数变化后旧的完成记录即失效 """
+        return params_digest(build_graph(layout).graph, encoder, self.video_args(encoder))
+
+    def render_outputs(self, v_path, filter_str, outputs, total_f, name, size=None):
+        """ outputs: [(-map 标签, 正式输出, 布局)]；先写临时文件，成功后原子重命名，
+        按实际使用的编码器登记参数摘要 """
+        partials = [(label, partial_path(target)) for label, target, _ in outputs]
+        encoder = self.encode_with_fallback(
+            lambda encoder: self.build_encode_cmd(v_path, filter_str, partials, encoder),
+            total_f, name, size)
+        for (_, target, layout), (_, partial) in zip(outputs, partials):
+            if encoder:
+                commit_output(partial, target)
+                self.manifest.record(target, v_path, self.output_params(layout, encoder),
+                                     encoder)
+            else:
+                discard_output(partial)
+        return bool(encoder)
+
+    def render_single_pass(self, v_path, total_f, pending):
+        """ 解码、旋转一次，split 后在同一进程内写出所有未完成的比例 """
+        graph = build_multi_graph(tuple(layout for _, layout, _ in pending))
+        outputs = [(out, target_file, layout) for out, (_, layout, target_file)
+                   in zip(graph.outputs, pending)]
+        filter_str = graph.graph
+
+        labels = " + ".join(label for label, _, _ in pending)
+        self.log_signal.emit(f"\n[处理] {v_path.name} | 模式: {labels} (单次解码)")
+
+        layout = pending[0][1]
+        success = self.render_outputs(
+            v_path, filter_str, outputs, total_f, v_path.name, (layout.src_w, layout.src_h))
+
+        self.log_signal.emit(f"\n[√] {v_path.name} 全部比例合成完毕")
+        return success
+
+    def encode_with_fallback(self, build_cmd, total_frames, name, size=None):
+        """ 使用探测出的编码器，运行失败再回退 CPU；每次尝试各占对应编码器的并发名额。返回成功的编码器名 """
+        candidates = [self.encoder]
+        if self.encoder != SOFTWARE_FALLBACK:
+            candidates.append(SOFTWARE_FALLBACK)
+        suspect = None
+        for i, encoder in enumerate(candidates):
+            if not self.is_running:
                 break
+            if i:
+                self.log_signal.emit(f"\n[!] {name} {candidates[0]} 模式失败，切换 CPU 安全模式渲染...")
+            with self.scheduler.encoder_slot(encoder):
+                profile = (self.variant(encoder), *size) if size else None
+                with span('encode', file=name, encoder=encoder, attempt=i) as sp:
+                    result = self.run_ffmpeg_task(build_cmd(encoder), total_frames, name, profile)
+                    sp.status = 'ok' if result.ok else 'failed'
+            if result.ok:
+                if suspect:
+                    # 探测缓存认为可用的编码器失败、同一输入 CPU 成功：清掉记录，下次启动重新探测
+                    forget_encoder(self.ffmpeg_path, suspect, work_dir=self.work_dir)
+                return encoder
+            if encoder != SOFTWARE_FALLBACK and encoder_failed(encoder, result):
+                suspect = encoder
+        return None
+
+    def mark_completed(self, count):
+        """ 线程安全地累加已完成子任务并刷新总进度 """
+        with self.lock:
+            self.completed_tasks += count
+            # 目录仍在扫描时总数还会增加
+            pct = int((self.completed_tasks / max(1, self.total_sub_tasks)) * 100)
+        self.total_progress_signal.emit(pct)
+
+    def process_video(self, job, v_path, meta_data):
+        """ 单个视频的调度任务：按预先探测的元数据渲染全部比例 """
+        if not self.is_running:
+            return False
+        with span('video', cat='video', file=v_path.name) as sp:
+            success = self.render_video(job, v_path, meta_data)
+            sp.status = 'ok' if success else 'failed'
+        return success
+
+    def render_video(self, job, v_path, meta_data):
+        """ 按预先探测的元数据渲染全部比例 (跳过清单中已完成的)，返回是否全部成功 """
+        try:
+            raw_w, raw_h = int(meta_data['width']), int(
+                meta_data['height'])
+            total_f = job.total
+
+            # 旋转判定：横屏旋转为竖屏
+            is_landscape = raw_w > raw_h
+
+            # 断点续跑：清单中已完成且源文件、参数均未变化的比例直接跳过
+            pending = []
+            for label, ratio in RATIOS:
+                layout = WallpaperLayout(raw_w, raw_h, rotate=is_landscape, ratio=ratio,
+                                         bg_downscale=self.bg_downscale)
+                output_folder = self.work_dir / "output" / label
+                output_folder.mkdir(parents=True, exist_ok=True)
+                target_file = output_folder / v_path.name
+                # 按本次选用的编码器比较：换用其它编码器或参数变化后重新渲染
+                params = self.output_params(layout, self.encoder)
+                if self.manifest.is_complete(target_file, v_path, params):
+                    self.log_signal.emit(f"\n[跳过] {v_path.name} {label} 已完成")
+                    self.mark_completed(1)
+                else:
+                    pending.append((label, layout, target_file))
+
+            if not pending:
+                return True
+
+            # 单次解码模式：一个 ffmpeg 进程同时写出全部比例
+            if self.single_pass:
+                success = self.render_single_pass(v_path, total_f, pending)
+                self.mark_completed(len(pending))
+                return success
+
+            success = True
+            for label, layout, target_file in pending:
+                if not self.is_running:
+                    return False
+
+                filter_str = build_graph(layout).graph
+
+                self.log_signal.emit(f"\n[处理] {v_path.name} | 模式: {label}")
 
-            if 'frame=' in line:
-                match = re.search(r'frame=\s*(\d+)', line)
-                if match:
-                    current_frame = int(match.group(1))
-                    if current_frame != last_frame_count:
-                        last_frame_count = current_frame
-                        last_active_time = time.time()
-                        if total_frames > 0:
-                            pct = min(
-                                100, int(current_frame * 100 / total_frames))
-                            self.log_signal.emit(
-                                f"\r{self.create_progress_bar_text(pct)}")
-
-            # 看门狗：25 秒进度不动则判定为驱动卡死
-            if time.time() - last_active_time > 25:
-                self.log_signal.emit("\n[!] 警告：发现进度卡滞，正在强制干预...")
-                process.terminate()
-                return False
-
-        return process.returncode == 0
+                success &= self.render_outputs(
+                    v_path, filter_str, [('[outv]', target_file, layout)],
+                    total_f, f"{v_path.name} {label}", (raw_w, raw_h))
+
+                self.log_signal.emit(f"\n[√] {v_path.name} {label} 比例合成完毕")
+                self.mark_completed(1)
+            return success
+
+        except Exception:
+            self.log_signal.emit(
+                f"\n[×] {v_path.name} 处理失败:\n{traceback.format_exc()}")
+            return False
+
+    def queue_video(self, scheduler, v_path):
+        """ 探测一个新发现的视频 (命中缓存时不启动 ffprobe) 并提交渲染任务 """
+        with span('probe', file=v_path.name):
+            try:
+                probe = get_probe_cache(self.work_dir).probe(v_path, self.ffprobe_path)
+            except Exception:
+                probe = {}
+            meta_data = video_stream(probe)
+        if meta_data is None:
+            self.log_signal.emit(f"[×] {v_path.name} 无法读取视频元数据，已跳过\n")
+            self.mark_completed(len(RATIOS))
+            return
+        try:
+            with span('estimate_frames', file=v_path.name):
+                total_f = estimate_total_frames(
+                    v_path, probe, self.ffprobe_path, work_dir=self.work_dir)
+            demand = self.resources.predict(
+                self.variant(self.encoder), int(meta_data['width']), int(meta_data['height']))
+            scheduler.submit(v_path.name, self.process_video, v_path, meta_data,
+                             total=total_f, demand=demand)
+        except Exception:
+            # 在探测线程池中运行，异常不会被取回：这里记录并计入完成数，总进度才能到 100%
+            self.log_signal.emit(
+                f"[×] {v_path.name} 提交任务失败，已跳过:\n{traceback.format_exc()}")
+            self.mark_completed(len(RATIOS))
 
     def run(self):
         try:
@@ -133,95 +333,52 @@ class VideoWorker(QThread):
                 self.error_signal.emit("致命错误：未找到 ffmpeg.exe。")
                 return
 
-            exts = ('.mp4', '.mov', '.mkv', '.avi', '.wmv')
-            videos = [f for f in self.work_dir.iterdir()
-                      if f.suffix.lower() in exts]
-
-            if not videos:
-                self.log_signal.emit(">>> 目录下没有发现任何视频文件。")
-                self.finished_signal.emit()
-                return
-
-            total_sub_tasks = len(videos) * 2
-            completed_tasks = 0
-
-            self.log_signal.emit(f"=== 引擎启动：发现 {len(videos)} 个视频 ===\n")
-
-            for v_path in videos:
-                if not self.is_running:
-                    break
-
-                # 获取元数据
-                si = subprocess.STARTUPINFO()
-                si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                probe_cmd = [self.ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
-                             '-show_entries', 'stream=width,height,nb_frames', '-of', 'json', str(v_path)]
-                meta_data = json.loads(subprocess.check_output(
-                    probe_cmd, startupinfo=si).decode('utf-8'))['streams'][0]
-
-                raw_w, raw_h = int(meta_data['width']), int(
-                    meta_data['height'])
-                total_f = int(meta_data.get('nb_frames', 0))
-
-                # 旋转判定
-                is_landscape = raw_w > raw_h
-                w, h = (raw_h, raw_w) if is_landscape else (raw_w, raw_h)
-
-                for label, ratio in [('9x20', 9/20), ('5x11', 5/11)]:
-                    if not self.is_running:
-                        break
-
-                    target_h = int(w / ratio)
-                    output_folder = self.work_dir / "output" / label
-                    output_folder.mkdir(parents=True, exist_ok=True)
-                    target_file = output_folder / v_path.name
-
-                    # 滤镜参数计算
-                    sw, sh, sth = (w//2)*2, (h//2)*2, (target_h//2)*2
-                    y_off = (sth - sh) // 2
-                    trans = "transpose=1" if is_landscape else "copy"
-
-                    filter_str = (
-                        f"[0:v]{trans},setsar=1[raw];[raw]split=2[bg_s][fg_s];"
-                        f"[bg_s]scale={sw}:{sth}:force_original_aspect_ratio=increase,crop={sw}:{sth},gblur=sigma=20[bg];"
-                        f"color=c=white:s={sw}x{sh}[m_base];[m_base]drawbox=x=0:y=0:w={sw}:h=30:t=fill:c=black,"
-                        f"drawbox=x=0:y={sh-30}:w={sw}:h=30:t=fill:c=black,drawbox=x=0:y=0:w=30:h={sh}:t=fill:c=black,"
-                        f"drawbox=x={sw-30}:y=0:w=30:h={sh}:t=fill:c=black,boxblur=30:1,format=gray[mask];"
-                        f"[fg_s]format=yuva420p[fg_a];[fg_a][mask]alphamerge[fg_f];"
-                        f"[bg][fg_f]overlay=x=0:y={y_off}:shortest=1:format=auto,format=yuv420p[outv]"
-                    )
-
-                    self.log_signal.emit(f"\n[处理] {v_path.name} | 模式: {label}")
-
-                    # 1. 优先 GPU
-                    cmd_gpu = [
-                        self.ffmpeg_path, '-y', '-progress', 'pipe:1', '-i', str(
-                            v_path),
-                        '-filter_complex', filter_str, '-map', '[outv]',
-                        '-c:v', 'h264_nvenc', '-preset', 'p4', '-rc:v', 'vbr', '-b:v', '10M',
-                        '-map', '0:a?', '-c:a', 'copy', str(target_file)
-                    ]
-
-                    success = self.run_ffmpeg_task(cmd_gpu, total_f)
-
-                    if not success:
-                        # 2. 备选 CPU
-                        self.log_signal.emit("\n[!] GPU 模式失败，切换 CPU 安全模式渲染...")
-                        cmd_cpu = [
-                            self.ffmpeg_path, '-y', '-progress', 'pipe:1', '-i', str(
-                                v_path),
-                            '-filter_complex', filter_str, '-map', '[outv]',
-                            '-c:v', 'libx264', '-preset', 'veryfast',
-                            '-map', '0:a?', '-c:a', 'copy', str(target_file)
-                        ]
-                        self.run_ffmpeg_task(cmd_cpu, total_f)
-
-                    self.log_signal.emit("\n[√] 该任务比例合成完毕")
-                    completed_tasks += 1
-                    self.total_progress_signal.emit(
-                        int((completed_tasks / total_sub_tasks) * 100))
-
-            self.log_signal.emit("\n>>> 全部批量视频合成任务已顺利结束！\n")
+            # 编码器能力只探测一次 (按 ffmpeg 文件缓存)，没有可用显卡时直接使用 CPU
+            self.encoder = pick_encoder(self.ffmpeg_path, work_dir=self.work_dir)
+            self.log_signal.emit(f">>> 编码器: {self.encoder}\n")
+
+            self.total_sub_tasks = 0
+            self.completed_tasks = 0
+
+            # 清理上次中断遗留的半成品，载入已完成任务清单
+            output_root = self.work_dir / "output"
+            if output_root.exists():
+                removed = sweep_partials(output_root)
+                if removed:
+                    self.log_signal.emit(f">>> 已清理 {removed} 个未完成的临时输出\n")
+            self.manifest = RenderManifest(self.work_dir)
+            self.resources = ResourceModel(self.work_dir)
+
+            # 多个视频并发渲染，编码器并发数由调度器限流；
+            # 按历史实测的内存 / CPU 占用预测，放得下时才开始下一个
+            admission = Admission()
+            with JobScheduler(max_workers=self.max_workers, admission=admission) as scheduler:
+                self.scheduler = scheduler
+                self.log_signal.emit(f"=== 引擎启动：并发 {scheduler.max_workers} ===\n")
+                # 边遍历目录边探测、提交，第一个视频不必等整个目录扫描完
+                found = 0
+                with ThreadPoolExecutor(max_workers=PROBE_WORKERS,
+                                        thread_name_prefix='discover') as probe_pool:
+                    for v_path in iter_videos(self.work_dir, VIDEO_EXTS,
+                                              should_stop=lambda: not self.is_running):
+                        found += 1
+                        with self.lock:
+                            self.total_sub_tasks += len(RATIOS)
+                        probe_pool.submit(self.queue_video, scheduler, v_path)
+
+                if not found:
+                    self.log_signal.emit(">>> 目录下没有发现任何视频文件。")
+                    self.finished_signal.emit()
+                    return
+                self.log_signal.emit(f">>> 目录扫描完成：共 {found} 个视频\n")
+                scheduler.wait()
+
+            if self.is_running:
+                self.log_signal.emit("\n>>> 全部批量视频合成任务已顺利结束！\n")
+            # 设置了环境变量 VE_TRACE 时输出各阶段耗时汇总
+            summary = finish_tracing()
+            if summary:
+                self.log_signal.emit(f"\n>>> 阶段耗时汇总:\n{summary}\n")
             self.finished_signal.emit()
 
         except Exception:
@@ -256,7 +413,7 @@ class MainWindow(QWidget):
             QPushButton:disabled { background-color: #333333; }
             QProgressBar { border: 1px solid #333; height: 16px; text-align: center; border-radius: 8px; background-color: #1E1E1E; }
             QProgressBar::chunk { background-color: #0078D4; border-radius: 8px; }
-            QTextEdit { 
+            QPlainTextEdit { 
                 background-color: #0A0A0A; 
                 border: 1px solid #222; 
                 color: #DCDCDC;   /* 米白色字体 */
@@ -269,6 +426,14 @@ class MainWindow(QWidget):
         self.setup_tray()
         self.worker = None
 
+        # 各任务最新进度，由定时器统一刷新到界面
+        self.job_snapshots = {}
+        self.jobs_dirty = False
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(int(PROGRESS_INTERVAL * 1000))
+        self.refresh_timer.timeout.connect(self.refresh_jobs)
+        self.refresh_timer.start()
+
     def setup_ui(self):
         """ 构建主界面布局 """
         main_layout = QVBoxLayout()
@@ -289,6 +454,22 @@ class MainWindow(QWidget):
         h_path.addWidget(btn_dir)
         main_layout.addLayout(h_path)
 
+        # 并发任务数 (默认：CPU 任务数 + NVENC 会话数)
+        h_jobs = QHBoxLayout()
+        limits = default_encoder_limits()
+        self.jobs_field = QSpinBox()
+        self.jobs_field.setRange(1, 64)
+        self.jobs_field.setValue(limits['libx264'] + limits['h264_nvenc'])
+        h_jobs.addWidget(QLabel("并发任务:"))
+        h_jobs.addWidget(self.jobs_field)
+        h_jobs.addSpacing(20)
+        self.fast_bg_box = QCheckBox("快速背景模糊")
+        self.fast_bg_box.setToolTip(
+            f"背景缩小到 1/{FAST_BG_FACTOR} 后再模糊，渲染更快，画质差异极小")
+        h_jobs.addWidget(self.fast_bg_box)
+        h_jobs.addStretch()
+        main_layout.addLayout(h_jobs)
+
         # 启动键
         self.btn_run = QPushButton("🚀 启动批量引擎")
         self.btn_run.setFixedHeight(45)
@@ -300,11 +481,21 @@ class MainWindow(QWidget):
         self.progress_all = QProgressBar()
         main_layout.addWidget(self.progress_all)
 
-        # 信息反馈区
+        # 当前任务进度 (每个任务一行)
+        main_layout.addWidget(QLabel("当前任务:"))
+        self.jobs_box = QPlainTextEdit()
+        self.jobs_box.setReadOnly(True)
+        self.jobs_box.setFont(QFont("Consolas", 10))
+        self.jobs_box.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.jobs_box.setMaximumHeight(140)
+        main_layout.addWidget(self.jobs_box)
+
+        # 信息反馈区 (超过上限时自动丢弃最早的行)
         main_layout.addWidget(QLabel("执行详细日志:"))
-        self.info_box = QTextEdit()
+        self.info_box = QPlainTextEdit()
         self.info_box.setReadOnly(True)
         self.info_box.setFont(QFont("Consolas", 10))
+        self.info_box.setMaximumBlockCount(LOG_MAX_LINES)
         main_layout.addWidget(self.info_box)
 
         self.setLayout(main_layout)
@@ -360,10 +551,15 @@ class MainWindow(QWidget):
     def start_engine(self):
         self.btn_run.setEnabled(False)
         self.info_box.clear()
+        self.job_snapshots.clear()
+        self.jobs_dirty = True
         self.progress_all.setValue(0)
 
-        self.worker = VideoWorker(self.path_field.text())
+        self.worker = VideoWorker(
+            self.path_field.text(), max_workers=self.jobs_field.value(),
+            fast_bg=self.fast_bg_box.isChecked())
         self.worker.log_signal.connect(self.log_update)
+        self.worker.job_progress_signal.connect(self.job_update)
         self.worker.total_progress_signal.connect(self.progress_all.setValue)
         self.worker.error_signal.connect(
             lambda e: QMessageBox.critical(self, "运行错误", e))
@@ -372,17 +568,25 @@ class MainWindow(QWidget):
         self.worker.start()
 
     def log_update(self, text):
-        cursor = self.info_box.textCursor()
-        cursor.movePosition(QTextCursor.MoveOperation.End)
-        if text.startswith("\r"):
-            cursor.movePosition(
-                QTextCursor.MoveOperation.StartOfLine, QTextCursor.MoveMode.KeepAnchor)
-            cursor.removeSelectedText()
-            cursor.insertText(text.replace("\r", ""))
+        text = text.strip("\n")
+        if text:
+            self.info_box.appendPlainText(text)
+
+    def job_update(self, name, snap):
+        """ 只记录最新快照，由 refresh_jobs 定时绘制 """
+        if snap is None:
+            self.job_snapshots.pop(name, None)
         else:
-            self.info_box.insertPlainText(text)
-        self.info_box.verticalScrollBar().setValue(
-            self.info_box.verticalScrollBar().maximum())
+            self.job_snapshots[name] = snap
+        self.jobs_dirty = True
+
+    def refresh_jobs(self):
+        if not self.jobs_dirty:
+            return
+        self.jobs_dirty = False
+        lines = [f"{name} {VideoWorker.create_progress_bar_text(snap.percent)} {snap.describe()}"
+                 for name, snap in self.job_snapshots.items()]
+        self.jobs_box.setPlainText("\n".join(lines))
 
     def safe_exit(self):
         """ 确保线程安全关闭 """
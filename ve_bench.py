@@ -0,0 +1,395 @@
+"""
+滤镜图基准测试 (无需真实素材和显卡)
+
+suite  用 lavfi 合成测试片 (testsrc2 / mandelbrot，720p / 1080p / 4K，横竖屏)，
+       逐个运行各引擎的滤镜图 (全部使用 CPU 编码器)，统计帧/秒、耗时、
+       峰值内存与 CPU 占用，以 JSON 输出，可与上一版本的结果对比找出性能回退
+bg     对比原分辨率 gblur 与快速背景 (缩小 -> 模糊 -> 放大) 的速度和 SSIM
+
+用法:
+    python ve_bench.py suite -o bench.json
+    python ve_bench.py suite -r 1080p -v gui feather --baseline old.json
+    python ve_bench.py bg demo.mp4 -f 4 8
+
+合成测试片缓存在 .ve_cache/bench 下，只生成一次。
+峰值内存与 CPU 时间通过 os.wait4 读取 (含子进程)，Windows 下这两项为 null。
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ve_cache import cache_dir, get_probe_cache, no_window_kwargs, video_stream
+from ve_filtergraph import WallpaperLayout, build_graph, build_multi_graph
+
+DEFAULT_SOURCE = "testsrc2=size=1920x1080:rate=30"
+
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080), '4k': (3840, 2160)}
+PATTERNS = ('testsrc2', 'mandelbrot')
+ORIENTATIONS = ('landscape', 'portrait')
+BENCH_FPS = 30
+
+# 与各引擎一致的 CPU 编码参数 (GPU 引擎改用 libx264，保证无显卡也能跑)
+RATIOS = [('9x20', 9/20), ('5x11', 5/11)]
+X264_FAST = ['-c:v', 'libx264', '-preset', 'veryfast']
+X264_FF = ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-c:a', 'aac', '-b:a', '128k']
+
+
+# ==========================================
+# 公共: 运行与资源统计
+# ==========================================
+
+def measure(cmd: List[str], cwd=None) -> Dict[str, Any]:
+    """
+    运行子进程并统计耗时、峰值内存、CPU 时间
+
+    Returns:
+        Dict[str, Any]: wall_s, user_s, sys_s, cpu_percent, peak_rss_mb, returncode, stderr
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, **no_window_kwargs())
+    stderr = proc.stderr.read().decode('utf-8', errors='replace')
+    proc.stderr.close()
+    usage = None
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    else:
+        proc.wait()
+    wall = time.perf_counter() - start
+
+    result = {'wall_s': round(wall, 3), 'user_s': None, 'sys_s': None,
+              'cpu_percent': None, 'peak_rss_mb': None,
+              'returncode': proc.returncode, 'stderr': stderr}
+    if usage is not None:
+        # Linux 下 ru_maxrss 单位为 KB，macOS 为字节
+        rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        result.update(user_s=round(usage.ru_utime, 3), sys_s=round(usage.ru_stime, 3),
+                      cpu_percent=round((usage.ru_utime + usage.ru_stime) / wall * 100, 1),
+                      peak_rss_mb=round(rss, 1))
+    return result
+
+
+def run_ffmpeg(cmd: List[str]) -> Tuple[float, str]:
+    """运行 ffmpeg，返回 (耗时秒数, stderr)"""
+    result = measure(cmd)
+    if result['returncode'] != 0:
+        raise RuntimeError(f"ffmpeg 执行失败:\n{result['stderr'][-2000:]}")
+    return result['wall_s'], result['stderr']
+
+
+def ffmpeg_version(ffmpeg: str) -> str:
+    try:
+        out = subprocess.run([ffmpeg, '-version'], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, **no_window_kwargs()).stdout
+        return out.decode('utf-8', errors='replace').splitlines()[0]
+    except (OSError, IndexError):
+        return 'unknown'
+
+
+# ==========================================
+# suite: 合成素材
+# ==========================================
+
+def synthetic_clip(ffmpeg: str, pattern: str, width: int, height: int,
+                   seconds: float) -> Path:
+    """生成 (或复用) 带静音音轨的 lavfi 测试片"""
+    bench_dir = cache_dir() / "bench"
+    bench_dir.mkdir(exist_ok=True)
+    path = bench_dir / f"{pattern}_{width}x{height}_{seconds:g}s.mp4"
+    if path.exists():
+        return path
+
+    tmp = path.with_name(f"{path.stem}.tmp{path.suffix}")
+    cmd = [ffmpeg, '-hide_banner', '-nostats', '-y',
+           '-f', 'lavfi', '-i', f"{pattern}=size={width}x{height}:rate={BENCH_FPS}",
+           '-f', 'lavfi', '-i', 'anullsrc=channel_layout=stereo:sample_rate=48000',
+           '-t', f"{seconds:g}", '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18',
+           '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', str(tmp)]
+    run_ffmpeg(cmd)
+    os.replace(tmp, path)
+    return path
+
+
+# ==========================================
+# suite: 各引擎的滤镜图
+# ==========================================
+
+def _null_outputs(labels, video_args: List[str]) -> List[str]:
+    args: List[str] = []
+    for label in labels:
+        args += ['-map', label, *video_args, '-f', 'null', os.devnull]
+    return args
+
+
+def gui_cmd(ffmpeg: str, clip: Path, w: int, h: int, fast_bg: bool) -> List[str]:
+    """main_gui_v3_release.VideoWorker: 单次解码同时输出全部比例"""
+    k = 4 if fast_bg else 1
+    graph = build_multi_graph(tuple(
+        WallpaperLayout(w, h, rotate=w > h, ratio=ratio, bg_downscale=k)
+        for _, ratio in RATIOS))
+    return [ffmpeg, '-hide_banner', '-nostats', '-y', '-i', str(clip),
+            '-filter_complex', graph.graph, *_null_outputs(graph.outputs, X264_FAST)]
+
+
+def feather_cmd(ffmpeg: str, clip: Path, w: int, h: int, fast_bg: bool) -> List[str]:
+    """VE_QW_all.build_cmd: inset 羽化，每个比例一个进程 (这里只跑 9x20)"""
+    graph = build_graph(WallpaperLayout(w, h, rotate=w > h, ratio=RATIOS[0][1], feather=20,
+                                        feather_style='inset',
+                                        bg_downscale=4 if fast_bg else 1))
+    return [ffmpeg, '-hide_banner', '-nostats', '-y', '-i', str(clip),
+            '-filter_complex', graph.graph,
+            *_null_outputs(graph.outputs, X264_FAST + ['-map', '0:a?', '-c:a', 'copy'])]
+
+
+def contain_cmd(ffmpeg: str, clip: Path, w: int, h: int, fast_bg: bool) -> List[str]:
+    """Video_Edit_FF.process_video: 9:16 contain，无羽化"""
+    graph = build_graph(WallpaperLayout(w, h, ratio=9 / 16, feather=0, fit='contain',
+                                        bg_downscale=4 if fast_bg else 1))
+    return [ffmpeg, '-hide_banner', '-nostats', '-y', '-i', str(clip),
+            '-filter_complex', graph.graph,
+            *_null_outputs(graph.outputs, ['-map', '0:a?'] + X264_FF)]
+
+
+def _ffprobe_for(ffmpeg: str) -> str:
+    """与 ffmpeg 同目录的 ffprobe"""
+    path = Path(ffmpeg)
+    if path.parent == Path('.'):
+        return 'ffprobe'
+    return str(path.with_name('ffprobe' + path.suffix))
+
+
+def prefect_cmd(two_step: bool) -> Callable[..., List[str]]:
+    """VE_QW_FInal_prefect.FFmpegManager: 在子进程中调用原始实现 (需要 ffmpeg-python)"""
+    def build(ffmpeg: str, clip: Path, w: int, h: int, fast_bg: bool) -> List[str]:
+        out = clip.with_name(f"{clip.stem}.prefect.mp4")
+        cmd = [sys.executable, os.path.abspath(__file__), '--ffmpeg', ffmpeg,
+               '--ffprobe', _ffprobe_for(ffmpeg), '_prefect', str(clip), str(out)]
+        return cmd + (['--two-step'] if two_step else [])
+    return build
+
+
+VARIANTS: Dict[str, Callable[..., List[str]]] = {
+    'gui': gui_cmd,
+    'feather': feather_cmd,
+    'contain': contain_cmd,
+    'prefect': prefect_cmd(two_step=False),
+    'prefect_two_step': prefect_cmd(two_step=True),
+}
+
+
+def run_prefect(args) -> int:
+    """_prefect 子命令: 用 FFmpegManager 以 CPU 方式处理一个文件"""
+    import VE_QW_FInal_prefect as prefect
+
+    manager = prefect.ffmpeg_manager
+    manager.components = {'ffmpeg': Path(args.ffmpeg), 'ffprobe': Path(args.ffprobe)}
+    output = Path(args.output)
+    ok = manager.process_video(Path(args.input), output, 1080, 1920,
+                               use_cuda=False, two_step=args.two_step)
+    if output.exists():
+        output.unlink()
+    return 0 if ok else 1
+
+
+# ==========================================
+# suite: 执行与对比
+# ==========================================
+
+def run_suite(args) -> Dict[str, Any]:
+    results = []
+    for res in args.resolutions:
+        for orientation in args.orientations:
+            w, h = RESOLUTIONS[res]
+            if orientation == 'portrait':
+                w, h = h, w
+            for pattern in args.patterns:
+                clip = synthetic_clip(args.ffmpeg, pattern, w, h, args.seconds)
+                frames = int(args.seconds * BENCH_FPS)
+                for variant in args.variants:
+                    cmd = VARIANTS[variant](args.ffmpeg, clip, w, h, args.fast_bg)
+                    stats = measure(cmd, cwd=str(clip.parent))
+                    stderr = stats.pop('stderr')
+                    ok = stats.pop('returncode') == 0
+                    entry = {'variant': variant, 'pattern': pattern, 'resolution': res,
+                             'orientation': orientation, 'width': w, 'height': h,
+                             'frames': frames, 'ok': ok,
+                             'fps': round(frames / stats['wall_s'], 2) if ok else None,
+                             **stats}
+                    if not ok:
+                        entry['error'] = stderr[-500:]
+                    results.append(entry)
+                    print(f"{variant:<18}{pattern:<12}{res:<7}{orientation:<11}"
+                          f"{entry['fps'] if ok else '失败':>9} fps"
+                          f"{stats['peak_rss_mb'] or 0:>9.0f} MB"
+                          f"{stats['cpu_percent'] or 0:>8.0f}% CPU", file=sys.stderr)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'ffmpeg': ffmpeg_version(args.ffmpeg),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'seconds': args.seconds,
+            'fast_bg': args.fast_bg,
+        },
+        'results': results,
+    }
+
+
+def _result_key(r: Dict[str, Any]) -> Tuple:
+    return r['variant'], r['pattern'], r['resolution'], r['orientation']
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """返回帧/秒比基线下降超过 tolerance 的条目说明"""
+    old = {_result_key(r): r for r in baseline.get('results', [])}
+    regressions = []
+    for r in report['results']:
+        prev = old.get(_result_key(r))
+        if not prev or not prev.get('fps'):
+            continue
+        if not r['fps']:
+            regressions.append(f"{'/'.join(_result_key(r))}: 基线可运行，现在失败")
+        elif r['fps'] < prev['fps'] * (1 - tolerance):
+            regressions.append(f"{'/'.join(_result_key(r))}: "
+                               f"{prev['fps']} -> {r['fps']} fps")
+    return regressions
+
+
+def cmd_suite(args) -> int:
+    report = run_suite(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding='utf-8')
+    else:
+        print(text)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print(f"性能回退: {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0 if all(r['ok'] for r in report['results']) else 1
+
+
+# ==========================================
+# bg: 快速背景对比
+# ==========================================
+
+def input_args(source: Optional[str]) -> List[str]:
+    """未指定视频时使用 lavfi 测试源"""
+    if source is None:
+        return ['-f', 'lavfi', '-i', DEFAULT_SOURCE]
+    return ['-i', source]
+
+
+def source_size(source: Optional[str], ffprobe: str) -> Tuple[int, int]:
+    if source is None:
+        w, h = re.search(r'size=(\d+)x(\d+)', DEFAULT_SOURCE).groups()
+        return int(w), int(h)
+    v = video_stream(get_probe_cache().probe(source, ffprobe))
+    return int(v['width']), int(v['height'])
+
+
+def measure_fps(ffmpeg: str, source: Optional[str], layout: WallpaperLayout,
+                frames: int) -> float:
+    graph = build_graph(layout)
+    cmd = [ffmpeg, '-hide_banner', '-nostats', '-y', *input_args(source),
+           '-filter_complex', graph.graph, '-map', graph.outputs[0],
+           '-frames:v', str(frames), '-f', 'null', '-']
+    elapsed, _ = run_ffmpeg(cmd)
+    return frames / elapsed
+
+
+def measure_ssim(ffmpeg: str, source: Optional[str], ref: WallpaperLayout,
+                 fast: WallpaperLayout, frames: int) -> float:
+    """一次解码同时渲染两种方案，逐帧 ssim 的平均值"""
+    graph = build_multi_graph((ref, fast))
+    cmd = [ffmpeg, '-hide_banner', '-nostats', '-y', *input_args(source),
+           '-filter_complex',
+           f"{graph.graph};{graph.outputs[0]}{graph.outputs[1]}ssim[cmp]",
+           '-map', '[cmp]', '-frames:v', str(frames), '-f', 'null', '-']
+    _, stderr = run_ffmpeg(cmd)
+    m = re.search(r'SSIM .*All:([\d.]+)', stderr)
+    if not m:
+        raise RuntimeError("未能从 ffmpeg 输出中解析 SSIM")
+    return float(m.group(1))
+
+
+def cmd_bg(args) -> int:
+    w, h = source_size(args.source, args.ffprobe)
+    ref = WallpaperLayout(w, h, rotate=w > h, ratio=args.ratio)
+    cw, ch = ref.canvas_size
+    print(f"源 {w}x{h} -> 画布 {cw}x{ch}, 每轮 {args.frames} 帧")
+
+    base_fps = measure_fps(args.ffmpeg, args.source, ref, args.frames)
+    print(f"{'方案':<14}{'帧/秒':>10}{'加速':>8}{'SSIM':>10}")
+    print(f"{'gblur 原分辨率':<14}{base_fps:>10.1f}{'1.00x':>8}{'1.0000':>10}")
+    for k in args.factors:
+        fast = WallpaperLayout(w, h, rotate=w > h, ratio=args.ratio, bg_downscale=k)
+        fps = measure_fps(args.ffmpeg, args.source, fast, args.frames)
+        ssim = measure_ssim(args.ffmpeg, args.source, ref, fast, args.frames)
+        print(f"{f'快速背景 1/{k}':<14}{fps:>10.1f}{fps / base_fps:>7.2f}x{ssim:>10.4f}")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="壁纸滤镜图基准测试")
+    parser.add_argument('--ffmpeg', default='ffmpeg')
+    parser.add_argument('--ffprobe', default='ffprobe')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    suite = sub.add_parser('suite', help="合成素材跑全部引擎的滤镜图，输出 JSON")
+    suite.add_argument('-r', '--resolutions', nargs='+', choices=list(RESOLUTIONS),
+                       default=list(RESOLUTIONS))
+    suite.add_argument('-p', '--patterns', nargs='+', choices=PATTERNS,
+                       default=list(PATTERNS))
+    suite.add_argument('--orientations', nargs='+', choices=ORIENTATIONS,
+                       default=list(ORIENTATIONS))
+    suite.add_argument('-v', '--variants', nargs='+', choices=list(VARIANTS),
+                       default=list(VARIANTS))
+    suite.add_argument('-s', '--seconds', type=float, default=5, help="测试片时长 (秒)")
+    suite.add_argument('--fast-bg', action='store_true', help="使用快速背景模糊")
+    suite.add_argument('-o', '--output', help="JSON 结果文件 (默认输出到标准输出)")
+    suite.add_argument('--baseline', help="上一版本的 JSON 结果，用于检测性能回退")
+    suite.add_argument('--tolerance', type=float, default=0.10,
+                       help="允许的帧/秒下降比例 (默认 0.10)")
+    suite.set_defaults(func=cmd_suite)
+
+    bg = sub.add_parser('bg', help="快速背景与原分辨率 gblur 的速度 / SSIM 对比")
+    bg.add_argument('source', nargs='?', default=None,
+                    help="测试视频 (默认使用 ffmpeg 内置测试源)")
+    bg.add_argument('-f', '--factors', type=int, nargs='+', default=[4, 8],
+                    help="快速背景的缩小倍数")
+    bg.add_argument('-n', '--frames', type=int, default=300, help="每轮渲染帧数")
+    bg.add_argument('--ratio', type=float, default=9 / 20, help="目标画幅 宽/高")
+    bg.set_defaults(func=cmd_bg)
+
+    # 内部使用: suite 在子进程中调用 FFmpegManager
+    prefect = sub.add_parser('_prefect')
+    prefect.add_argument('input')
+    prefect.add_argument('output')
+    prefect.add_argument('--two-step', action='store_true')
+    prefect.set_defaults(func=run_prefect)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    try:
+        args = parse_args()
+        sys.exit(args.func(args))
+    except (RuntimeError, FileNotFoundError) as e:
+        print(e)
+        sys.exit(1)
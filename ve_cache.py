@@ -0,0 +1,181 @@
+"""
+ffprobe 元数据持久化缓存
+
+所有引擎共用同一份缓存：工作目录下 .ve_cache/probe.sqlite，
+以 (绝对路径, 文件大小, mtime_ns) 判断文件是否变化。
+缓存保存 ffprobe -show_format -show_streams 的完整 JSON，
+各引擎再从中取自己需要的字段，因此重复扫描未变化的文件不会再启动 ffprobe。
+"""
+
+import os
+import json
+import sqlite3
+import subprocess
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = ".ve_cache"
+PROBE_WORKERS = min(8, os.cpu_count() or 1)  # 批量探测时同时运行的 ffprobe 数
+
+
+def cache_dir(work_dir=None) -> Path:
+    """返回 (并创建) 工作目录下的缓存目录"""
+    path = Path(work_dir or ".").resolve() / CACHE_DIR_NAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def no_window_kwargs() -> Dict[str, Any]:
+    """Windows 下启动子进程时不弹出控制台窗口"""
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NO_WINDOW}
+    return {}
+
+
+def file_key(path) -> Tuple[str, int, int]:
+    """文件指纹: (绝对路径, 大小, mtime_ns)"""
+    abs_path = os.path.abspath(str(path))
+    st = os.stat(abs_path)
+    return abs_path, st.st_size, st.st_mtime_ns
+
+
+def video_stream(probe: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """取 ffprobe 结果中的第一条视频流"""
+    return next((s for s in probe.get('streams', [])
+                 if s.get('codec_type') == 'video'), None)
+
+
+class ProbeCache:
+    """以文件指纹为键的 ffprobe 结果缓存 (内存 + SQLite)"""
+
+    def __init__(self, work_dir=None):
+        self.db_path = cache_dir(work_dir) / "probe.sqlite"
+        self._lock = threading.Lock()
+        self._memory: Dict[str, Tuple[int, int, Dict[str, Any]]] = {}
+        self.hits = 0
+        self.spawns = 0
+        self._db = sqlite3.connect(
+            str(self.db_path), timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS probe ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT)")
+
+    def get(self, path) -> Optional[Dict[str, Any]]:
+        """命中且文件未变化时返回缓存的 ffprobe 结果，否则返回 None"""
+        abs_path, size, mtime_ns = file_key(path)
+        with self._lock:
+            cached = self._memory.get(abs_path)
+            if cached and cached[:2] == (size, mtime_ns):
+                self.hits += 1
+                return cached[2]
+            row = self._db.execute(
+                "SELECT size, mtime_ns, data FROM probe WHERE path = ?",
+                (abs_path,)).fetchone()
+            if row and (row[0], row[1]) == (size, mtime_ns):
+                data = json.loads(row[2])
+                self._memory[abs_path] = (size, mtime_ns, data)
+                self.hits += 1
+                return data
+        return None
+
+    def put(self, path, data: Dict[str, Any]) -> None:
+        """写入 (或覆盖) 某个文件的 ffprobe 结果"""
+        abs_path, size, mtime_ns = file_key(path)
+        with self._lock:
+            self._memory[abs_path] = (size, mtime_ns, data)
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?)",
+                    (abs_path, size, mtime_ns, json.dumps(data)))
+
+    def probe(self, path, ffprobe_path='ffprobe') -> Dict[str, Any]:
+        """
+        获取文件的完整 ffprobe 结果，未命中时才调用 ffprobe
+
+        Raises:
+            subprocess.CalledProcessError / json.JSONDecodeError: ffprobe 执行失败
+        """
+        data = self.get(path)
+        if data is not None:
+            return data
+
+        cmd = [str(ffprobe_path), '-v', 'error', '-show_format', '-show_streams',
+               '-of', 'json', str(path)]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                check=True, **no_window_kwargs())
+        with self._lock:
+            self.spawns += 1
+        data = json.loads(result.stdout.decode('utf-8', errors='replace'))
+        self.put(path, data)
+        return data
+
+    def probe_many(self, paths: Iterable, ffprobe_path='ffprobe',
+                   max_workers: int = PROBE_WORKERS) -> Dict[str, Dict[str, Any]]:
+        """
+        批量获取元数据：先查缓存，未命中的文件用有界并发的 ffprobe 进程池探测
+
+        Args:
+            paths: 视频文件路径列表
+            ffprobe_path: ffprobe 可执行文件
+            max_workers: 同时运行的 ffprobe 进程数上限
+
+        Returns:
+            Dict[str, Dict[str, Any]]: str(path) -> ffprobe 结果，探测失败的文件不在其中
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        misses = []
+        for path in paths:
+            try:
+                data = self.get(path)
+            except OSError as e:
+                logger.warning(f"无法读取文件 {path}: {e}")
+                continue
+            if data is None:
+                misses.append(path)
+            else:
+                results[str(path)] = data
+
+        def probe_one(path):
+            try:
+                return path, self.probe(path, ffprobe_path)
+            except Exception as e:
+                logger.warning(f"ffprobe 探测失败 {path}: {e}")
+                return path, None
+
+        if misses:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers),
+                                    thread_name_prefix='ffprobe') as pool:
+                for path, data in pool.map(probe_one, misses):
+                    if data is not None:
+                        results[str(path)] = data
+        return results
+
+    def prune(self) -> int:
+        """删除已不存在的文件的缓存记录，返回删除条数"""
+        with self._lock:
+            paths = [row[0] for row in self._db.execute("SELECT path FROM probe")]
+            gone = [(p,) for p in paths if not os.path.exists(p)]
+            with self._db:
+                self._db.executemany("DELETE FROM probe WHERE path = ?", gone)
+            for (p,) in gone:
+                self._memory.pop(p, None)
+        return len(gone)
+
+
+_caches: Dict[Path, ProbeCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_probe_cache(work_dir=None) -> ProbeCache:
+    """同一工作目录在进程内共享一个缓存实例"""
+    key = Path(work_dir or ".").resolve()
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ProbeCache(key)
+        return _caches[key]
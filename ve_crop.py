@@ -0,0 +1,161 @@
+"""
+黑边检测 (cropdetect，只解码关键帧)
+
+带黑边 (letterbox / pillarbox) 的源视频原先连同黑边一起被缩放、羽化、叠加，
+羽化落在黑边外缘而不是画面边缘，黑边本身也按全码率编码。
+
+这里在文件的几个位置各解码少量关键帧 (-skip_frame nokey，不解码其它帧)，
+用 cropdetect 得到每帧的有效画面，合并为一个稳定的裁剪矩形：
+
+    取全部样本的并集     任何一个样本里有画面的区域都保留 (暗场不会被误裁)
+    每边至少 MIN_BORDER  过细的边视为压缩噪声，不裁
+    至少保留 MIN_AREA    几乎全黑的视频不裁
+
+各位置并行分析，总耗时限制在 ANALYSIS_BUDGET 秒内 (超时的位置放弃，样本不足时不裁)。
+结果写回 ffprobe 探测缓存 (CROP_KEY)，文件不变时不再分析。
+"""
+
+import re
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from ve_cache import get_probe_cache, video_stream
+from ve_supervisor import run_command
+
+logger = logging.getLogger(__name__)
+
+CROP_KEY = 've_cropdetect'   # 探测缓存中保存结果的字段
+SAMPLE_POINTS = (0.15, 0.35, 0.55, 0.75)  # 采样位置 (占时长的比例)
+FRAMES_PER_POINT = 3         # 每个位置解码的关键帧数
+MIN_SAMPLES = 2              # 至少这么多个位置成功才采用结果
+CROP_LIMIT = 24              # cropdetect 的黑色阈值 (8 位亮度)
+CROP_SKIP = 2                # cropdetect 默认不输出前 2 帧 (skip=2；旧版没有该选项，多解码 2 帧兼容各版本)
+MIN_BORDER = 8               # 单边黑边至少这么多像素才裁
+MIN_AREA = 0.3               # 裁剪后至少保留原画面的比例
+ANALYSIS_BUDGET = 1.0        # 单个文件的分析时间上限 (秒)
+
+_CROP = re.compile(r'crop=(\d+):(\d+):(\d+):(\d+)')
+
+
+class CropRect(NamedTuple):
+    w: int
+    h: int
+    x: int
+    y: int
+
+    def filter(self) -> str:
+        return f"crop={self.w}:{self.h}:{self.x}:{self.y}"
+
+
+def _rotation(stream) -> int:
+    """流的旋转角度 (rotate 标签或 displaymatrix 附加数据)"""
+    try:
+        angle = int(float((stream.get('tags') or {}).get('rotate', 0)))
+        for side in stream.get('side_data_list') or []:
+            if 'rotation' in side:
+                angle = int(float(side['rotation']))
+    except (TypeError, ValueError):
+        return 0
+    return angle % 360
+
+
+def _sample(path, at: float, ffmpeg: str, should_stop) -> List[CropRect]:
+    """在 at 秒附近解码 FRAMES_PER_POINT 个关键帧，返回每帧的检测结果"""
+    cmd = [str(ffmpeg), '-hide_banner', '-nostats', '-loglevel', 'info',
+           '-skip_frame', 'nokey', '-ss', f"{at:.3f}", '-i', str(path),
+           '-map', '0:v:0', '-an', '-sn', '-dn', '-frames:v', str(FRAMES_PER_POINT + CROP_SKIP),
+           '-vf', f"cropdetect=limit={CROP_LIMIT}:round=2:reset=1", '-f', 'null', '-']
+    result = run_command(cmd, should_stop)
+    if result.returncode != 0:
+        return []
+    return [CropRect(*map(int, m.groups()))
+            for m in map(_CROP.search, result.stderr_tail) if m]
+
+
+def merge_crops(rects: List[CropRect], width: int, height: int) -> Optional[CropRect]:
+    """合并各帧的检测结果，不需要裁剪时返回 None"""
+    if not rects:
+        return None
+    x1 = min(r.x for r in rects)
+    y1 = min(r.y for r in rects)
+    x2 = max(r.x + r.w for r in rects)
+    y2 = max(r.y + r.h for r in rects)
+    # 过细的边不裁
+    if x1 < MIN_BORDER:
+        x1 = 0
+    if y1 < MIN_BORDER:
+        y1 = 0
+    if width - x2 < MIN_BORDER:
+        x2 = width
+    if height - y2 < MIN_BORDER:
+        y2 = height
+    # 偶数尺寸与偏移 (yuv420p 要求)
+    x1, y1 = x1 // 2 * 2, y1 // 2 * 2
+    w, h = (min(x2, width) - x1) // 2 * 2, (min(y2, height) - y1) // 2 * 2
+    if (w, h) == (width // 2 * 2, height // 2 * 2) or w <= 0 or h <= 0:
+        return None
+    if w * h < MIN_AREA * width * height:
+        return None
+    return CropRect(w, h, x1, y1)
+
+
+def detect_crop(path, ffmpeg='ffmpeg', ffprobe='ffprobe', work_dir=None) -> Optional[CropRect]:
+    """
+    检测视频的黑边
+
+    Args:
+        path: 视频文件
+        ffmpeg, ffprobe: 可执行文件
+        work_dir: 探测缓存所在的工作目录
+
+    Returns:
+        Optional[CropRect]: 去掉黑边后的矩形 (解码后的画面坐标)，没有黑边或无法判断时为 None
+    """
+    cache = get_probe_cache(work_dir)
+    try:
+        probe = cache.probe(path, ffprobe)
+    except Exception as e:
+        logger.warning(f"无法读取视频信息 {path}: {e}")
+        return None
+    if CROP_KEY in probe:
+        cached = probe[CROP_KEY]
+        return CropRect(*cached) if cached else None
+
+    stream = video_stream(probe) or {}
+    try:
+        width, height = int(stream['width']), int(stream['height'])
+        duration = float(stream.get('duration') or probe.get('format', {}).get('duration') or 0)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if _rotation(stream) in (90, 270):
+        # ffmpeg 解码时自动按旋转元数据转正，cropdetect 看到的是转正后的画面
+        width, height = height, width
+
+    started = time.monotonic()
+    deadline = started + ANALYSIS_BUDGET
+
+    def expired() -> bool:
+        return time.monotonic() > deadline
+
+    points = [duration * p for p in SAMPLE_POINTS] if duration > 0 else [0.0]
+    with ThreadPoolExecutor(max_workers=len(points), thread_name_prefix='cropdetect') as pool:
+        samples = list(pool.map(lambda at: _sample(path, at, ffmpeg, expired), points))
+    rects = [r for sample in samples for r in sample]
+    complete = sum(1 for sample in samples if sample)
+    if complete < min(MIN_SAMPLES, len(points)):
+        # 超时或解码失败：不裁，也不写缓存 (下次重试)
+        logger.debug(f"黑边检测样本不足 {path}: {complete}/{len(points)}")
+        return None
+
+    crop = merge_crops(rects, width, height)
+    probe[CROP_KEY] = list(crop) if crop else []
+    try:
+        cache.put(path, probe)
+    except OSError:
+        pass
+    if crop:
+        logger.info(f"检测到黑边 {path}: {width}x{height} -> {crop.w}x{crop.h} "
+                    f"({time.monotonic() - started:.2f}s)")
+    return crop
@@ -0,0 +1,74 @@
+"""
+流式视频文件发现
+
+原先各引擎先列出完整文件列表 (逐个 stat、打印大小，Video_Edit_FF 还对每个扩展名的
+大小写各 glob 一次)，然后才开始第一个任务。在挂载了数万个文件的 NAS 目录上，
+第一个任务要等好几分钟。
+
+iter_videos() 用 os.scandir 边遍历边产出文件，调用方每拿到一个文件就提交到渲染队列，
+探测与渲染和目录遍历同时进行。扩展名比较不区分大小写 (也不会像大小写两次 glob
+那样在 Windows 上把同一个文件列两遍)；只有设置了大小过滤时才读取文件大小。
+"""
+
+import os
+import logging
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from ve_locate import SKIP_DIRS
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTS = ('.mp4', '.mov', '.mkv', '.avi', '.wmv', '.flv', '.webm', '.m4v')
+
+
+def iter_videos(root, exts: Iterable[str] = VIDEO_EXTS, recursive: bool = False,
+                min_size: int = 0, max_size: int = 0,
+                should_stop: Optional[Callable[[], bool]] = None) -> Iterator[Path]:
+    """
+    逐个产出 root 下的视频文件
+
+    Args:
+        root: 起始目录
+        exts: 接受的扩展名 (不区分大小写)
+        recursive: 是否进入子目录 (跳过 output、temp_processing、隐藏目录与目录符号链接)
+        min_size: 最小文件大小 (字节)，0 表示不限
+        max_size: 最大文件大小 (字节)，0 表示不限
+        should_stop: 返回 True 时停止遍历
+
+    Yields:
+        Path: 视频文件路径，同一目录内按 scandir 返回的顺序
+    """
+    exts = tuple(e.lower() for e in exts)
+    pending = [Path(root)]
+    while pending:
+        directory = pending.pop()
+        try:
+            it = os.scandir(directory)
+        except OSError as e:
+            logger.warning(f"无法读取目录 {directory}: {e}")
+            continue
+        subdirs = []
+        with it:
+            for entry in it:
+                if should_stop and should_stop():
+                    return
+                try:
+                    # 不进入指向目录的符号链接 (与 os.walk 默认相同)：
+                    # 指向上级目录的链接会导致无限下钻，同一视频被反复产出
+                    if entry.is_dir(follow_symlinks=False):
+                        if (recursive and entry.name.lower() not in SKIP_DIRS
+                                and not entry.name.startswith('.')):
+                            subdirs.append(Path(entry.path))
+                        continue
+                    if not entry.name.lower().endswith(exts) or not entry.is_file():
+                        continue
+                    if min_size or max_size:
+                        size = entry.stat().st_size
+                        if size < min_size or (max_size and size > max_size):
+                            continue
+                except OSError:
+                    continue  # 遍历过程中被删除或无权限
+                yield Path(entry.path)
+        # 逆序压栈，子目录按发现顺序处理
+        pending.extend(reversed(subdirs))
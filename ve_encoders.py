@@ -0,0 +1,229 @@
+"""
+编码器能力探测
+
+原先每个任务先试 h264_nvenc，失败后再回退 libx264；没有可用 NVENC 的机器上
+每个输出都要白白启动一次进程、留下一个半成品。这里对每个候选编码器只做一次
+1 帧的试编码，结果缓存在 .ve_cache/encoders.json，以 ffmpeg 可执行文件的
+(路径, 大小, mtime) 为键。可用的结果一直有效 (换了 ffmpeg 才重新探测)；
+失败只保留 NEGATIVE_TTL 秒，会话被占满、驱动尚未装好等临时失败不会把
+之后的每次运行都钉在 libx264 上。缓存为可用的编码器在实际渲染中失败时，
+只有 encoder_failed() 认定是编码器本身的问题、且同一输入用 CPU 回退成功，
+调用方才用 forget_encoder() 清掉该记录，下次启动重新探测 (卡滞、源文件损坏
+等与编码器无关的失败不会清掉缓存)。
+
+各引擎启动时调用 pick_encoder() 取得最快的可用 H.264 编码器：
+    h264_nvenc > h264_qsv > h264_vaapi > libx264
+没有显卡的 Linux 上直接得到 libx264。
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from ve_cache import cache_dir, file_key, no_window_kwargs
+
+logger = logging.getLogger(__name__)
+
+VAAPI_DEVICE = "/dev/dri/renderD128"
+PROBE_TIMEOUT = 20  # 单个编码器试编码的超时 (秒)
+NEGATIVE_TTL = 600  # 探测失败的结果保留时间 (秒)，过期后重新探测
+# stderr 中出现这些字样 (不区分大小写) 时认为失败与编码器 / 硬件设备有关
+ENCODER_ERROR_HINTS = ('nvenc', 'qsv', 'vaapi', 'cuda', 'hwupload', 'device',
+                       'cannot load', 'error initializing output stream',
+                       'error while opening encoder')
+
+
+class EncoderSpec(NamedTuple):
+    args: Tuple[str, ...]          # 输出端编码参数
+    hw_args: Tuple[str, ...] = ()  # 输入前的全局参数 (硬件设备)
+    upload: bool = False           # 是否需要在滤镜图末尾 hwupload
+
+
+# 与原 GPU / CPU 参数保持同一档位：约 10M VBR，软件编码用 veryfast
+ENCODERS: Dict[str, EncoderSpec] = {
+    'h264_nvenc': EncoderSpec(('-c:v', 'h264_nvenc', '-preset', 'p4', '-rc:v', 'vbr', '-b:v', '10M')),
+    'hevc_nvenc': EncoderSpec(('-c:v', 'hevc_nvenc', '-preset', 'p4', '-rc:v', 'vbr', '-b:v', '8M')),
+    'h264_qsv': EncoderSpec(('-c:v', 'h264_qsv', '-preset', 'medium', '-b:v', '10M',
+                             '-maxrate', '15M')),
+    'h264_vaapi': EncoderSpec(('-c:v', 'h264_vaapi', '-rc_mode', 'VBR', '-b:v', '10M',
+                               '-maxrate', '15M'),
+                              hw_args=('-vaapi_device', VAAPI_DEVICE), upload=True),
+    'libx264': EncoderSpec(('-c:v', 'libx264', '-preset', 'veryfast')),
+    'libx265': EncoderSpec(('-c:v', 'libx265', '-preset', 'fast')),
+    'libsvtav1': EncoderSpec(('-c:v', 'libsvtav1', '-preset', '8')),
+}
+
+H264_PREFERENCE = ('h264_nvenc', 'h264_qsv', 'h264_vaapi', 'libx264')
+SOFTWARE_FALLBACK = 'libx264'
+
+_lock = threading.Lock()
+# ffmpeg 文件键 -> {'encoders': {名称: True}, 'failed': {名称: 探测失败的时间戳}}
+_memory: Dict[Tuple, Dict[str, Dict]] = {}
+
+
+def encoder_args(name: str) -> List[str]:
+    return list(ENCODERS[name].args)
+
+
+def global_args(name: str) -> List[str]:
+    """需要放在 -i 之前的硬件设备参数"""
+    spec = ENCODERS.get(name)
+    return list(spec.hw_args) if spec else []
+
+
+def upload_outputs(graph: str, outputs: Sequence[str], name: str) -> Tuple[str, Tuple[str, ...]]:
+    """
+    VAAPI 等编码器要求帧位于显存：为每个输出标签追加 hwupload
+
+    Returns:
+        Tuple[str, Tuple[str, ...]]: (新的滤镜图, 新的输出标签)
+    """
+    spec = ENCODERS.get(name)
+    if not spec or not spec.upload:
+        return graph, tuple(outputs)
+    chains, labels = [graph], []
+    for label in outputs:
+        hw = f"{label[:-1]}_hw]"
+        chains.append(f"{label}format=nv12,hwupload{hw}")
+        labels.append(hw)
+    return ";".join(chains), tuple(labels)
+
+
+def _test_cmd(ffmpeg: str, name: str) -> List[str]:
+    spec = ENCODERS[name]
+    vf = ['-vf', 'format=nv12,hwupload'] if spec.upload else []
+    return [ffmpeg, '-hide_banner', '-loglevel', 'error', *spec.hw_args,
+            '-f', 'lavfi', '-i', 'color=c=black:s=256x256:r=25', '-frames:v', '1',
+            *vf, *spec.args, '-f', 'null', '-']
+
+
+def _try_encoder(ffmpeg: str, name: str) -> bool:
+    try:
+        result = subprocess.run(_test_cmd(ffmpeg, name), stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT,
+                                **no_window_kwargs())
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return result.returncode == 0
+
+
+def _resolve(ffmpeg) -> Optional[str]:
+    path = shutil.which(str(ffmpeg)) or str(ffmpeg)
+    return os.path.abspath(path) if os.path.isfile(path) else None
+
+
+def probe_encoders(ffmpeg='ffmpeg', names: Optional[Iterable[str]] = None,
+                   work_dir=None) -> Dict[str, bool]:
+    """
+    探测各编码器能否实际工作 (结果按 ffmpeg 可执行文件缓存)
+
+    Args:
+        ffmpeg: ffmpeg 路径或命令名
+        names: 要探测的编码器，默认为 ENCODERS 中的全部
+        work_dir: 缓存所在的工作目录
+
+    Returns:
+        Dict[str, bool]: 编码器名称 -> 是否可用；找不到 ffmpeg 时全部为 False
+    """
+    names = list(names or ENCODERS)
+    binary = _resolve(ffmpeg)
+    if binary is None:
+        return {name: False for name in names}
+
+    key = file_key(binary)
+    cache_path = cache_dir(work_dir) / "encoders.json"
+    with _lock:
+        entry = _load(cache_path, binary, key)
+        working, failed = entry['encoders'], entry['failed']
+        now = time.time()
+
+        missing = [name for name in names if not working.get(name)
+                   and now - failed.get(name, 0) >= NEGATIVE_TTL]
+        if missing:
+            logger.info(f"探测编码器: {', '.join(missing)}")
+            with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+                for name, ok in zip(missing, pool.map(lambda n: _try_encoder(binary, n), missing)):
+                    if ok:
+                        working[name] = True
+                        failed.pop(name, None)
+                    else:
+                        failed[name] = now
+            _save(cache_path, binary, key, entry)
+        return {name: bool(working.get(name)) for name in names}
+
+
+def encoder_failed(name: str, result) -> bool:
+    """
+    一次失败的渲染是否指向编码器本身
+
+    卡滞或取消不算；第一帧都没编出来，或 stderr 提到该编码器、硬件设备初始化时算。
+    源文件损坏同样会在第一帧前失败，调用方须在 CPU 回退成功后才 forget_encoder()
+
+    Args:
+        name: 本次使用的编码器
+        result: ve_supervisor.SupervisedResult
+    """
+    if result.ok or result.stalled or result.cancelled:
+        return False
+    if result.snapshot.frame <= 0:
+        return True
+    text = result.stderr_text(50).lower()
+    return any(hint in text for hint in (name.lower(), *ENCODER_ERROR_HINTS))
+
+
+def forget_encoder(ffmpeg, name: str, work_dir=None) -> None:
+    """缓存为可用的编码器在实际渲染中失败：删除该记录，下次 probe_encoders 重新探测"""
+    binary = _resolve(ffmpeg)
+    if binary is None:
+        return
+    key = file_key(binary)
+    cache_path = cache_dir(work_dir) / "encoders.json"
+    with _lock:
+        entry = _load(cache_path, binary, key)
+        if entry['encoders'].pop(name, None):
+            logger.info(f"编码器 {name} 运行失败，已清除探测缓存")
+            _save(cache_path, binary, key, entry)
+
+
+def _load(cache_path, binary: str, key: Tuple) -> Dict[str, Dict]:
+    """内存中的缓存条目，首次访问时从 encoders.json 读取 (调用方持有 _lock)"""
+    entry = _memory.get(key)
+    if entry is None:
+        try:
+            stored = json.loads(cache_path.read_text(encoding='utf-8')).get(binary, {})
+        except (OSError, ValueError):
+            stored = {}
+        if stored.get('key') != list(key):
+            stored = {}
+        # 旧格式把失败也记为 false，这里只保留可用的结果
+        entry = {'encoders': {n: True for n, ok in stored.get('encoders', {}).items() if ok},
+                 'failed': dict(stored.get('failed', {}))}
+        _memory[key] = entry
+    return entry
+
+
+def _save(cache_path, binary: str, key: Tuple, entry: Dict[str, Dict]) -> None:
+    try:
+        data = json.loads(cache_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        data = {}
+    data[binary] = {'key': list(key), **entry}
+    tmp = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2), encoding='utf-8')
+    os.replace(tmp, cache_path)
+
+
+def pick_encoder(ffmpeg='ffmpeg', preference: Sequence[str] = H264_PREFERENCE,
+                 work_dir=None) -> str:
+    """按优先级返回第一个可用的编码器，全部不可用时返回 libx264"""
+    available = probe_encoders(ffmpeg, preference, work_dir)
+    for name in preference:
+        if available.get(name):
+            return name
+    return SOFTWARE_FALLBACK
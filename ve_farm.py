@@ -0,0 +1,672 @@
+"""
+多机渲染农场：协调器 + 工作进程
+
+协调器 (serve) 扫描工作目录，按与 GUI VideoWorker.run 相同的规则生成任务
+(同样的比例、布局与参数摘要，清单中已完成的输出直接跳过)，
+通过 HTTP 提供给各工作进程：
+
+    POST /lease      领取一个任务，返回任务描述与租约 ID
+    POST /heartbeat  续租并上报帧进度；租约已失效时返回 410
+    PUT  /upload     上传一个输出文件 (无共享存储时)
+    GET  /source     下载源视频 (无共享存储时)
+    POST /complete   上报结果，协调器原子提交输出并登记到清单
+    GET  /status     各状态任务数
+
+工作进程 (work) 循环领取任务，用现有滤镜图与探测出的编码器渲染。
+能直接访问协调器路径 (共享存储或同一台机器) 时直接读写，否则下载源文件、上传输出。
+LEASE_TTL 秒内没有心跳的租约过期，任务重新排队；失败超过 MAX_ATTEMPTS 次标记为失败。
+
+单机测试:
+    python ve_farm.py serve D:/videos --port 8765
+    python ve_farm.py work http://127.0.0.1:8765 -j 2
+
+或一条命令在 127.0.0.1 上启动协调器与 N 个工作进程 (--lavfi 先用 testsrc2 生成测试片段):
+    python ve_farm.py local /tmp/farm 2 --lavfi
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import argparse
+import logging
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ve_cache import get_probe_cache, video_stream
+from ve_encoders import (SOFTWARE_FALLBACK, encoder_args, encoder_failed, forget_encoder,
+                         global_args, pick_encoder, upload_outputs)
+from ve_filtergraph import (FAST_BG_FACTOR, WallpaperLayout, build_graph,
+                            build_multi_graph)
+from ve_locate import locate_ffmpeg
+from ve_manifest import (PARTIAL_TAG, RenderManifest, commit_output, discard_output,
+                         params_digest, sweep_partials)
+from ve_progress import estimate_total_frames
+from ve_supervisor import run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# 与 GUI 相同的输出比例与扫描的扩展名
+RATIOS = [('9x20', 9/20), ('5x11', 5/11)]
+VIDEO_EXTS = ('.mp4', '.mov', '.mkv', '.avi', '.wmv')
+
+DEFAULT_PORT = 8765
+LEASE_TTL = 30.0       # 租约有效期 (秒)，工作进程每 LEASE_TTL/3 秒续租一次
+MAX_ATTEMPTS = 3       # 单个任务最多被领取的次数
+POLL_INTERVAL = 2.0    # 暂无任务时工作进程的等待间隔 (秒)
+CHUNK_SIZE = 1 << 20   # 上传 / 下载的块大小
+TOKEN_HEADER = 'X-VE-Token'
+
+
+@dataclass
+class FarmJob:
+    """协调器中的一个任务 (一个源视频的全部未完成比例)"""
+    job_id: str
+    source: str
+    total_frames: int
+    layouts: List[WallpaperLayout]
+    targets: List[str]
+    state: str = 'pending'  # pending / leased / done / failed
+    attempts: int = 0
+    lease: Optional[str] = None
+    worker: str = ''
+    deadline: float = 0.0
+    frame: int = 0
+    error: Optional[str] = None
+
+    def describe(self, ttl: float = LEASE_TTL) -> Dict[str, Any]:
+        """发给工作进程的任务描述"""
+        return {
+            'job_id': self.job_id,
+            'lease': self.lease,
+            'name': os.path.basename(self.source),
+            'source': self.source,
+            'source_size': os.path.getsize(self.source),
+            'total_frames': self.total_frames,
+            'layouts': [asdict(layout) for layout in self.layouts],
+            'partials': [str(lease_partial(t, self.lease)) for t in self.targets],
+            'ttl': ttl,
+        }
+
+
+def lease_partial(target, lease: str) -> Path:
+    """每个租约独立的临时输出，过期租约迟到的写入不会覆盖新租约的文件"""
+    target = Path(target)
+    return target.with_name(f"{target.stem}{PARTIAL_TAG}.{lease[:8]}{target.suffix}")
+
+
+def output_params(layout: WallpaperLayout, encoder: str) -> str:
+    """与 GUI 相同的参数摘要 (滤镜图 + 编码器及其参数)，两边的完成记录可以互相识别"""
+    return params_digest(build_graph(layout).graph, encoder, encoder_args(encoder))
+
+
+class Coordinator:
+    """任务队列、租约与结果提交"""
+
+    def __init__(self, work_dir, ffprobe='ffprobe', bg_downscale=1,
+                 lease_ttl: float = LEASE_TTL):
+        self.work_dir = Path(work_dir).resolve()
+        self.ffprobe = ffprobe
+        self.bg_downscale = bg_downscale
+        self.lease_ttl = lease_ttl
+        self.manifest = RenderManifest(self.work_dir)
+        self.jobs: Dict[str, FarmJob] = {}
+        self.leases: Dict[str, FarmJob] = {}
+        self._lock = threading.Lock()
+
+    def scan(self) -> int:
+        """扫描工作目录生成任务，返回任务数"""
+        videos = sorted(f for f in self.work_dir.iterdir()
+                        if f.is_file() and f.suffix.lower() in VIDEO_EXTS)
+        probes = get_probe_cache(self.work_dir).probe_many(videos, self.ffprobe)
+        output_root = self.work_dir / "output"
+        if output_root.exists():
+            sweep_partials(output_root)
+
+        for v_path in videos:
+            probe = probes.get(str(v_path))
+            meta = video_stream(probe or {})
+            if meta is None:
+                logger.warning(f"无法读取视频元数据，已跳过: {v_path.name}")
+                continue
+            raw_w, raw_h = int(meta['width']), int(meta['height'])
+            layouts, targets = [], []
+            for label, ratio in RATIOS:
+                layout = WallpaperLayout(raw_w, raw_h, rotate=raw_w > raw_h, ratio=ratio,
+                                         bg_downscale=self.bg_downscale)
+                target = output_root / label / v_path.name
+                # 各工作进程的编码器可能不同：按登记时使用的编码器核对参数
+                done_with = self.manifest.encoder_of(target)
+                if done_with and self.manifest.is_complete(
+                        target, v_path, output_params(layout, done_with)):
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                layouts.append(layout)
+                targets.append(str(target))
+            if not layouts:
+                continue
+            total = estimate_total_frames(v_path, probe, self.ffprobe, work_dir=self.work_dir)
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = FarmJob(job_id, str(v_path), total, layouts, targets)
+        return len(self.jobs)
+
+    # ---- 租约 ----
+
+    def lease(self, worker: str) -> Optional[Dict[str, Any]]:
+        """领取下一个待处理任务，没有时返回 None"""
+        with self._lock:
+            self._expire()
+            job = next((j for j in self.jobs.values() if j.state == 'pending'), None)
+            if job is None:
+                return None
+            job.state, job.attempts, job.worker = 'leased', job.attempts + 1, worker
+            job.lease = uuid.uuid4().hex
+            job.deadline = time.monotonic() + self.lease_ttl
+            job.frame = 0
+            self.leases[job.lease] = job
+            logger.info(f"{worker} 领取 {os.path.basename(job.source)} "
+                        f"(第 {job.attempts} 次)")
+            return job.describe(self.lease_ttl)
+
+    def _active(self, lease: str) -> Optional[FarmJob]:
+        job = self.leases.get(lease)
+        if job is None or job.state != 'leased' or job.lease != lease:
+            return None
+        return job
+
+    def heartbeat(self, lease: str, frame: int = 0) -> bool:
+        """续租，租约已失效时返回 False"""
+        with self._lock:
+            self._expire()
+            job = self._active(lease)
+            if job is None:
+                return False
+            job.deadline = time.monotonic() + self.lease_ttl
+            job.frame = frame
+            return True
+
+    def _expire(self) -> None:
+        """回收过期租约 (调用方持有锁)"""
+        now = time.monotonic()
+        for lease, job in list(self.leases.items()):
+            if job.lease != lease or job.state != 'leased':
+                self.leases.pop(lease, None)
+                continue
+            if now > job.deadline:
+                logger.warning(f"{job.worker} 的租约已过期: {os.path.basename(job.source)}")
+                self._release(job, "租约过期")
+
+    def _release(self, job: FarmJob, error: str) -> None:
+        self.leases.pop(job.lease, None)
+        for target in job.targets:
+            discard_output(lease_partial(target, job.lease))
+        job.lease, job.error = None, error
+        job.state = 'failed' if job.attempts >= MAX_ATTEMPTS else 'pending'
+
+    def upload_target(self, lease: str, index: int) -> Optional[Path]:
+        """上传文件应写入的临时路径，租约无效时返回 None"""
+        with self._lock:
+            job = self._active(lease)
+            if job is None or not 0 <= index < len(job.targets):
+                return None
+            return lease_partial(job.targets[index], lease)
+
+    def source_of(self, lease: str) -> Optional[str]:
+        with self._lock:
+            job = self._active(lease)
+            return job.source if job else None
+
+    def complete(self, lease: str, ok: bool, encoder: Optional[str] = None,
+                 error: Optional[str] = None) -> bool:
+        """提交结果：成功时把各临时输出原子重命名为正式文件并登记"""
+        with self._lock:
+            job = self._active(lease)
+            if job is None:
+                return False
+            partials = [lease_partial(t, lease) for t in job.targets]
+            if ok and not all(p.is_file() for p in partials):
+                ok, error = False, "输出文件缺失"
+            if not ok:
+                for partial in partials:
+                    discard_output(partial)
+                logger.error(f"{job.worker} 渲染失败 {os.path.basename(job.source)}: {error}")
+                self._release(job, error or "渲染失败")
+                return True
+            self.leases.pop(lease, None)
+            job.state, job.lease, job.error = 'done', None, None
+
+        for partial, target, layout in zip(partials, job.targets, job.layouts):
+            commit_output(partial, target)
+            self.manifest.record(target, job.source, output_params(layout, encoder), encoder)
+        logger.info(f"{job.worker} 完成 {os.path.basename(job.source)} ({encoder})")
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire()
+            counts: Dict[str, int] = {}
+            for job in self.jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+            running = [{'name': os.path.basename(j.source), 'worker': j.worker,
+                        'frame': j.frame, 'total': j.total_frames}
+                       for j in self.jobs.values() if j.state == 'leased']
+        return {'counts': counts, 'running': running,
+                'finished': all(j.state in ('done', 'failed') for j in self.jobs.values())}
+
+    # ---- HTTP ----
+
+    def make_server(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                    token: Optional[str] = None) -> ThreadingHTTPServer:
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                logger.debug(fmt % args)
+
+            def _reply(self, code: int, payload: Optional[Dict[str, Any]] = None):
+                body = json.dumps(payload or {}, ensure_ascii=False).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self) -> bool:
+                if token and self.headers.get(TOKEN_HEADER) != token:
+                    self._reply(403, {'error': 'forbidden'})
+                    return False
+                return True
+
+            def _query(self) -> Dict[str, str]:
+                query = urllib.parse.urlparse(self.path).query
+                return {k: v[0] for k, v in urllib.parse.parse_qs(query).items()}
+
+            def _json(self) -> Dict[str, Any]:
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                route = urllib.parse.urlparse(self.path).path
+                if route == '/status':
+                    return self._reply(200, coordinator.status())
+                if route == '/source':
+                    source = coordinator.source_of(self._query().get('lease', ''))
+                    if source is None:
+                        return self._reply(410, {'error': 'lease expired'})
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(os.path.getsize(source)))
+                    self.end_headers()
+                    with open(source, 'rb') as f:
+                        shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+                    return
+                self._reply(404, {'error': 'not found'})
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                route = urllib.parse.urlparse(self.path).path
+                data = self._json()
+                if route == '/lease':
+                    job = coordinator.lease(data.get('worker', self.client_address[0]))
+                    if job is None:
+                        return self._reply(200, {'job': None,
+                                                 'finished': coordinator.status()['finished']})
+                    return self._reply(200, {'job': job})
+                if route == '/heartbeat':
+                    alive = coordinator.heartbeat(data.get('lease', ''), int(data.get('frame', 0)))
+                    return self._reply(200 if alive else 410)
+                if route == '/complete':
+                    accepted = coordinator.complete(data.get('lease', ''), bool(data.get('ok')),
+                                                    data.get('encoder'), data.get('error'))
+                    return self._reply(200 if accepted else 410)
+                self._reply(404, {'error': 'not found'})
+
+            def do_PUT(self):
+                if not self._authorized():
+                    return
+                if urllib.parse.urlparse(self.path).path != '/upload':
+                    return self._reply(404, {'error': 'not found'})
+                query = self._query()
+                partial = coordinator.upload_target(query.get('lease', ''),
+                                                    int(query.get('index', -1)))
+                if partial is None:
+                    return self._reply(410, {'error': 'lease expired'})
+                remaining = int(self.headers.get('Content-Length') or 0)
+                with open(partial, 'wb') as f:
+                    while remaining > 0:
+                        chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                if remaining:
+                    discard_output(partial)
+                    return self._reply(400, {'error': 'incomplete upload'})
+                self._reply(200)
+
+        return ThreadingHTTPServer((host, port), Handler)
+
+
+class FarmClient:
+    """协调器 HTTP 接口的简单封装"""
+
+    def __init__(self, url: str, token: Optional[str] = None, timeout: float = 30):
+        self.url = url.rstrip('/')
+        self.headers = {TOKEN_HEADER: token} if token else {}
+        self.timeout = timeout
+
+    def _open(self, method: str, route: str, body=None, headers=None, **query):
+        url = f"{self.url}{route}"
+        if query:
+            url += '?' + urllib.parse.urlencode(query)
+        request = urllib.request.Request(url, data=body, method=method,
+                                         headers={**self.headers, **(headers or {})})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def call(self, route: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """POST JSON，租约失效 (410) 时返回 None"""
+        body = json.dumps(payload).encode('utf-8')
+        try:
+            with self._open('POST', route, body, {'Content-Type': 'application/json'}) as resp:
+                return json.loads(resp.read() or b'{}')
+        except urllib.error.HTTPError as e:
+            if e.code == 410:
+                return None
+            raise
+
+    def download(self, lease: str, dest: Path) -> None:
+        with self._open('GET', '/source', lease=lease) as resp, open(dest, 'wb') as f:
+            shutil.copyfileobj(resp, f, CHUNK_SIZE)
+
+    def upload(self, lease: str, index: int, path: Path) -> bool:
+        size = path.stat().st_size
+        try:
+            with open(path, 'rb') as f, \
+                    self._open('PUT', '/upload', f, {'Content-Length': str(size)},
+                               lease=lease, index=index):
+                return True
+        except urllib.error.HTTPError as e:
+            if e.code == 410:
+                return False
+            raise
+
+
+class FarmWorker:
+    """领取任务并渲染，可在一台机器上开多个槽位"""
+
+    def __init__(self, client: FarmClient, name: Optional[str] = None, ffmpeg_dir=None):
+        self.client = client
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        paths = locate_ffmpeg(Path(__file__).parent, explicit=ffmpeg_dir)
+        self.ffmpeg = paths.ffmpeg or 'ffmpeg'
+        self.encoder = pick_encoder(self.ffmpeg)
+        self.stop = threading.Event()
+        logger.info(f"工作进程 {self.name}: FFmpeg={self.ffmpeg}, 编码器={self.encoder}")
+
+    def build_cmd(self, source: str, layouts: List[WallpaperLayout], outputs: List[str],
+                  encoder: str) -> List[str]:
+        graph = build_multi_graph(tuple(layouts))
+        filter_str, labels = upload_outputs(graph.graph, graph.outputs, encoder)
+        cmd = [self.ffmpeg, '-y', '-progress', 'pipe:1', '-nostats', '-loglevel', 'error',
+               *global_args(encoder), '-i', source, '-filter_complex', filter_str]
+        for label, out in zip(labels, outputs):
+            cmd += ['-map', label, *encoder_args(encoder),
+                    '-map', '0:a?', '-c:a', 'copy', out]
+        return cmd
+
+    def _heartbeat(self, lease: str, ttl: float, frame: List[int],
+                   lost: threading.Event, done: threading.Event) -> None:
+        while not done.wait(ttl / 3):
+            try:
+                if self.client.call('/heartbeat', {'lease': lease, 'frame': frame[0]}) is None:
+                    logger.warning("租约已被协调器收回，放弃当前任务")
+                    lost.set()
+                    return
+            except OSError as e:
+                logger.warning(f"心跳失败: {e}")
+
+    def render(self, job: Dict[str, Any]) -> None:
+        lease = job['lease']
+        layouts = [WallpaperLayout.from_dict(d) for d in job['layouts']]
+        partials = job['partials']
+        # 能直接访问协调器的文件时不走网络传输
+        shared = (os.path.isfile(job['source'])
+                  and os.path.getsize(job['source']) == job['source_size']
+                  and os.access(os.path.dirname(partials[0]), os.W_OK))
+        scratch = Path(tempfile.mkdtemp(prefix='ve_farm_'))
+        frame, lost, done = [0], threading.Event(), threading.Event()
+        beat = threading.Thread(target=self._heartbeat, name='farm-heartbeat', daemon=True,
+                                args=(lease, job['ttl'], frame, lost, done))
+        beat.start()
+        try:
+            source = job['source']
+            if shared:
+                outputs = partials
+            else:
+                source = str(scratch / f"source{Path(job['source']).suffix}")
+                self.client.download(lease, Path(source))
+                outputs = [str(scratch / f"out{i}{Path(p).suffix}")
+                           for i, p in enumerate(partials)]
+
+            def on_progress(snap):
+                frame[0] = snap.frame
+
+            used, error, suspect = None, None, None
+            candidates = [self.encoder] + ([SOFTWARE_FALLBACK]
+                                           if self.encoder != SOFTWARE_FALLBACK else [])
+            for encoder in candidates:
+                result = run_ffmpeg(self.build_cmd(source, layouts, outputs, encoder),
+                                    job['total_frames'], on_progress,
+                                    should_stop=lambda: lost.is_set() or self.stop.is_set())
+                if result.ok:
+                    used = encoder
+                    if suspect:
+                        # 硬件编码失败、同一输入 CPU 成功：探测缓存已不可信
+                        forget_encoder(self.ffmpeg, suspect)
+                    break
+                error = "卡滞" if result.stalled else result.stderr_text(5)
+                if result.cancelled:
+                    break
+                if encoder != SOFTWARE_FALLBACK and encoder_failed(encoder, result):
+                    suspect = encoder
+            if lost.is_set():
+                return
+
+            if used and not shared:
+                for i, out in enumerate(outputs):
+                    if not self.client.upload(lease, i, Path(out)):
+                        return
+            self.client.call('/complete', {'lease': lease, 'ok': bool(used),
+                                           'encoder': used, 'error': error})
+        finally:
+            done.set()
+            beat.join()
+            if shared:
+                for partial in partials:
+                    # 协调器已提交或拒收，残留的只可能是失败的半成品
+                    if self.stop.is_set() or lost.is_set():
+                        discard_output(partial)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def loop(self) -> None:
+        """领取并渲染，直到协调器上的任务全部结束"""
+        while not self.stop.is_set():
+            try:
+                reply = self.client.call('/lease', {'worker': self.name})
+            except OSError as e:
+                logger.warning(f"无法连接协调器: {e}")
+                self.stop.wait(POLL_INTERVAL)
+                continue
+            job = reply and reply.get('job')
+            if job:
+                logger.info(f"{self.name} 开始渲染 {job['name']}")
+                try:
+                    self.render(job)
+                except Exception as e:
+                    logger.error(f"{job['name']} 处理失败: {e}")
+                    try:
+                        self.client.call('/complete', {'lease': job['lease'], 'ok': False,
+                                                       'error': str(e)})
+                    except OSError:
+                        pass  # 协调器收不到时由租约过期兜底
+            elif reply and reply.get('finished'):
+                return
+            else:
+                self.stop.wait(POLL_INTERVAL)
+
+    def run(self, slots: int = 1) -> None:
+        threads = [threading.Thread(target=self.loop, name=f'farm-slot-{i}')
+                   for i in range(max(1, slots))]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.stop.set()
+            for t in threads:
+                t.join()
+
+
+def make_test_clips(work_dir, ffmpeg='ffmpeg', seconds: int = 3) -> None:
+    """用 lavfi testsrc2 生成一横一竖两个带音轨的测试片段 (单机测试用)"""
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    for name, size in (('lavfi_landscape.mp4', '640x360'), ('lavfi_portrait.mp4', '360x640')):
+        target = work_dir / name
+        if target.exists():
+            continue
+        subprocess.run([ffmpeg, '-y', '-loglevel', 'error',
+                        '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate=25:duration={seconds}",
+                        '-f', 'lavfi', '-i', f"sine=frequency=440:duration={seconds}",
+                        '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+                        '-c:a', 'aac', '-shortest', str(target)], check=True)
+
+
+def start_coordinator(args):
+    """扫描工作目录并在后台线程中启动 HTTP 服务，返回 (协调器, 服务器)"""
+    paths = locate_ffmpeg(Path(__file__).parent, explicit=args.ffmpeg)
+    coordinator = Coordinator(args.work_dir, paths.ffprobe or 'ffprobe',
+                              bg_downscale=args.fast_bg, lease_ttl=args.lease_ttl)
+    count = coordinator.scan()
+    logger.info(f"共 {count} 个待渲染视频")
+    server = coordinator.make_server(args.host, args.port, args.token)
+    logger.info(f"协调器监听 http://{args.host}:{server.server_port}")
+    thread = threading.Thread(target=server.serve_forever, name='farm-http', daemon=True)
+    thread.start()
+    return coordinator, server
+
+
+def wait_finished(coordinator: Coordinator, server, workers=()) -> bool:
+    """等待全部任务结束 (或本地工作进程全部退出)，返回是否没有失败的任务"""
+    try:
+        while not coordinator.status()['finished']:
+            if workers and all(p.poll() is not None for p in workers):
+                logger.error("本地工作进程已全部退出，但仍有未完成的任务")
+                break
+            time.sleep(1)
+        # 工作进程下一次领取时收到 finished 后自行退出，之后再关闭服务
+        for p in workers:
+            try:
+                p.wait(timeout=POLL_INTERVAL * 3)
+            except subprocess.TimeoutExpired:
+                pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    counts = coordinator.status()['counts']
+    logger.info(f"全部结束: 完成 {counts.get('done', 0)}，失败 {counts.get('failed', 0)}")
+    return coordinator.status()['finished'] and not counts.get('failed', 0)
+
+
+def serve(args) -> None:
+    coordinator, server = start_coordinator(args)
+    wait_finished(coordinator, server)
+
+
+def local(args) -> None:
+    """在本机 127.0.0.1 上启动协调器与 N 个独立的工作进程，用于单机测试整个农场"""
+    if args.lavfi:
+        paths = locate_ffmpeg(Path(__file__).parent, explicit=args.ffmpeg)
+        make_test_clips(args.work_dir, paths.ffmpeg or 'ffmpeg')
+    args.host, args.port = '127.0.0.1', 0  # 随机空闲端口
+    coordinator, server = start_coordinator(args)
+    url = f"http://127.0.0.1:{server.server_port}"
+    base = [sys.executable, str(Path(__file__).resolve())]
+    if args.token:
+        base += ['--token', args.token]
+    if args.ffmpeg:
+        base += ['--ffmpeg', args.ffmpeg]
+    workers = [subprocess.Popen(base + ['work', url, '--name', f"local-{i}"])
+               for i in range(max(1, args.workers))]
+    try:
+        ok = wait_finished(coordinator, server, workers)
+    finally:
+        for p in workers:
+            if p.poll() is None:
+                p.terminate()
+            p.wait()
+    if not ok:
+        sys.exit(1)
+
+
+def work(args) -> None:
+    client = FarmClient(args.url, args.token)
+    FarmWorker(client, args.name, args.ffmpeg).run(args.jobs)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="多机渲染农场")
+    parser.add_argument('--token', default=os.environ.get('VE_FARM_TOKEN'),
+                        help="共享口令 (也可用环境变量 VE_FARM_TOKEN)")
+    parser.add_argument('--ffmpeg', default=None, help="ffmpeg 路径或所在目录")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    s = sub.add_parser('serve', help="扫描工作目录并分发任务")
+    s.add_argument('work_dir', nargs='?', default='.')
+    s.add_argument('--host', default='127.0.0.1', help="监听地址 (多机时用 0.0.0.0)")
+    s.add_argument('--port', type=int, default=DEFAULT_PORT)
+    s.add_argument('--lease-ttl', type=float, default=LEASE_TTL)
+    s.add_argument('--fast-bg', type=int, nargs='?', const=FAST_BG_FACTOR, default=1,
+                   metavar='N', help="快速背景: 背景缩小到 1/N 再模糊")
+    s.set_defaults(func=serve)
+
+    loc = sub.add_parser('local', help="单机测试: 在 127.0.0.1 上启动协调器与 N 个工作进程")
+    loc.add_argument('work_dir', nargs='?', default='.')
+    loc.add_argument('workers', type=int, nargs='?', default=2, help="工作进程数 (默认 2)")
+    loc.add_argument('--lavfi', action='store_true',
+                   help="先在工作目录中用 lavfi testsrc2 生成测试片段")
+    loc.add_argument('--lease-ttl', type=float, default=LEASE_TTL)
+    loc.add_argument('--fast-bg', type=int, nargs='?', const=FAST_BG_FACTOR, default=1,
+                   metavar='N', help="快速背景: 背景缩小到 1/N 再模糊")
+    loc.set_defaults(func=local)
+
+    w = sub.add_parser('work', help="连接协调器领取任务")
+    w.add_argument('url', help="协调器地址，如 http://127.0.0.1:8765")
+    w.add_argument('-j', '--jobs', type=int, default=1, help="本机同时渲染的任务数")
+    w.add_argument('--name', default=None, help="工作进程名称 (日志用)")
+    w.set_defaults(func=work)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - [%(levelname)s] - %(message)s')
+    args = parse_args()
+    args.func(args)
@@ -0,0 +1,183 @@
+"""
+壁纸滤镜图构建 (背景模糊 + 羽化前景)
+
+各引擎原先各自拼接同一套 filter_complex，这里统一为一个布局描述 WallpaperLayout
+和一个构建函数。构建结果按布局缓存，同分辨率的一批视频只计算一次。
+
+布局参数：
+    src_w, src_h   源视频宽高 (旋转前)
+    rotate         是否先顺时针旋转 90 度 (transpose=1)
+    ratio          目标画幅 宽/高，如 9/20
+    feather        羽化宽度 (像素)，0 表示前景不羽化
+    blur_sigma     背景高斯模糊强度
+    feather_style  'edge'  白底四边画黑带再 boxblur (GUI / ve_wallpaper 系列)
+                   'inset' 黑底内缩画白框再 boxblur (VE_QW_all)
+    fit            'width'   画布宽 = 前景宽，高按比例推出 (壁纸引擎)
+                   'contain' 画布按比例包住整个源画面 (Video_Edit_FF)
+    bg_downscale   快速背景：背景先缩小到 1/N 再模糊 (sigma 同比缩小)，
+                   最后放大回画布尺寸。1 表示原分辨率 gblur (默认)
+    crop           去黑边的裁剪矩形 (宽, 高, x, y)，旋转前先裁；None 表示不裁
+                   (由 ve_crop.detect_crop 检测)
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+INSET_BLUR = "50:2"  # inset 风格遮罩的 boxblur 参数
+FAST_BG_FACTOR = 4   # 快速背景模式的默认缩小倍数 (4~8 之间画质差异很小)
+
+
+@dataclass(frozen=True)
+class WallpaperLayout:
+    src_w: int
+    src_h: int
+    rotate: bool = False
+    ratio: float = 9 / 20
+    feather: int = 30
+    blur_sigma: float = 20
+    feather_style: str = 'edge'
+    fit: str = 'width'
+    bg_downscale: int = 1
+    crop: Optional[Tuple[int, int, int, int]] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'WallpaperLayout':
+        """由 asdict() 经 JSON 往返后的字典还原 (列表还原为元组，布局需可哈希以便缓存)"""
+        data = dict(data)
+        data['crop'] = tuple(data['crop']) if data.get('crop') else None
+        return cls(**data)
+
+    @property
+    def frame_size(self) -> Tuple[int, int]:
+        """裁掉黑边并旋转后的前景宽高"""
+        w, h = self.crop[:2] if self.crop else (self.src_w, self.src_h)
+        if self.rotate:
+            return h, w
+        return w, h
+
+    @property
+    def canvas_size(self) -> Tuple[int, int]:
+        """输出画布宽高 (偶数)"""
+        w, h = self.frame_size
+        if self.fit == 'contain':
+            if w / h > self.ratio:
+                cw, ch = w, int(w / self.ratio)
+            else:
+                cw, ch = int(h * self.ratio), h
+            # 确保尺寸为偶数 (FFmpeg要求)
+            return cw + cw % 2, ch + ch % 2
+        return (w // 2) * 2, (int(w / self.ratio) // 2) * 2
+
+
+def background_chain(layout: WallpaperLayout) -> str:
+    """背景层滤镜：放大铺满画布 -> 裁切 -> 高斯模糊 (快速模式在小图上模糊)"""
+    cw, ch = layout.canvas_size
+    k = max(1, layout.bg_downscale)
+    if k == 1:
+        return (f"scale={cw}:{ch}:force_original_aspect_ratio=increase,"
+                f"crop={cw}:{ch},gblur=sigma={layout.blur_sigma}")
+    # 模糊半径与图像同比缩小，结果放大后与原分辨率模糊近似一致
+    bw, bh = max(2, (cw // k) // 2 * 2), max(2, (ch // k) // 2 * 2)
+    return (f"scale={bw}:{bh}:force_original_aspect_ratio=increase,"
+            f"crop={bw}:{bh},gblur=sigma={layout.blur_sigma / k:g},"
+            f"scale={cw}:{ch}:flags=bilinear")
+
+
+class FilterGraph(NamedTuple):
+    graph: str                      # -filter_complex 字符串
+    sizes: Tuple[Tuple[int, int], ...]  # 每个输出 [outv{i}] 的宽高
+    outputs: Tuple[str, ...]        # 输出标签，如 '[outv]' 或 '[outv0]'
+
+
+def mask_chain(width: int, height: int, feather: int, style: str = 'edge',
+               tag: str = "") -> str:
+    """羽化遮罩子图 (无输入)：-> [mask{tag}]，gray 格式，供 alphamerge 使用"""
+    f = feather
+    if style == 'inset':
+        # 黑底内缩白框，模糊后得到向内渐隐的遮罩
+        return (f"color=c=black:s={width}x{height}[m_base{tag}];"
+                f"[m_base{tag}]drawbox=x={f}:y={f}:w=iw-{2*f}:h=ih-{2*f}:t=fill:c=white,"
+                f"boxblur={INSET_BLUR},format=gray[mask{tag}]")
+    # 白底四边各画 f 像素黑带，boxblur 后形成收缩羽化
+    return (f"color=c=white:s={width}x{height}[m_base{tag}];"
+            f"[m_base{tag}]drawbox=x=0:y=0:w={width}:h={f}:t=fill:c=black,"
+            f"drawbox=x=0:y={height-f}:w={width}:h={f}:t=fill:c=black,"
+            f"drawbox=x=0:y=0:w={f}:h={height}:t=fill:c=black,"
+            f"drawbox=x={width-f}:y=0:w={f}:h={height}:t=fill:c=black,"
+            f"boxblur={f}:1,format=gray[mask{tag}]")
+
+
+def layout_chain(layout: WallpaperLayout, src: str, tag: str = "") -> str:
+    """单个布局的子图：[src] -> 背景模糊 + 羽化前景 -> [outv{tag}]"""
+    w, h = layout.frame_size
+    cw, ch = layout.canvas_size
+    sw, sh = (w // 2) * 2, (h // 2) * 2
+    f = layout.feather
+
+    # 轨道 1：放大铺满画布 -> 裁切 -> 高斯模糊
+    parts = [
+        f"[{src}]split=2[bg_src{tag}][fg_src{tag}]",
+        f"[bg_src{tag}]{background_chain(layout)}[bg{tag}]",
+    ]
+
+    # 轨道 2：前景 (可选羽化)
+    if layout.fit == 'contain':
+        parts.append(
+            f"[fg_src{tag}]scale=w={cw}:h={ch}:force_original_aspect_ratio=decrease[fg_main{tag}]")
+        fg = f"fg_main{tag}"
+    elif layout.feather_style == 'inset':
+        parts.append(
+            f"[fg_src{tag}]scale={sw}:{sh}:force_original_aspect_ratio=decrease[fg_main{tag}]")
+        fg = f"fg_main{tag}"
+    else:
+        fg = f"fg_src{tag}"
+
+    if f > 0:
+        parts.append(mask_chain(sw, sh, f, layout.feather_style, tag))
+        parts.append(f"[{fg}]format=yuva420p[fg_alpha{tag}]")
+        parts.append(
+            f"[fg_alpha{tag}][mask{tag}]alphamerge[fg_final{tag}]")
+        fg = f"fg_final{tag}"
+
+    # 居中叠加；overlay 需 format=auto 才能正确处理 alpha
+    if layout.fit == 'width' and layout.feather_style == 'edge':
+        pos = f"x=0:y={(ch - sh) // 2}"
+    else:
+        pos = "x=(W-w)/2:y=(H-h)/2"
+    parts.append(
+        f"[bg{tag}][{fg}]overlay={pos}:shortest=1:format=auto,format=yuv420p[outv{tag}]")
+    return ";".join(parts)
+
+
+def source_chain(layout: WallpaperLayout) -> str:
+    """源画面预处理：去黑边 -> 旋转 -> setsar (不含输出标签)"""
+    parts = []
+    if layout.crop:
+        w, h, x, y = layout.crop
+        parts.append(f"crop={w}:{h}:{x}:{y}")
+    parts.append("transpose=1" if layout.rotate else "copy")
+    return f"[0:v]{','.join(parts)},setsar=1"
+
+
+@lru_cache(maxsize=256)
+def build_graph(layout: WallpaperLayout) -> FilterGraph:
+    """单输出滤镜图，输出标签 [outv]"""
+    graph = f"{source_chain(layout)}[raw];" + layout_chain(layout, "raw")
+    return FilterGraph(graph, (layout.canvas_size,), ('[outv]',))
+
+
+@lru_cache(maxsize=256)
+def build_multi_graph(layouts: Tuple[WallpaperLayout, ...]) -> FilterGraph:
+    """
+    单次解码的多输出滤镜图：旋转一次后 split，每个布局输出 [outv0]、[outv1] ...
+    所有布局必须来自同一个源 (相同的 src_w、src_h、rotate、crop)
+    """
+    n = len(layouts)
+    chains: List[str] = [source_chain(layouts[0]) + f",split={n}" +
+                         "".join(f"[raw{i}]" for i in range(n))]
+    for i, layout in enumerate(layouts):
+        chains.append(layout_chain(layout, f"raw{i}", tag=str(i)))
+    return FilterGraph(";".join(chains),
+                       tuple(l.canvas_size for l in layouts),
+                       tuple(f"[outv{i}]" for i in range(n)))
@@ -0,0 +1,164 @@
+"""
+ffmpeg / ffprobe 可执行文件定位
+
+原先 GUI 对整个程序目录 rglob("*.exe")、ve_wallpaper 对脚本目录 os.walk，
+程序旁边有庞大的 output/ 或素材目录时，第一个任务开始前要先扫几秒钟。
+
+这里按固定顺序查找，命中即停：
+    1. 显式指定 (参数或环境变量 VE_FFMPEG，可为文件或所在目录)
+    2. ffmpeg_full_diagnostics.json 中登记的路径
+    3. ./ffmpeg/bin、./ffmpeg、程序目录本身
+    4. 系统 PATH
+    5. 限深扫描程序目录 (跳过 output、temp_processing 等目录)
+前四步都只是几次 stat，每次都重新检查，修改诊断文件或放入新版本立即生效；
+只有耗时的第 5 步的结果写入 .ve_cache/locate.json，文件仍存在时之后的启动直接使用。
+"""
+
+import os
+import json
+import shutil
+import logging
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional
+
+from ve_cache import CACHE_DIR_NAME, cache_dir
+
+logger = logging.getLogger(__name__)
+
+ENV_VAR = "VE_FFMPEG"
+DIAG_FILE = "ffmpeg_full_diagnostics.json"
+SCAN_DEPTH = 3
+SKIP_DIRS = {'output', 'temp_processing', CACHE_DIR_NAME, '.git', '__pycache__',
+             'node_modules', 'build', 'dist'}
+
+
+class FFmpegPaths(NamedTuple):
+    ffmpeg: Optional[str]
+    ffprobe: Optional[str]
+    source: str  # 命中的查找方式，便于日志说明
+
+
+def exe_name(name: str) -> str:
+    return name + ('.exe' if os.name == 'nt' else '')
+
+
+def _pair_in(directory) -> Optional[FFmpegPaths]:
+    """目录中同时存在 ffmpeg 与 ffprobe 时返回"""
+    directory = Path(directory)
+    ffmpeg, ffprobe = directory / exe_name('ffmpeg'), directory / exe_name('ffprobe')
+    if ffmpeg.is_file() and ffprobe.is_file():
+        return FFmpegPaths(str(ffmpeg), str(ffprobe), str(directory))
+    return None
+
+
+def _from_explicit(explicit) -> Optional[FFmpegPaths]:
+    path = Path(explicit)
+    found = _pair_in(path if path.is_dir() else path.parent)
+    if found and path.is_file():
+        found = found._replace(ffmpeg=str(path))
+    return found
+
+
+def _from_diagnostics(diag_file: Path) -> Optional[FFmpegPaths]:
+    try:
+        data = json.loads(diag_file.read_text(encoding='utf-8'))
+        ffmpeg = data['components']['ffmpeg']['path']
+        ffprobe = data['components']['ffprobe']['path']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if os.path.isfile(ffmpeg) and os.path.isfile(ffprobe):
+        return FFmpegPaths(ffmpeg, ffprobe, diag_file.name)
+    return None
+
+
+def _walk_dirs(root: Path, depth: int) -> Iterator[Path]:
+    """广度优先列出 root 下 depth 层以内的目录，跳过输出 / 临时 / 隐藏目录"""
+    level = [root]
+    for _ in range(depth + 1):
+        next_level = []
+        for directory in level:
+            yield directory
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if (entry.is_dir(follow_symlinks=False)
+                                and entry.name.lower() not in SKIP_DIRS
+                                and not entry.name.startswith('.')):
+                            next_level.append(Path(entry.path))
+            except OSError:
+                continue
+        level = next_level
+
+
+def _load_cache(path: Path) -> Dict[str, Dict[str, str]]:
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path: Path, key: str, found: FFmpegPaths) -> None:
+    data = _load_cache(path)
+    data[key] = {'ffmpeg': found.ffmpeg, 'ffprobe': found.ffprobe}
+    try:
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.debug(f"无法保存定位结果: {e}")
+
+
+def locate_ffmpeg(base_dir=None, explicit=None, diag_file: str = DIAG_FILE,
+                  scan_depth: int = SCAN_DEPTH) -> FFmpegPaths:
+    """
+    查找 ffmpeg 与 ffprobe
+
+    Args:
+        base_dir: 程序目录 (默认当前目录)，同时也是定位缓存所在的目录
+        explicit: 显式指定的 ffmpeg 路径或所在目录，优先级最高
+        diag_file: 诊断文件名 (相对 base_dir)
+        scan_depth: 兜底扫描的最大目录深度
+
+    Returns:
+        FFmpegPaths: 找不到时 ffmpeg / ffprobe 为 None
+    """
+    base = Path(base_dir or ".").resolve()
+    explicit = explicit or os.environ.get(ENV_VAR)
+    if explicit:
+        found = _from_explicit(explicit)
+        if found:
+            return found
+        logger.warning(f"指定的 ffmpeg 不可用: {explicit}")
+
+    found = _from_diagnostics(base / diag_file)
+    if not found:
+        for directory in (base / 'ffmpeg' / 'bin', base / 'ffmpeg', base):
+            found = _pair_in(directory)
+            if found:
+                break
+    if not found:
+        ffmpeg, ffprobe = shutil.which('ffmpeg'), shutil.which('ffprobe')
+        if ffmpeg and ffprobe:
+            found = FFmpegPaths(ffmpeg, ffprobe, 'PATH')
+    if found:
+        return found
+
+    # 只有兜底扫描使用缓存：上次扫到的文件仍存在时不再扫描
+    cache_path = None
+    if base.is_dir():
+        try:
+            cache_path = cache_dir(base) / "locate.json"
+        except OSError:
+            pass  # 程序目录只读时不缓存
+    key = str(base)
+    if cache_path is not None:
+        cached = _load_cache(cache_path).get(key)
+        if cached and all(os.path.isfile(cached.get(k) or '') for k in ('ffmpeg', 'ffprobe')):
+            return FFmpegPaths(cached['ffmpeg'], cached['ffprobe'], 'cache')
+
+    found = next(filter(None, (_pair_in(d) for d in _walk_dirs(base, scan_depth))), None)
+    if not found:
+        return FFmpegPaths(None, None, 'missing')
+    if cache_path is not None:
+        _save_cache(cache_path, key, found)
+    return found
@@ -0,0 +1,132 @@
+"""
+渲染任务清单 (断点续跑)
+
+每完成一个输出文件就在工作目录的 .ve_cache/manifest.sqlite 记录一条：
+源文件指纹、滤镜/编码参数摘要、输出文件大小与 SHA-256。
+重新运行时，源文件与参数都未变化且输出文件完好的任务直接跳过，
+缺失、残缺或参数已变化的任务重新渲染。
+
+输出先写到 "<名称>.partial<后缀>" 临时文件，成功后再原子重命名，
+崩溃留下的半成品不会被误认为已完成。
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+from pathlib import Path
+from typing import Any, Optional
+
+from ve_cache import cache_dir, file_key
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_TAG = ".partial"
+
+
+def params_digest(*parts: Any) -> str:
+    """滤镜图与编码参数的摘要，参数任何变化都会使旧记录失效"""
+    blob = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+def file_sha256(path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def partial_path(target) -> Path:
+    """临时输出路径：保留原后缀，让 ffmpeg 仍能按扩展名选择封装格式"""
+    target = Path(target)
+    return target.with_name(f"{target.stem}{PARTIAL_TAG}{target.suffix}")
+
+
+def commit_output(partial, target) -> None:
+    """把写完的临时文件原子替换为正式输出"""
+    os.replace(str(partial), str(target))
+
+
+def discard_output(partial) -> None:
+    try:
+        os.remove(str(partial))
+    except FileNotFoundError:
+        pass
+
+
+def sweep_partials(output_dir) -> int:
+    """删除上次崩溃遗留的临时输出文件，返回删除个数"""
+    removed = 0
+    for path in Path(output_dir).rglob(f"*{PARTIAL_TAG}.*"):
+        if path.is_file():
+            discard_output(path)
+            removed += 1
+    return removed
+
+
+class RenderManifest:
+    """已完成输出的持久化记录"""
+
+    def __init__(self, work_dir=None):
+        self.db_path = cache_dir(work_dir) / "manifest.sqlite"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            str(self.db_path), timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "output TEXT PRIMARY KEY, source TEXT, source_size INTEGER, "
+                "source_mtime_ns INTEGER, params TEXT, output_size INTEGER, "
+                "output_mtime_ns INTEGER, output_sha256 TEXT, encoder TEXT, "
+                "finished_at REAL)")
+
+    def is_complete(self, output, source, params: str, verify_hash: bool = False) -> bool:
+        """
+        判断某个输出是否已按当前源文件和参数渲染完成
+
+        Args:
+            output: 输出文件路径
+            source: 源视频路径
+            params: params_digest() 的结果
+            verify_hash: 是否重新计算输出文件哈希 (默认只比较大小和 mtime)
+        """
+        output = os.path.abspath(str(output))
+        with self._lock:
+            row = self._db.execute(
+                "SELECT source, source_size, source_mtime_ns, params, output_size, "
+                "output_mtime_ns, output_sha256 FROM jobs WHERE output = ?",
+                (output,)).fetchone()
+        if not row or row[3] != params:
+            return False
+        try:
+            if tuple(row[:3]) != file_key(source):
+                return False
+            _, out_size, out_mtime = file_key(output)
+        except FileNotFoundError:
+            return False
+        if (out_size, out_mtime) != (row[4], row[5]):
+            return False
+        return not verify_hash or file_sha256(output) == row[6]
+
+    def encoder_of(self, output) -> Optional[str]:
+        """已登记输出所用的编码器，没有记录时为 None"""
+        with self._lock:
+            row = self._db.execute("SELECT encoder FROM jobs WHERE output = ?",
+                                   (os.path.abspath(str(output)),)).fetchone()
+        return row[0] if row else None
+
+    def record(self, output, source, params: str, encoder: Optional[str] = None) -> None:
+        """登记一个已完成的输出 (应在 commit_output 之后调用)"""
+        out_path, out_size, out_mtime = file_key(output)
+        src_path, src_size, src_mtime = file_key(source)
+        sha = file_sha256(out_path)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (out_path, src_path, src_size, src_mtime, params, out_size,
+                 out_mtime, sha, encoder, time.time()))
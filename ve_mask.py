@@ -0,0 +1,93 @@
+"""
+预生成的边缘羽化遮罩
+
+原方案用 geq 表达式逐帧、逐像素计算羽化 alpha，是整条流水线最慢的环节。
+这里按 (宽, 高, 羽化宽度) 只生成一次灰度遮罩，保存为 PGM 图片缓存到
+.ve_cache/masks，再作为循环图片输入交给 alphamerge，逐帧只剩一次通道合并。
+
+遮罩数值与原 geq 表达式逐像素一致 (左右边优先，其次上下边)。
+有 NumPy 时向量化生成，没有时退回纯 Python。
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+
+from ve_cache import cache_dir
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+_paths: Dict[Tuple[Path, int, int, int], Path] = {}
+_lock = threading.Lock()
+
+
+def _axis_ramp(n: int, feather: int):
+    """单个方向上的渐变值，位于羽化带之外的位置为 None"""
+    return [i / feather if i < feather else
+            (n - i) / feather if i > n - feather else None
+            for i in range(n)]
+
+
+def feather_mask_bytes(width: int, height: int, feather: int) -> bytes:
+    """
+    生成 8 位灰度遮罩的原始像素 (逐行)
+
+    等价于 geq 表达式:
+        if(lt(X,F), X/F, if(gt(X,W-F), (W-X)/F,
+        if(lt(Y,F), Y/F, if(gt(Y,H-F), (H-Y)/F, 1))))*255
+    """
+    if HAS_NUMPY:
+        x = np.arange(width, dtype=np.float64)
+        y = np.arange(height, dtype=np.float64)
+        col = np.where(x < feather, x / feather,
+                       np.where(x > width - feather, (width - x) / feather, np.nan))
+        row = np.where(y < feather, y / feather,
+                       np.where(y > height - feather, (height - y) / feather, 1.0))
+        alpha = np.where(np.isnan(col)[None, :], row[:, None], col[None, :])
+        return (alpha * 255).astype(np.uint8).tobytes()
+
+    cols = _axis_ramp(width, feather)
+    rows = [1.0 if v is None else v for v in _axis_ramp(height, feather)]
+    cache: Dict[float, bytes] = {}
+    out = bytearray()
+    for row_value in rows:
+        line = cache.get(row_value)
+        if line is None:
+            line = bytes(int((row_value if c is None else c) * 255) for c in cols)
+            cache[row_value] = line
+        out += line
+    return bytes(out)
+
+
+def feather_mask_path(width: int, height: int, feather: int, work_dir=None) -> Path:
+    """
+    返回 (宽, 高, 羽化宽度) 对应的 PGM 遮罩文件路径，不存在时生成一次
+
+    Args:
+        width, height: 前景层尺寸
+        feather: 羽化宽度 (像素)
+        work_dir: 缓存所在的工作目录，默认当前目录
+    """
+    root = cache_dir(work_dir)
+    key = (root, width, height, feather)
+    with _lock:
+        path = _paths.get(key)
+        if path is not None and path.exists():
+            return path
+
+        mask_dir = root / "masks"
+        mask_dir.mkdir(exist_ok=True)
+        path = mask_dir / f"feather_{width}x{height}_{feather}.pgm"
+        if not path.exists():
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp, 'wb') as f:
+                f.write(b"P5\n%d %d\n255\n" % (width, height))
+                f.write(feather_mask_bytes(width, height, feather))
+            os.replace(tmp, path)
+        _paths[key] = path
+        return path
@@ -0,0 +1,229 @@
+"""
+ffmpeg -progress 输出解析
+
+ffmpeg 加上 "-progress pipe:1" 后，会在 stdout 周期性输出 key=value 块，
+每块以 progress=continue / progress=end 结束：
+
+    frame=120
+    fps=59.94
+    bitrate= 812.3kbits/s
+    total_size=1048576
+    out_time_us=4000000
+    speed=1.98x
+    progress=continue
+
+(bitrate、speed 按固定宽度输出，值前可能带空格，如 "speed= 1.5x")
+
+ProgressParser 逐行喂入，每收齐一块返回一个 ProgressSnapshot，
+各引擎的 tqdm / rich 进度条和 Qt 信号都从快照取帧数、速度和剩余时间。
+
+总帧数优先取 nb_frames；MKV / WebM 等容器常缺这一项，
+此时按 时长 × avg_frame_rate 估算，仍不可得时用 ffprobe -count_packets 实数
+(结果写回探测缓存，同一文件只数一次)。
+"""
+
+import re
+import subprocess
+import logging
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from ve_cache import get_probe_cache, no_window_kwargs, video_stream
+
+logger = logging.getLogger(__name__)
+
+_LINE = re.compile(r'^([a-z0-9_]+)=\s*(\S*)$')
+
+
+@dataclass
+class ProgressSnapshot:
+    """一个 -progress 块的解析结果"""
+    frame: int = 0
+    fps: float = 0.0
+    speed: float = 0.0          # 相对实时的倍速，如 1.98
+    out_time_us: int = 0        # 已输出时长 (微秒)
+    bitrate_kbps: float = 0.0
+    total_size: int = 0         # 已写出字节数
+    total_frames: int = 0       # 0 表示未知
+    finished: bool = False      # 收到 progress=end
+
+    @property
+    def percent(self) -> int:
+        if self.finished:
+            return 100
+        if self.total_frames <= 0:
+            return 0
+        return min(100, int(self.frame * 100 / self.total_frames))
+
+    @property
+    def eta(self) -> Optional[float]:
+        """按当前帧率估算的剩余秒数，无法估算时为 None"""
+        if self.finished:
+            return 0.0
+        if self.total_frames <= 0 or self.fps <= 0:
+            return None
+        return max(0.0, (self.total_frames - self.frame) / self.fps)
+
+    def describe(self) -> str:
+        """简短的吞吐量说明，如 '59.9fps 1.98x ETA 00:12'"""
+        text = f"{self.fps:.1f}fps {self.speed:.2f}x"
+        eta = self.eta
+        if eta is not None:
+            m, s = divmod(int(eta), 60)
+            text += f" ETA {m:02d}:{s:02d}"
+        return text
+
+
+def _number(value: str, cast=float):
+    """ffmpeg 对未知值输出 N/A，单位后缀 (x, kbits/s) 需去掉"""
+    value = value.rstrip('x').replace('kbits/s', '')
+    try:
+        return cast(value)
+    except ValueError:
+        return None
+
+
+class ProgressParser:
+    """
+    逐行解析 -progress 输出，忽略混入的 stderr 日志等其它行
+
+    (python -m doctest ve_progress.py 运行下面的示例，输入为 ffmpeg 的实际输出)
+
+    >>> parser = ProgressParser(total_frames=240)
+    >>> block = ["frame=60", "fps=29.97", "stream_0_0_q=28.0", "bitrate= 812.3kbits/s",
+    ...          "total_size=262192", "out_time_us=2002000", "out_time_ms=2002000",
+    ...          "out_time=00:00:02.002000", "dup_frames=0", "drop_frames=0",
+    ...          "speed= 1.5x", "progress=continue"]
+    >>> snap = [parser.feed(line) for line in block][-1]
+    >>> snap.frame, snap.fps, snap.speed, snap.bitrate_kbps, snap.percent
+    (60, 29.97, 1.5, 812.3, 25)
+    >>> snap.describe()
+    '30.0fps 1.50x ETA 00:06'
+    >>> snap = [parser.feed(line) for line in
+    ...         ["frame=240", "bitrate=N/A", "speed=N/A", "progress=end"]][-1]
+    >>> snap.speed, snap.bitrate_kbps, snap.finished
+    (1.5, 812.3, True)
+    """
+
+    def __init__(self, total_frames: int = 0):
+        self.total_frames = total_frames
+        self.last = ProgressSnapshot(total_frames=total_frames)
+        self._block: Dict[str, str] = {}
+
+    def feed(self, line: str) -> Optional[ProgressSnapshot]:
+        """喂入一行，收齐一个块时返回快照，否则返回 None"""
+        m = _LINE.match(line.strip())
+        if not m:
+            return None
+        key, value = m.groups()
+        if key != 'progress':
+            self._block[key] = value
+            return None
+
+        block, self._block = self._block, {}
+        prev = self.last
+        frame = _number(block.get('frame', ''), int)
+        fps = _number(block.get('fps', ''))
+        speed = _number(block.get('speed', ''))
+        out_time = _number(block.get('out_time_us', block.get('out_time_ms', '')), int)
+        bitrate = _number(block.get('bitrate', ''))
+        size = _number(block.get('total_size', ''), int)
+        self.last = ProgressSnapshot(
+            frame=prev.frame if frame is None else frame,
+            fps=prev.fps if fps is None else fps,
+            speed=prev.speed if speed is None else speed,
+            out_time_us=prev.out_time_us if out_time is None else out_time,
+            bitrate_kbps=prev.bitrate_kbps if bitrate is None else bitrate,
+            total_size=prev.total_size if size is None else size,
+            total_frames=self.total_frames,
+            finished=value == 'end')
+        return self.last
+
+
+def iter_progress(lines: Iterable[str], total_frames: int = 0) -> Iterator[ProgressSnapshot]:
+    """从 ffmpeg stdout 的行迭代器中逐个产出快照"""
+    parser = ProgressParser(total_frames)
+    for line in lines:
+        snap = parser.feed(line)
+        if snap is not None:
+            yield snap
+
+
+def _rate(value: Optional[str]) -> float:
+    """'30000/1001' -> 29.97，无效值返回 0"""
+    try:
+        rate = Fraction(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return 0.0
+    return float(rate)
+
+
+def _positive_int(value: Any) -> int:
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def count_packets(path, ffprobe_path='ffprobe') -> int:
+    """用 ffprobe -count_packets 数出视频流的包数 (需读完整个文件)"""
+    cmd = [str(ffprobe_path), '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+           '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0', str(path)]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                check=True, **no_window_kwargs())
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"ffprobe 数帧失败 {path}: {e}")
+        return 0
+    return _positive_int(result.stdout.decode('utf-8', errors='replace').strip())
+
+
+def estimate_total_frames(path, probe: Optional[Dict[str, Any]] = None,
+                          ffprobe_path='ffprobe', allow_count: bool = True,
+                          work_dir=None) -> int:
+    """
+    视频总帧数：nb_frames -> 时长 × avg_frame_rate -> -count_packets
+
+    Args:
+        path: 视频文件路径
+        probe: 已有的 ffprobe 结果，None 时从缓存读取 (必要时探测)
+        ffprobe_path: ffprobe 可执行文件
+        allow_count: 前两种方式都失败时是否允许逐包计数
+        work_dir: 探测缓存所在的工作目录
+
+    Returns:
+        int: 总帧数，未知时为 0
+    """
+    cache = get_probe_cache(work_dir)
+    if probe is None:
+        try:
+            probe = cache.probe(path, ffprobe_path)
+        except Exception as e:
+            logger.warning(f"无法读取视频信息 {path}: {e}")
+            return 0
+    stream = video_stream(probe) or {}
+
+    frames = _positive_int(stream.get('nb_frames'))
+    if frames:
+        return frames
+
+    duration = _number(str(stream.get('duration') or
+                           probe.get('format', {}).get('duration') or ''))
+    rate = _rate(stream.get('avg_frame_rate')) or _rate(stream.get('r_frame_rate'))
+    if duration and rate:
+        return int(round(duration * rate))
+
+    frames = _positive_int(stream.get('nb_read_packets'))
+    if frames or not allow_count:
+        return frames
+
+    frames = count_packets(path, ffprobe_path)
+    if frames:
+        # 写回缓存，下次直接命中
+        stream['nb_read_packets'] = str(frames)
+        try:
+            cache.put(path, probe)
+        except OSError:
+            pass
+    return frames
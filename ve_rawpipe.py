@@ -0,0 +1,333 @@
+"""
+rawvideo 管道合成引擎 (NumPy)
+
+壁纸合成原先全部写在 ffmpeg 滤镜表达式里：羽化遮罩要经 alphamerge + overlay
+逐帧合并，想加自定义效果也只能借助 geq 这类逐像素求值的表达式。
+这里把合成挪到 Python：
+
+    解码进程  ffmpeg 解码 -> 背景链 (ve_filtergraph.background_chain) 与缩放后的前景
+              vstack 成一帧 yuv444p rawvideo，写到 stdout
+    合成      readinto 读入预分配的 NumPy 帧缓冲 (不逐帧分配内存)，按羽化遮罩
+              在缓冲内就地做整数乘加，把前景混合进背景区域
+    编码进程  背景区域的三个平面按内存视图直接写入编码器 stdin (不复制)，
+              编码器再从源文件取音轨
+
+解码、合成、编码分别在三个线程中重叠执行，帧缓冲在有界队列间循环使用
+(QUEUE_DEPTH 帧)，任一环节变慢时其余环节自然等待，内存占用固定。
+遮罩按布局的 feather_style 用滤镜图里同一段遮罩滤镜 (ve_filtergraph.mask_chain)
+由 ffmpeg 渲染一次再读入，与 alphamerge 用的遮罩逐像素相同；只有羽化带内的像素
+参与混合，遮罩全不透明的内部直接复制。输出与滤镜图渲染并非逐位一致：这里在
+yuv444p 上逐像素混合，overlay 在 yuva420p 上按子采样后的 alpha 混合色度，
+两者只在羽化带的色度和舍入上有细微差别。
+
+使用 yuv444p 而不是 rgb24：混合是线性运算，在 YUV 上与在 RGB 上结果相同，
+还省去两次色彩空间转换及其矩阵 / 色彩范围问题。
+需要 NumPy；没有时 HAS_NUMPY 为 False，调用方应改用滤镜图渲染。
+"""
+
+import queue
+import threading
+import subprocess
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from ve_cache import get_probe_cache, no_window_kwargs, video_stream
+from ve_encoders import global_args, upload_outputs
+from ve_filtergraph import WallpaperLayout, background_chain, mask_chain, source_chain
+from ve_supervisor import kill_tree, start_process
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+logger = logging.getLogger(__name__)
+
+PIX_FMT = 'yuv444p'
+PLANES = 3
+QUEUE_DEPTH = 4       # 在各环节间循环的帧缓冲个数
+DEFAULT_RATE = '30'   # 探测不到帧率时使用
+
+
+def frame_rate(path, ffprobe='ffprobe') -> str:
+    """源视频的平均帧率 (如 '30000/1001')，用于解码端转恒定帧率与编码端的 -r"""
+    try:
+        stream = video_stream(get_probe_cache().probe(path, ffprobe)) or {}
+    except Exception as e:
+        logger.warning(f"无法读取帧率 {path}: {e}")
+        return DEFAULT_RATE
+    for key in ('avg_frame_rate', 'r_frame_rate'):
+        rate = stream.get(key) or ''
+        if rate and not rate.startswith('0'):
+            return rate
+    return DEFAULT_RATE
+
+
+def foreground_box(layout: WallpaperLayout) -> Tuple[int, int, int, int]:
+    """前景在画布中的 (宽, 高, x, y)，与 ve_filtergraph.layout_chain 的摆放一致"""
+    w, h = layout.frame_size
+    cw, ch = layout.canvas_size
+    if layout.fit == 'contain':
+        scale = min(cw / w, ch / h)
+        fw, fh = int(w * scale) // 2 * 2, int(h * scale) // 2 * 2
+    else:
+        fw, fh = min((w // 2) * 2, cw), min((h // 2) * 2, ch)
+    return fw, fh, (cw - fw) // 2, (ch - fh) // 2
+
+
+@lru_cache(maxsize=8)
+def render_mask(width: int, height: int, feather: int, style: str = 'edge',
+                ffmpeg='ffmpeg') -> bytes:
+    """
+    用 ffmpeg 渲染滤镜图中的羽化遮罩 (与 layout_chain 同一段滤镜)
+
+    Returns:
+        bytes: width × height 的 gray 原始像素
+    """
+    cmd = [str(ffmpeg), '-nostdin', '-loglevel', 'error',
+           '-filter_complex', mask_chain(width, height, feather, style),
+           '-map', '[mask]', '-frames:v', '1', '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1']
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            **no_window_kwargs())
+    if result.returncode != 0 or len(result.stdout) != width * height:
+        stderr = result.stderr.decode('utf-8', 'ignore').strip()
+        raise RuntimeError(f"无法渲染 {width}x{height} 羽化遮罩: {stderr}")
+    return result.stdout
+
+
+class FeatherBlender:
+    """把前景按羽化遮罩就地混合进背景 (全部缓冲在构造时分配)"""
+
+    def __init__(self, width: int, height: int, mask: Optional[bytes] = None):
+        """mask 为 width × height 的 gray 像素 (render_mask)，None 表示不羽化"""
+        self.width, self.height = width, height
+        self.regions = []  # (y 切片, x 切片, alpha, 1-alpha, 两个临时缓冲)
+        self.inner: Optional[Tuple[slice, slice]] = (slice(0, height), slice(0, width))
+        if mask is None:
+            return
+        mask = np.frombuffer(mask, dtype=np.uint8).reshape(height, width)
+        opaque = mask == 255
+        rows = np.flatnonzero(opaque.any(axis=1))
+        cols = np.flatnonzero(opaque.any(axis=0))
+        if rows.size and cols.size:
+            y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            if not opaque[y0:y1, x0:x1].all():
+                y0 = y1 = x0 = x1 = 0
+        else:
+            y0 = y1 = x0 = x1 = 0
+        if y1 > y0 and x1 > x0:
+            self.inner = (slice(y0, y1), slice(x0, x1))
+            # 内部矩形以外的羽化带: 上、下两条整行，左、右两条 (只含中间行)
+            bands = [(slice(0, y0), slice(0, width)), (slice(y1, height), slice(0, width)),
+                     (slice(y0, y1), slice(0, x0)), (slice(y0, y1), slice(x1, width))]
+        else:
+            self.inner = None
+            bands = [(slice(0, height), slice(0, width))]
+        for ys, xs in bands:
+            alpha = mask[ys, xs].astype(np.uint16)
+            if alpha.size == 0:
+                continue
+            shape = (PLANES, *alpha.shape)
+            self.regions.append((ys, xs, alpha, 255 - alpha,
+                                 np.empty(shape, np.uint16), np.empty(shape, np.uint16)))
+
+    def blend(self, bg, fg) -> None:
+        """
+        bg = (fg × a + bg × (255 - a)) / 255，逐平面就地计算
+
+        Args:
+            bg: 背景中前景所在区域的视图，形如 (3, 高, 宽)
+            fg: 前景视图，形状与 bg 相同
+        """
+        if self.inner is not None:
+            ys, xs = self.inner
+            np.copyto(bg[:, ys, xs], fg[:, ys, xs])
+        for ys, xs, alpha, inv, acc, tmp in self.regions:
+            np.multiply(fg[:, ys, xs], alpha, out=acc)
+            np.multiply(bg[:, ys, xs], inv, out=tmp)
+            np.add(acc, tmp, out=acc)
+            # 精确的 x / 255 四舍五入: (x + 128 + ((x + 128) >> 8)) >> 8
+            np.add(acc, 128, out=acc)
+            np.right_shift(acc, 8, out=tmp)
+            np.add(acc, tmp, out=acc)
+            np.right_shift(acc, 8, out=acc)
+            np.copyto(bg[:, ys, xs], acc, casting='unsafe')
+
+
+def decode_cmd(source, layout: WallpaperLayout, rate: str, ffmpeg='ffmpeg') -> List[str]:
+    """解码进程：背景 (画布大小) 在上、前景 (左对齐补到画布宽) 在下，输出 rawvideo"""
+    cw, _ = layout.canvas_size
+    fw, fh, _, _ = foreground_box(layout)
+    graph = (f"{source_chain(layout)},split=2[bg_src][fg_src];"
+             f"[bg_src]{background_chain(layout)}[bg];"
+             f"[fg_src]scale={fw}:{fh},pad={cw}:{fh}:0:0[fg];"
+             f"[bg][fg]vstack,format={PIX_FMT}[out]")
+    return [str(ffmpeg), '-nostdin', '-loglevel', 'error', '-i', str(source),
+            '-filter_complex', graph, '-map', '[out]', '-r', rate,
+            '-f', 'rawvideo', '-pix_fmt', PIX_FMT, 'pipe:1']
+
+
+def encode_cmd(source, target, layout: WallpaperLayout, rate: str,
+               video_args: Callable[[str], List[str]], encoder: str,
+               ffmpeg='ffmpeg') -> List[str]:
+    """编码进程：stdin 读 rawvideo，音轨直接取自源文件"""
+    cw, ch = layout.canvas_size
+    filter_str, labels = upload_outputs("[0:v]format=yuv420p[enc]", ('[enc]',), encoder)
+    return [str(ffmpeg), '-y', '-loglevel', 'error', *global_args(encoder),
+            '-f', 'rawvideo', '-pix_fmt', PIX_FMT, '-s', f"{cw}x{ch}", '-r', rate,
+            '-i', 'pipe:0', '-i', str(source), '-filter_complex', filter_str,
+            *video_args(labels[0]), '-map', '1:a?', '-c:a', 'copy', '-shortest', str(target)]
+
+
+def _read_frame(stream, view: memoryview) -> bool:
+    """把一整帧读入 view，管道结束 (含不完整的末帧) 时返回 False"""
+    got, size = 0, len(view)
+    while got < size:
+        n = stream.readinto(view[got:])
+        if not n:
+            return False
+        got += n
+    return True
+
+
+def render_rawpipe(source, target, layout: WallpaperLayout,
+                   video_args: Callable[[str], List[str]], encoder: str = 'libx264',
+                   ffmpeg='ffmpeg', ffprobe='ffprobe', rate: Optional[str] = None,
+                   on_progress: Optional[Callable[[int], None]] = None,
+                   should_stop: Optional[Callable[[], bool]] = None) -> bool:
+    """
+    用 NumPy 合成渲染一个布局
+
+    Args:
+        source: 源视频
+        target: 输出路径
+        layout: 壁纸布局 (背景链、前景尺寸、羽化宽度与风格)
+        video_args: 输出标签 -> 视频参数 (-map 与编码参数，不含音频)
+        encoder: 编码器名称 (决定硬件设备参数与是否需要 hwupload)
+        rate: 帧率，None 时从探测缓存读取
+        on_progress: 已合成帧数的回调
+        should_stop: 返回 True 时取消
+
+    Returns:
+        bool: 两个进程都成功退出时为 True
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError("rawvideo 合成需要 NumPy")
+    rate = rate or frame_rate(source, ffprobe)
+    cw, ch = layout.canvas_size
+    fw, fh, x, y = foreground_box(layout)
+    mask = (render_mask(fw, fh, layout.feather, layout.feather_style, ffmpeg)
+            if layout.feather > 0 else None)
+    blender = FeatherBlender(fw, fh, mask)
+    # 每帧: 3 个平面，每个平面为画布高 + 前景高行
+    frames = [np.empty((PLANES, ch + fh, cw), np.uint8) for _ in range(QUEUE_DEPTH)]
+    free: "queue.Queue" = queue.Queue()
+    for buf in frames:
+        free.put(buf)
+    decoded: "queue.Queue" = queue.Queue(maxsize=QUEUE_DEPTH)
+    composed: "queue.Queue" = queue.Queue(maxsize=QUEUE_DEPTH)
+    failed = threading.Event()
+
+    decoder, dec_err = start_process(decode_cmd(source, layout, rate, ffmpeg),
+                                     stdout=subprocess.PIPE)
+    encoder_proc, enc_err = start_process(
+        encode_cmd(source, target, layout, rate, video_args, encoder, ffmpeg),
+        stdin=subprocess.PIPE)
+
+    def stopping() -> bool:
+        return failed.is_set() or bool(should_stop and should_stop())
+
+    def put(q: "queue.Queue", item) -> bool:
+        """放入有界队列，等待期间检查取消"""
+        while not stopping():
+            try:
+                q.put(item, timeout=0.25)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q: "queue.Queue"):
+        while not stopping():
+            try:
+                return q.get(timeout=0.25)
+            except queue.Empty:
+                continue
+        return None
+
+    def decode() -> None:
+        try:
+            while True:
+                buf = get(free)
+                if buf is None:
+                    return
+                if not _read_frame(decoder.stdout, memoryview(buf).cast('B')):
+                    break
+                if not put(decoded, buf):
+                    return
+        except (OSError, ValueError) as e:
+            logger.error(f"读取解码输出失败: {e}")
+            failed.set()
+        put(decoded, None)
+
+    def encode() -> None:
+        try:
+            while True:
+                buf = get(composed)
+                if buf is None:
+                    break
+                # 背景区域在每个平面内是连续的前 ch 行，直接写出内存视图
+                for plane in buf:
+                    encoder_proc.stdin.write(memoryview(plane[:ch]).cast('B'))
+                free.put(buf)
+        except (BrokenPipeError, OSError, ValueError) as e:
+            logger.error(f"写入编码器失败: {e}")
+            failed.set()
+        finally:
+            try:
+                encoder_proc.stdin.close()
+            except OSError:
+                pass
+
+    workers = [threading.Thread(target=decode, name='rawpipe-decode', daemon=True),
+               threading.Thread(target=encode, name='rawpipe-encode', daemon=True)]
+    for t in workers:
+        t.start()
+
+    count = 0
+    try:
+        while True:
+            buf = get(decoded)
+            if buf is None:
+                break
+            blender.blend(buf[:, y:y + fh, x:x + fw], buf[:, ch:ch + fh, :fw])
+            if not put(composed, buf):
+                break
+            count += 1
+            if on_progress:
+                on_progress(count)
+    except BaseException:
+        # 合成或进度回调出错：让两个工作线程都退出等待，并结束进程
+        failed.set()
+        raise
+    finally:
+        put(composed, None)
+        if stopping():
+            kill_tree(decoder)
+            kill_tree(encoder_proc)
+        for t in workers:
+            t.join()
+        dec_code, enc_code = decoder.wait(), encoder_proc.wait()
+
+    if should_stop and should_stop():
+        return False
+    if dec_code != 0 or enc_code != 0 or failed.is_set() or count == 0:
+        stderr = "\n".join(dec_err.lines()[-10:] + enc_err.lines()[-10:])
+        logger.error(f"rawvideo 合成失败: {Path(source).name} "
+                     f"(解码 {dec_code}, 编码 {enc_code})\n{stderr}")
+        return False
+    logger.info(f"rawvideo 合成完成: {Path(source).name} ({count} 帧)")
+    return True
@@ -0,0 +1,308 @@
+"""
+按实测资源占用做任务准入
+
+并发渲染时只按编码器会话数限流，4K 源 + split + gblur 的任务同时跑几个就会把
+机器推进 swap。这里记录每次 ffmpeg 运行的实测峰值 RSS 与平均占用核数
+(Linux 下读取 /proc，含子进程)，按 "滤镜图变体 + 分辨率" 存入
+.ve_cache/resources.json，下一批任务据此预测占用：
+
+    同变体同分辨率有记录    直接使用 (指数滑动平均，峰值取最大)
+    同变体其它分辨率有记录  按每百万像素的占用线性换算
+    没有任何记录            DEFAULT_MB_PER_MPIXEL / DEFAULT_CORES
+
+Admission 在预测的内存与 CPU 都放得下时才放行新任务 (先到先得，
+没有任务在运行时总会放行一个，避免预测偏大时永远不开工)。
+可选对每个 ffmpeg 进程设置 RLIMIT_DATA 作为兜底，超限的进程直接失败而不是拖垮整机。
+RLIMIT_DATA 限制的是私有可写的虚拟内存 (线程栈、硬件加速映射、编码器内存池等
+常常是 RSS 的数倍)，所以上限按单个进程实测的 VmData 峰值计算，而不是 RSS；
+还没有 VmData 记录时不设上限。
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from ve_cache import cache_dir
+
+try:
+    import resource
+    HAS_RLIMIT = hasattr(resource, 'prlimit')
+except ImportError:
+    HAS_RLIMIT = False
+
+logger = logging.getLogger(__name__)
+
+PROC = Path("/proc")
+HAS_PROC = (PROC / "self" / "stat").exists()
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+SAMPLE_INTERVAL = 1.0        # 监督循环中采样的最小间隔 (秒)
+EWMA_ALPHA = 0.3             # 新样本在滑动平均中的权重
+DEFAULT_MB_PER_MPIXEL = 150  # 无记录时每百万像素 (源分辨率) 预计的内存占用
+DEFAULT_CORES = 2.0          # 无记录时预计的占用核数
+MEMORY_HEADROOM = 0.8        # 默认内存预算 = 可用内存 × 该比例
+RLIMIT_FACTOR = 1.5          # RLIMIT_DATA = 单进程 VmData 实测峰值 × 该倍数
+
+
+class Demand(NamedTuple):
+    """一个任务预计占用的资源"""
+    mem_mb: float
+    cores: float
+
+
+@dataclass
+class Usage:
+    """一次运行的实测资源占用"""
+    peak_rss_mb: float = 0.0
+    peak_data_mb: float = 0.0    # 单个进程 VmData 的峰值 (RLIMIT_DATA 的计量口径)
+    cpu_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+    @property
+    def cores(self) -> float:
+        return self.cpu_seconds / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+
+def _children(pid: int) -> List[int]:
+    kids: List[int] = []
+    try:
+        for task in (PROC / str(pid) / "task").iterdir():
+            text = (task / "children").read_text()
+            kids.extend(int(c) for c in text.split())
+    except (OSError, ValueError):
+        pass
+    return kids
+
+
+def _vm_data_mb(pid: int) -> float:
+    """/proc/<pid>/status 中的 VmData (私有可写虚拟内存)，读取失败时为 0"""
+    try:
+        for line in (PROC / str(pid) / "status").read_text().splitlines():
+            if line.startswith("VmData:"):
+                return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0.0
+
+
+def _proc_stat(pid: int):
+    """(RSS 字节, 累计 CPU 秒)，进程已退出时返回 None"""
+    try:
+        stat = (PROC / str(pid) / "stat").read_text()
+    except OSError:
+        return None
+    # comm 字段可能含空格，从最后一个 ')' 之后开始按空格切分
+    fields = stat[stat.rfind(')') + 2:].split()
+    utime, stime, rss_pages = int(fields[11]), int(fields[12]), int(fields[21])
+    return rss_pages * PAGE_SIZE, (utime + stime) / CLOCK_TICKS
+
+
+class ProcessSampler:
+    """对一个进程树反复采样，累计峰值 RSS、单进程 VmData 峰值与 CPU 时间 (非 Linux 下为空操作)"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.started = time.monotonic()
+        self.usage = Usage()
+        self._cpu: Dict[int, float] = {}
+        self._last = 0.0
+
+    def sample(self, force: bool = False) -> Usage:
+        now = time.monotonic()
+        if not HAS_PROC or (not force and now - self._last < SAMPLE_INTERVAL):
+            return self.usage
+        self._last = now
+        rss_total = 0
+        pending, seen = [self.pid], set()
+        while pending:
+            pid = pending.pop()
+            if pid in seen:
+                continue
+            seen.add(pid)
+            stat = _proc_stat(pid)
+            if stat is None:
+                continue
+            rss, cpu = stat
+            rss_total += rss
+            self.usage.peak_data_mb = max(self.usage.peak_data_mb, _vm_data_mb(pid))
+            # 已退出的子进程保留最后一次读数
+            self._cpu[pid] = max(self._cpu.get(pid, 0.0), cpu)
+            pending.extend(_children(pid))
+        self.usage.peak_rss_mb = max(self.usage.peak_rss_mb, rss_total / (1 << 20))
+        self.usage.cpu_seconds = sum(self._cpu.values())
+        self.usage.wall_seconds = now - self.started
+        return self.usage
+
+
+def limit_memory(pid: int, mem_mb: float) -> bool:
+    """为已启动的进程设置 RLIMIT_DATA (仅 Linux)，成功时返回 True
+
+    mem_mb 应来自 VmData 的实测 (ResourceModel.memory_limit)，按 RSS 推算会误杀正常任务"""
+    if not HAS_RLIMIT or mem_mb <= 0:
+        return False
+    limit = int(mem_mb * (1 << 20))
+    try:
+        resource.prlimit(pid, resource.RLIMIT_DATA, (limit, limit))
+    except (OSError, ValueError) as e:
+        logger.debug(f"无法设置内存上限 {pid}: {e}")
+        return False
+    return True
+
+
+def available_memory_mb() -> float:
+    """/proc/meminfo 中的 MemAvailable，无法读取时为 0"""
+    try:
+        for line in (PROC / "meminfo").read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0.0
+
+
+class ResourceModel:
+    """实测资源占用记录，按 "变体:宽x高" 存储"""
+
+    def __init__(self, work_dir=None):
+        self.path = cache_dir(work_dir) / "resources.json"
+        self._lock = threading.Lock()
+        try:
+            self._data: Dict[str, Dict[str, float]] = json.loads(
+                self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            self._data = {}
+
+    @staticmethod
+    def key(variant: str, width: int, height: int) -> str:
+        return f"{variant}:{width}x{height}"
+
+    def predict(self, variant: str, width: int, height: int) -> Demand:
+        mpix = max(width * height / 1e6, 0.1)
+        with self._lock:
+            exact = self._data.get(self.key(variant, width, height))
+            if exact:
+                return Demand(exact['peak_rss_mb'], exact['cores'])
+            same = [v for k, v in self._data.items() if k.startswith(f"{variant}:")]
+        if same:
+            per_mp = sum(v['peak_rss_mb'] / v['mpix'] for v in same) / len(same)
+            cores = sum(v['cores'] for v in same) / len(same)
+            return Demand(per_mp * mpix, cores)
+        return Demand(DEFAULT_MB_PER_MPIXEL * mpix, DEFAULT_CORES)
+
+    def memory_limit(self, variant: str, width: int, height: int) -> float:
+        """单个进程的 RLIMIT_DATA 上限 (MB)：VmData 实测峰值 × RLIMIT_FACTOR，没有记录时为 0 (不限)"""
+        mpix = max(width * height / 1e6, 0.1)
+        with self._lock:
+            exact = self._data.get(self.key(variant, width, height))
+            if exact and exact.get('peak_data_mb'):
+                return exact['peak_data_mb'] * RLIMIT_FACTOR
+            same = [v for k, v in self._data.items()
+                    if k.startswith(f"{variant}:") and v.get('peak_data_mb')]
+        if not same:
+            return 0.0
+        # 其它分辨率换算时取最大的每百万像素占用，宁可放宽
+        per_mp = max(v['peak_data_mb'] / v['mpix'] for v in same)
+        return per_mp * mpix * RLIMIT_FACTOR
+
+    def record(self, variant: str, width: int, height: int, usage: Usage) -> None:
+        """登记一次成功运行的实测占用并写回磁盘"""
+        if usage.peak_rss_mb <= 0 or usage.wall_seconds <= 0:
+            return
+        key = self.key(variant, width, height)
+        with self._lock:
+            old = self._data.get(key)
+            if old:
+                entry = {
+                    'peak_rss_mb': max(old['peak_rss_mb'] * (1 - EWMA_ALPHA),
+                                       usage.peak_rss_mb),
+                    # 上限宁大勿小：VmData 峰值只增不减
+                    'peak_data_mb': max(old.get('peak_data_mb', 0.0), usage.peak_data_mb),
+                    'cores': old['cores'] * (1 - EWMA_ALPHA) + usage.cores * EWMA_ALPHA,
+                    'runs': old.get('runs', 0) + 1,
+                }
+            else:
+                entry = {'peak_rss_mb': usage.peak_rss_mb, 'peak_data_mb': usage.peak_data_mb,
+                         'cores': usage.cores, 'runs': 1}
+            entry['mpix'] = max(width * height / 1e6, 0.1)
+            self._data[key] = entry
+            try:
+                tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(self._data, indent=2), encoding='utf-8')
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logger.debug(f"无法保存资源记录: {e}")
+
+
+class Admission:
+    """按预测的内存 / CPU 占用放行任务 (先到先得)"""
+
+    def __init__(self, mem_budget_mb: Optional[float] = None,
+                 cpu_budget: Optional[float] = None):
+        """
+        Args:
+            mem_budget_mb: 内存预算 (MB)，None 时取可用内存 × MEMORY_HEADROOM，0 表示不限
+            cpu_budget: 可占用的核数，None 时为 CPU 核心数，0 表示不限
+        """
+        if mem_budget_mb is None:
+            mem_budget_mb = available_memory_mb() * MEMORY_HEADROOM
+        self.mem_budget = mem_budget_mb
+        self.cpu_budget = (os.cpu_count() or 1) if cpu_budget is None else cpu_budget
+        self._mem = 0.0
+        self._cpu = 0.0
+        self._running = 0
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned = set()
+        self._cond = threading.Condition()
+
+    def _fits(self, demand: Demand) -> bool:
+        if self._running == 0:
+            return True
+        if self.mem_budget and self._mem + demand.mem_mb > self.mem_budget:
+            return False
+        if self.cpu_budget and self._cpu + demand.cores > self.cpu_budget:
+            return False
+        return True
+
+    def _advance(self) -> None:
+        """跳过已放弃排队的号 (调用方持有锁)"""
+        while self._serving in self._abandoned:
+            self._abandoned.discard(self._serving)
+            self._serving += 1
+
+    @contextmanager
+    def admit(self, demand: Demand, should_stop=None):
+        """阻塞到资源足够后放行；should_stop() 为 True 时不占用资源直接返回"""
+        admitted = False
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving or not self._fits(demand):
+                if should_stop and should_stop():
+                    self._abandoned.add(ticket)
+                    break
+                self._cond.wait(timeout=0.5)
+            else:
+                self._serving += 1
+                self._mem += demand.mem_mb
+                self._cpu += demand.cores
+                self._running += 1
+                admitted = True
+            self._advance()
+            self._cond.notify_all()
+        try:
+            yield  # 未放行时调用方应自行检查取消标志
+        finally:
+            if admitted:
+                with self._cond:
+                    self._mem -= demand.mem_mb
+                    self._cpu -= demand.cores
+                    self._running -= 1
+                    self._cond.notify_all()
@@ -0,0 +1,158 @@
+"""
+按画面内容选取截取窗口
+
+超长视频原先固定截取前 TRIM_DURATION 秒，片头、黑场淡入经常成为壁纸。
+这里对整段视频只解码关键帧 (-skip_frame nokey) 并缩小到 ANALYSIS_WIDTH 宽，
+逐个关键帧取:
+
+    scene   与上一关键帧的画面差异 (select 滤镜的 scene 分数，0~1)，作为运动量
+    yavg    平均亮度 (signalstats)，用于识别黑场
+
+再以每个关键帧为起点给长度为 window 的候选窗口打分：
+
+    + 窗口内的平均运动量 (单个分数不超过 CUT_SCENE，硬切不算运动)
+    - DARK_WEIGHT × 黑场关键帧的比例
+    - CUT_WEIGHT  × 窗口内硬切 (scene >= CUT_SCENE) 的比例 (壁纸循环播放，单个镜头更好)
+    - INTRO_PENALTY (起点在前 INTRO_SECONDS 秒内，多为片头)
+
+起点在关键帧上，调用方直接在输入端用 -ss / -t 截取，不再写中间文件。
+结果按窗口长度写回探测缓存 (WINDOW_KEY)；分析失败时退回从 0 秒开始。
+"""
+
+import time
+import bisect
+import logging
+from typing import List, NamedTuple, Optional
+
+from ve_cache import get_probe_cache
+from ve_supervisor import run_command
+
+logger = logging.getLogger(__name__)
+
+WINDOW_KEY = 've_window'   # 探测缓存中保存结果的字段 ({窗口长度: 起点})
+ANALYSIS_WIDTH = 160       # 分析时缩小到的宽度
+ANALYSIS_TIMEOUT = 30.0    # 分析超时 (秒)
+DARK_LUMA = 32             # 平均亮度低于此值 (8 位) 视为黑场
+CUT_SCENE = 0.4            # scene 分数达到此值视为硬切
+DARK_WEIGHT = 1.0
+CUT_WEIGHT = 0.5
+INTRO_SECONDS = 10.0
+INTRO_PENALTY = 0.05
+
+
+class KeyframeStat(NamedTuple):
+    time: float
+    scene: float
+    yavg: float
+
+
+def analyze_keyframes(path, ffmpeg='ffmpeg', should_stop=None) -> List[KeyframeStat]:
+    """只解码关键帧，返回每个关键帧的时间、画面差异与平均亮度"""
+    graph = (f"scale={ANALYSIS_WIDTH}:-2,signalstats,"
+             f"select=gte(scene\\,0),metadata=print:file=-")
+    cmd = [str(ffmpeg), '-hide_banner', '-nostats', '-loglevel', 'error',
+           '-skip_frame', 'nokey', '-i', str(path), '-map', '0:v:0', '-an', '-sn', '-dn',
+           '-vf', graph, '-f', 'null', '-']
+    stats: List[KeyframeStat] = []
+    current = {}
+
+    def flush():
+        if 'time' in current:
+            stats.append(KeyframeStat(current['time'], current.get('scene', 0.0),
+                                      current.get('yavg', 255.0)))
+
+    def on_line(line: str) -> None:
+        line = line.strip()
+        try:
+            if line.startswith('frame:'):
+                flush()
+                current.clear()
+                current['time'] = float(line.rsplit('pts_time:', 1)[1])
+            elif line.startswith('lavfi.scene_score='):
+                current['scene'] = float(line.partition('=')[2])
+            elif line.startswith('lavfi.signalstats.YAVG='):
+                current['yavg'] = float(line.partition('=')[2])
+        except (IndexError, ValueError):
+            pass
+
+    result = run_command(cmd, should_stop, on_stdout=on_line)
+    flush()
+    if not result.ok:
+        if not result.cancelled:
+            logger.warning(f"关键帧分析失败 {path}:\n{result.stderr_text(5)}")
+        return []
+    return sorted(stats)
+
+
+def score_window(stats: List[KeyframeStat]) -> Optional[float]:
+    """一个窗口内关键帧的得分 (第一个关键帧的 scene 描述的是进入窗口的变化，不计入)"""
+    if not stats:
+        return None
+    dark = sum(1 for s in stats if s.yavg < DARK_LUMA) / len(stats)
+    inner = stats[1:]
+    if not inner:
+        return -DARK_WEIGHT * dark
+    motion = sum(min(s.scene, CUT_SCENE) for s in inner) / len(inner)
+    cuts = sum(1 for s in inner if s.scene >= CUT_SCENE) / len(inner)
+    return motion - DARK_WEIGHT * dark - CUT_WEIGHT * cuts
+
+
+def best_window(stats: List[KeyframeStat], duration: float, window: float) -> float:
+    """得分最高的窗口起点 (同分取较早者)，没有可选窗口时为 0"""
+    best, best_score = 0.0, None
+    times = [s.time for s in stats]
+    for i, start in enumerate(times):
+        if start + window > duration:
+            break
+        inside = stats[i:bisect.bisect_left(times, start + window, i)]
+        score = score_window(inside)
+        if score is None:
+            continue
+        if start < INTRO_SECONDS:
+            score -= INTRO_PENALTY
+        if best_score is None or score > best_score:
+            best, best_score = start, score
+    return best
+
+
+def select_window(path, duration: float, window: float, ffmpeg='ffmpeg',
+                  ffprobe='ffprobe', work_dir=None) -> float:
+    """
+    选取长度为 window 秒的最佳截取起点
+
+    Args:
+        path: 视频文件
+        duration: 视频总时长 (秒)
+        window: 截取长度 (秒)
+        work_dir: 探测缓存所在的工作目录
+
+    Returns:
+        float: 起点 (秒，位于关键帧上)；视频不长于 window 或分析失败时为 0
+    """
+    if duration <= window:
+        return 0.0
+    cache = get_probe_cache(work_dir)
+    key = f"{window:g}"
+    try:
+        probe = cache.probe(path, ffprobe)
+    except Exception as e:
+        logger.warning(f"无法读取视频信息 {path}: {e}")
+        probe = None
+    if probe is not None and key in probe.get(WINDOW_KEY, {}):
+        return float(probe[WINDOW_KEY][key])
+
+    started = time.monotonic()
+    stats = analyze_keyframes(
+        path, ffmpeg, lambda: time.monotonic() - started > ANALYSIS_TIMEOUT)
+    if not stats:
+        return 0.0
+    start = best_window(stats, duration, window)
+    logger.info(f"选取片段 {path}: {start:.2f}s ~ {start + window:.2f}s "
+                f"({len(stats)} 个关键帧, 分析 {time.monotonic() - started:.2f}s)")
+    if probe is not None:
+        probe.setdefault(WINDOW_KEY, {})[key] = start
+        try:
+            cache.put(path, probe)
+        except OSError:
+            pass
+    return start
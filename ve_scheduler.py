@@ -0,0 +1,211 @@
+"""
+批量渲染任务调度器
+
+用线程池同时驱动多个 ffmpeg 子进程，并按编码器限制并发数：
+NVENC 的硬件会话数有限 (消费级显卡通常为 2)，libx264 则按 CPU 核心数分配。
+每个任务的进度单独记录，调用方可通过 on_progress 回调或 snapshot() 汇总显示。
+可选的 Admission (ve_resources) 按任务预测的内存 / CPU 占用决定何时开工。
+"""
+
+import os
+import threading
+import time
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional
+
+from ve_resources import Admission, Demand
+
+logger = logging.getLogger(__name__)
+
+NVENC_SESSIONS = 2        # NVENC 同时编码会话上限
+HW_SESSIONS = 2           # QSV / VAAPI 同时编码会话数
+X264_THREADS_PER_JOB = 8  # 单个 libx264 veryfast 任务大约能吃满的线程数
+
+
+def default_encoder_limits(cpu_count: Optional[int] = None) -> Dict[str, int]:
+    """
+    各编码器的默认并发上限
+
+    Args:
+        cpu_count: CPU 核心数，默认取 os.cpu_count()
+
+    Returns:
+        Dict[str, int]: 编码器名称到并发数的映射
+    """
+    cores = cpu_count or os.cpu_count() or 1
+    cpu_jobs = max(1, cores // X264_THREADS_PER_JOB)
+    return {
+        'h264_nvenc': NVENC_SESSIONS,
+        'hevc_nvenc': NVENC_SESSIONS,
+        'h264_qsv': HW_SESSIONS,
+        'h264_vaapi': HW_SESSIONS,
+        'libx264': cpu_jobs,
+        'libx265': cpu_jobs,
+    }
+
+
+@dataclass
+class Job:
+    """单个渲染任务的状态与进度"""
+    job_id: int
+    name: str
+    total: int = 0
+    done: int = 0
+    state: str = 'pending'  # pending / running / done / failed / cancelled
+    error: Optional[str] = None
+    started: float = 0.0
+    finished: float = 0.0
+    _listener: Optional[Callable[['Job'], None]] = field(
+        default=None, repr=False, compare=False)
+
+    def update(self, done: int, total: Optional[int] = None) -> None:
+        """由任务函数调用，上报当前完成量"""
+        self.done = done
+        if total is not None:
+            self.total = total
+        if self._listener:
+            self._listener(self)
+
+    @property
+    def percent(self) -> int:
+        if self.total <= 0:
+            return 0
+        return min(100, int(self.done * 100 / self.total))
+
+
+class JobScheduler:
+    """线程池 + 按编码器信号量的任务调度器"""
+
+    def __init__(self, max_workers: Optional[int] = None,
+                 encoder_limits: Optional[Dict[str, int]] = None,
+                 on_progress: Optional[Callable[[Job], None]] = None,
+                 admission: Optional[Admission] = None):
+        """
+        Args:
+            max_workers: 同时运行的任务数，默认为 CPU 任务数 + NVENC 会话数
+            encoder_limits: 覆盖默认的编码器并发上限
+            on_progress: 任务进度或状态变化时的回调 (在工作线程中调用)
+            admission: 资源准入控制，提交时带 demand 的任务在资源足够时才开始
+        """
+        limits = default_encoder_limits()
+        limits.update(encoder_limits or {})
+        self.encoder_limits = limits
+        self.max_workers = max(1, max_workers or (
+            limits['libx264'] + limits['h264_nvenc']))
+        self.on_progress = on_progress
+        self.admission = admission
+
+        self._slots = {name: threading.BoundedSemaphore(n)
+                       for name, n in limits.items()}
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                        thread_name_prefix='render')
+        self._lock = threading.Lock()
+        self._jobs: List[Job] = []
+        self._futures: List[Future] = []
+        self.cancelled = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.cancel()
+        self.shutdown()
+
+    @contextmanager
+    def encoder_slot(self, encoder: str):
+        """
+        占用一个编码器并发名额，未登记的编码器不限流
+
+        Args:
+            encoder: ffmpeg 编码器名称 (如 'h264_nvenc', 'libx264')
+        """
+        slot = self._slots.get(encoder)
+        if slot is None:
+            yield
+            return
+        with slot:
+            yield
+
+    def submit(self, name: str, fn: Callable[..., Any], *args,
+               total: int = 0, demand: Optional[Demand] = None, **kwargs) -> Future:
+        """
+        提交任务，fn 的第一个参数为 Job，用于上报进度
+
+        Args:
+            demand: 预计资源占用，配合 admission 使用
+
+        Returns:
+            Future: 结果为 fn 的返回值
+        """
+        with self._lock:
+            job = Job(job_id=len(self._jobs), name=name, total=total,
+                      _listener=self._notify)
+            self._jobs.append(job)
+            future = self._pool.submit(self._admit, job, fn, args, kwargs, demand)
+            self._futures.append(future)
+        return future
+
+    def _admit(self, job: Job, fn, args, kwargs, demand: Optional[Demand]):
+        if self.admission is None or demand is None:
+            return self._run(job, fn, args, kwargs)
+        with self.admission.admit(demand, self.cancelled.is_set):
+            return self._run(job, fn, args, kwargs)
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if self.cancelled.is_set():
+            self._finish(job, 'cancelled')
+            return None
+
+        job.state = 'running'
+        job.started = time.time()
+        self._notify(job)
+        try:
+            result = fn(job, *args, **kwargs)
+        except Exception:
+            job.error = traceback.format_exc()
+            logger.error(f"任务失败: {job.name}\n{job.error}")
+            self._finish(job, 'failed')
+            raise
+        state = 'cancelled' if self.cancelled.is_set() else (
+            'failed' if result is False else 'done')
+        self._finish(job, state)
+        return result
+
+    def _finish(self, job: Job, state: str) -> None:
+        job.state = state
+        job.finished = time.time()
+        self._notify(job)
+
+    def _notify(self, job: Job) -> None:
+        if self.on_progress:
+            try:
+                self.on_progress(job)
+            except Exception as e:
+                logger.warning(f"进度回调出错: {e}")
+
+    def snapshot(self) -> List[Job]:
+        """返回当前所有任务状态的副本"""
+        with self._lock:
+            return [replace(job, _listener=None) for job in self._jobs]
+
+    def wait(self) -> List[Any]:
+        """等待全部已提交任务结束，返回结果列表 (失败的任务为 None)"""
+        results = []
+        for future in list(self._futures):
+            try:
+                results.append(future.result())
+            except Exception:
+                results.append(None)
+        return results
+
+    def cancel(self) -> None:
+        """标记取消：排队中的任务不再启动，运行中的任务应自行检查 cancelled"""
+        self.cancelled.set()
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
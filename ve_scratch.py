@@ -0,0 +1,229 @@
+"""
+任务独立的临时工作目录
+
+原先 FFmpegManager 把所有中间文件放在同一个 temp_processing 目录，
+以秒级时间戳命名 (同一秒启动的任务互相覆盖)，结束时 rmtree 整个目录
+(会删掉其它任务正在写的文件)。
+
+这里每个任务创建自己的目录 <root>/<标签>-<pid>-<随机串>，目录中写有
+.owner (主机名、pid、创建时间)，使用者通过 acquire / release 引用计数，
+最后一个引用释放时才删除目录。
+
+可选使用 tmpfs (/dev/shm)：按调用方给出的预计大小在预算内预留空间，
+超出预算或 tmpfs 剩余空间不足时落到磁盘目录。
+
+启动时 sweep() 删除本机上属主进程已不存在的目录 (崩溃遗留)。
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import threading
+import logging
+from pathlib import Path
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+SCRATCH_ROOT = "temp_processing"
+SHM_ROOT = "/dev/shm"
+SHM_DIR_NAME = "ve_scratch"
+SHM_BUDGET = 2 << 30   # tmpfs 默认预算 (2 GiB)
+SHM_RESERVE = 256 << 20  # tmpfs 上至少保留给系统的空间
+OWNER_FILE = ".owner"
+ORPHAN_GRACE = 60.0   # 没有属主信息的目录至少存在这么久才视为遗留 (秒)
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # 进程存在但属于其它用户
+    return True
+
+
+class ScratchSpace:
+    """一个任务独占的临时目录 (磁盘目录 + 可选的 tmpfs 目录)"""
+
+    def __init__(self, pool: 'ScratchPool', name: str):
+        self.pool = pool
+        self.name = name
+        self.path = pool.root / name
+        self.shm_path = pool.shm_root / name if pool.shm_root else None
+        self._refs = 1
+        self._reserved: Dict[Path, int] = {}
+        self._lock = threading.Lock()
+        self._make_dir(self.path)
+
+    def _make_dir(self, path: Path) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        owner = {'host': socket.gethostname(), 'pid': os.getpid(), 'created': time.time()}
+        (path / OWNER_FILE).write_text(json.dumps(owner), encoding='utf-8')
+
+    def file(self, name: str, estimate: int = 0) -> Path:
+        """
+        目录中的一个文件路径
+
+        Args:
+            name: 文件名 (同一任务内唯一即可)
+            estimate: 预计大小 (字节)，大于 0 且 tmpfs 预算足够时放在 tmpfs 上
+        """
+        if estimate > 0 and self.shm_path is not None and self.pool.reserve(estimate):
+            if not self.shm_path.exists():
+                self._make_dir(self.shm_path)
+            path = self.shm_path / name
+            with self._lock:
+                self._reserved[path] = self._reserved.get(path, 0) + estimate
+            return path
+        return self.path / name
+
+    def remove(self, path) -> None:
+        """提前删除一个不再需要的文件并归还 tmpfs 预留"""
+        path = Path(path)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"清理临时文件失败 {path}: {e}")
+        with self._lock:
+            reserved = self._reserved.pop(path, 0)
+        self.pool.unreserve(reserved)
+
+    def acquire(self) -> 'ScratchSpace':
+        with self._lock:
+            if self._refs <= 0:
+                raise RuntimeError(f"临时目录已释放: {self.name}")
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        """引用计数减一，归零时删除目录"""
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            reserved, self._reserved = sum(self._reserved.values()), {}
+        self.pool.unreserve(reserved)
+        for path in (self.path, self.shm_path):
+            if path is not None:
+                shutil.rmtree(path, ignore_errors=True)
+        self.pool.forget(self)
+        logger.debug(f"已清理临时目录: {self.name}")
+
+    def __enter__(self) -> 'ScratchSpace':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class ScratchPool:
+    """分配 ScratchSpace，管理 tmpfs 预算并清理遗留目录"""
+
+    def __init__(self, root=SCRATCH_ROOT, use_shm: bool = False, shm_budget: int = SHM_BUDGET):
+        self.root = Path(root).resolve()
+        self.shm_root = None
+        if use_shm and os.path.isdir(SHM_ROOT) and os.access(SHM_ROOT, os.W_OK):
+            self.shm_root = Path(SHM_ROOT) / SHM_DIR_NAME
+        elif use_shm:
+            logger.warning(f"{SHM_ROOT} 不可用，临时文件全部写入磁盘")
+        self.shm_budget = shm_budget
+        self._shm_used = 0
+        self._spaces: List[ScratchSpace] = []
+        self._lock = threading.Lock()
+
+    def create(self, tag: str = "job") -> ScratchSpace:
+        """创建一个新的临时目录 (引用计数为 1)"""
+        safe = "".join(c if c.isalnum() or c in '-_' else '_' for c in tag)[:40] or "job"
+        space = ScratchSpace(self, f"{safe}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        with self._lock:
+            self._spaces.append(space)
+        return space
+
+    def forget(self, space: ScratchSpace) -> None:
+        with self._lock:
+            if space in self._spaces:
+                self._spaces.remove(space)
+
+    def reserve(self, size: int) -> bool:
+        """在 tmpfs 预算内预留 size 字节，不足时返回 False (调用方改用磁盘)"""
+        if self.shm_root is None:
+            return False
+        with self._lock:
+            if self._shm_used + size > self.shm_budget:
+                return False
+            try:
+                free = shutil.disk_usage(SHM_ROOT).free
+            except OSError:
+                return False
+            if free - size < SHM_RESERVE:
+                return False
+            self._shm_used += size
+            return True
+
+    def unreserve(self, size: int) -> None:
+        if size:
+            with self._lock:
+                self._shm_used = max(0, self._shm_used - size)
+
+    def sweep(self) -> int:
+        """删除本机上属主进程已退出的临时目录，返回删除个数"""
+        removed = 0
+        host = socket.gethostname()
+        for base in (self.root, self.shm_root):
+            if base is None or not base.is_dir():
+                continue
+            for entry in base.iterdir():
+                if not entry.is_dir():
+                    if base == self.root:
+                        # 旧版本直接放在根目录下的中间文件
+                        entry.unlink(missing_ok=True)
+                        removed += 1
+                    continue
+                try:
+                    owner = json.loads((entry / OWNER_FILE).read_text(encoding='utf-8'))
+                    pid, owner_host = int(owner['pid']), owner['host']
+                except (OSError, ValueError, KeyError, TypeError):
+                    # 没有属主信息：旧版本留下的目录，或另一进程刚创建、尚未写入
+                    try:
+                        if time.time() - entry.stat().st_mtime < ORPHAN_GRACE:
+                            continue
+                    except OSError:
+                        continue
+                    pid, owner_host = 0, host
+                if owner_host != host or (pid and _pid_alive(pid)):
+                    continue
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"已清理 {removed} 个遗留的临时目录")
+        return removed
+
+    def close(self) -> None:
+        """强制删除本进程仍未释放的临时目录 (中断 / 退出时调用)"""
+        with self._lock:
+            spaces, self._spaces = self._spaces, []
+        for space in spaces:
+            for path in (space.path, space.shm_path):
+                if path is not None:
+                    shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._shm_used = 0
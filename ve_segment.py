@@ -0,0 +1,220 @@
+"""
+长视频分段并行渲染
+
+单个长视频只能由一个 ffmpeg 进程渲染，libx264 veryfast 加单线程 gblur
+吃不满多核。分段模式按关键帧把源视频切成 N 段，每段用同一张壁纸滤镜图
+并行渲染 (只含视频)，再用 concat demuxer 无损拼接，并从源文件直接复制音轨。
+
+流程:
+    1. ffprobe 列出视频流全部数据包 (pts, 是否关键帧)，不解码
+    2. 在接近等分点的关键帧处切分，每段记下起始时间与帧数
+    3. 每段: -noaccurate_seek -ss <关键帧> -i 源 ... -frames:v <帧数>
+    4. concat 拼接各段视频 + 源音轨 (-c copy)
+    5. 校验: 总帧数一致，音视频时长差与源文件一致 (误差 1.5 帧以内)
+校验失败时返回 False，调用方应退回单进程渲染。
+"""
+
+import os
+import json
+import shutil
+import threading
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import (Callable, ContextManager, Dict, List, NamedTuple, Optional,
+                    Sequence, Tuple)
+
+from ve_cache import cache_dir, no_window_kwargs
+from ve_supervisor import run_command, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+MIN_SEGMENT_SECONDS = 10.0  # 每段至少这么长，过短的视频不分段
+SEEK_EPSILON = 1e-4         # -ss 略晚于关键帧，保证定位到该关键帧而不是前一个
+SYNC_TOLERANCE_FRAMES = 1.5
+
+
+class Segment(NamedTuple):
+    index: int
+    start: float   # 起始关键帧的时间 (秒)
+    frames: int    # 本段帧数
+
+
+def probe_packets(path, ffprobe='ffprobe') -> List[Tuple[float, bool]]:
+    """视频流全部数据包 (pts 秒, 是否关键帧)，按显示顺序排列"""
+    cmd = [str(ffprobe), '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', str(path)]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            check=True, **no_window_kwargs())
+    packets = []
+    for line in result.stdout.decode('utf-8', errors='replace').splitlines():
+        pts, _, flags = line.strip().partition(',')
+        try:
+            packets.append((float(pts), 'K' in flags))
+        except ValueError:
+            continue  # pts 为 N/A 的包
+    packets.sort()
+    return packets
+
+
+def plan_segments(packets: Sequence[Tuple[float, bool]], count: int,
+                  min_seconds: float = MIN_SEGMENT_SECONDS) -> List[Segment]:
+    """在最接近等分点的关键帧处切成至多 count 段"""
+    if not packets:
+        return []
+    first, last = packets[0][0], packets[-1][0]
+    count = max(1, min(count, int((last - first) // min_seconds)))
+    keys = [i for i, (_, is_key) in enumerate(packets) if is_key and i > 0]
+
+    bounds = [0]
+    for j in range(1, count):
+        target = first + (last - first) * j / count
+        candidates = [i for i in keys if i > bounds[-1]]
+        if not candidates:
+            break
+        best = min(candidates, key=lambda i: abs(packets[i][0] - target))
+        if best not in bounds:
+            bounds.append(best)
+    bounds.append(len(packets))
+    return [Segment(n, packets[a][0], b - a) for n, (a, b) in enumerate(zip(bounds, bounds[1:]))]
+
+
+def stream_stats(path, ffprobe='ffprobe') -> Dict[str, Tuple[int, float]]:
+    """各类型第一条流的 (数据包数, 时长)，用于拼接后的校验"""
+    cmd = [str(ffprobe), '-v', 'error', '-count_packets', '-show_entries',
+           'stream=codec_type,nb_read_packets,duration:format=duration',
+           '-of', 'json', str(path)]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            check=True, **no_window_kwargs())
+    data = json.loads(result.stdout.decode('utf-8', errors='replace'))
+    fallback = float(data.get('format', {}).get('duration') or 0)
+    stats: Dict[str, Tuple[int, float]] = {}
+    for s in data.get('streams', []):
+        kind = s.get('codec_type')
+        if kind in stats:
+            continue
+        try:
+            duration = float(s.get('duration') or fallback)
+        except ValueError:
+            duration = fallback
+        stats[kind] = (int(s.get('nb_read_packets') or 0), duration)
+    return stats
+
+
+def _concat_list(paths: Sequence[Path], list_path: Path) -> None:
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for p in paths:
+            escaped = str(p.resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def verify_join(source, output, expected_frames: int, fps: float,
+                ffprobe='ffprobe') -> bool:
+    """帧数一致，且音视频时长差与源文件相同 (误差 SYNC_TOLERANCE_FRAMES 帧)"""
+    src, out = stream_stats(source, ffprobe), stream_stats(output, ffprobe)
+    frames, v_dur = out.get('video', (0, 0.0))
+    if frames != expected_frames:
+        logger.warning(f"分段拼接帧数不符: {frames} != {expected_frames}")
+        return False
+    tolerance = SYNC_TOLERANCE_FRAMES / fps if fps > 0 else 0.1
+    if abs(v_dur - src.get('video', (0, v_dur))[1]) > tolerance:
+        logger.warning(f"分段拼接视频时长不符: {v_dur:.3f}s")
+        return False
+    if 'audio' in src:
+        drift = (v_dur - out.get('audio', (0, 0.0))[1]) - (src['video'][1] - src['audio'][1])
+        if abs(drift) > tolerance:
+            logger.warning(f"分段拼接后音画偏移 {drift * 1000:.0f} ms")
+            return False
+    return True
+
+
+def render_segmented(source, filter_str: str, out_labels: Sequence[str], targets: Sequence,
+                     video_args: Callable[[str], List[str]], ffmpeg='ffmpeg',
+                     ffprobe='ffprobe', segments: int = 4, pre_args: Sequence[str] = (),
+                     encoder_slot: Optional[Callable[[], ContextManager]] = None,
+                     on_progress: Optional[Callable[[int], None]] = None,
+                     should_stop: Optional[Callable[[], bool]] = None,
+                     work_dir=None) -> bool:
+    """
+    分段并行渲染一个视频的全部输出
+
+    Args:
+        source: 源视频
+        filter_str: 壁纸滤镜图 (与整段渲染时相同)
+        out_labels: 滤镜图的输出标签
+        targets: 与 out_labels 对应的最终输出路径
+        video_args: 输出标签 -> 该输出的视频参数 (-map 与编码参数，不含音频)
+        segments: 期望段数 (也是并行数)
+        pre_args: 放在 -i 之前的附加参数 (如硬件设备)
+        encoder_slot: 每段渲染时占用的编码器名额 (上下文管理器工厂)
+        on_progress: 已完成总帧数的回调
+        should_stop: 返回 True 时取消
+        work_dir: 分段临时文件所在的工作目录
+
+    Returns:
+        bool: 渲染且校验通过时为 True；不宜分段、失败或取消时为 False
+    """
+    packets = probe_packets(source, ffprobe)
+    plan = plan_segments(packets, segments)
+    if len(plan) < 2:
+        return False
+    span = packets[-1][0] - packets[0][0]
+    fps = (len(packets) - 1) / span if span > 0 else 0.0
+
+    seg_dir = cache_dir(work_dir) / "segments" / f"{Path(source).stem}_{os.getpid()}_{id(plan):x}"
+    seg_dir.mkdir(parents=True, exist_ok=True)
+    seg_files = [[seg_dir / f"out{o}_seg{s.index:03d}.mp4" for s in plan]
+                 for o in range(len(out_labels))]
+
+    lock = threading.Lock()
+    done = [0] * len(plan)
+
+    def render(seg: Segment) -> bool:
+        if should_stop and should_stop():
+            return False
+        seek = [] if seg.index == 0 else ['-noaccurate_seek', '-ss', f"{seg.start + SEEK_EPSILON:.6f}"]
+        cmd = [str(ffmpeg), '-y', '-progress', 'pipe:1', '-nostats', '-loglevel', 'error',
+               *pre_args, *seek, '-i', str(source), '-filter_complex', filter_str]
+        for o, label in enumerate(out_labels):
+            cmd += [*video_args(label), '-an', '-frames:v', str(seg.frames),
+                    '-avoid_negative_ts', 'make_zero', str(seg_files[o][seg.index])]
+
+        def progress(snap):
+            with lock:
+                done[seg.index] = snap.frame
+                total = sum(done)
+            if on_progress:
+                on_progress(total)
+
+        with (encoder_slot() if encoder_slot else nullcontext()):
+            result = run_ffmpeg(cmd, seg.frames, progress, should_stop)
+        if not result.ok and not result.cancelled:
+            logger.error(f"第 {seg.index} 段渲染失败:\n{result.stderr_text()}")
+        return result.ok
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(plan), thread_name_prefix='segment') as pool:
+            if not all(list(pool.map(render, plan))):
+                return False
+
+        expected = sum(s.frames for s in plan)
+        for o, target in enumerate(targets):
+            list_path = seg_dir / f"out{o}.txt"
+            _concat_list(seg_files[o], list_path)
+            # 视频逐段无损拼接，音轨直接取自源文件
+            cmd = [str(ffmpeg), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                   '-i', str(list_path), '-i', str(source),
+                   '-map', '0:v', '-map', '1:a?', '-c', 'copy', str(target)]
+            result = run_command(cmd, should_stop)
+            if not result.ok:
+                if not result.cancelled:
+                    logger.error(f"分段拼接失败:\n{result.stderr_text()}")
+                return False
+            if not verify_join(source, target, expected, fps, ffprobe):
+                return False
+        logger.info(f"分段渲染完成: {Path(source).name} ({len(plan)} 段, {expected} 帧)")
+        return True
+    finally:
+        shutil.rmtree(seg_dir, ignore_errors=True)
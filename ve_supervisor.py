@@ -0,0 +1,296 @@
+"""
+ffmpeg 子进程监督
+
+原先各引擎在主循环里阻塞调用 stdout.readline()，ffmpeg 卡死不再输出时
+看门狗根本没有机会执行；固定 25 秒的阈值对 4K CPU 编码太短、对短片又太长。
+
+这里由两个读线程同时排空 stdout / stderr (只排空其中一个时，另一个管道写满后
+ffmpeg 会阻塞在 write 上，整个渲染随之死锁)：
+    stdout  -progress 块解析为 ProgressSnapshot，放入有界队列
+    stderr  按块读入 StderrRing，只保留最后 STDERR_TAIL_BYTES 字节，供失败时打印
+            (啰嗦的滤镜图跑几个小时也不会占用越来越多的内存)
+监督循环按超时取队列，因此即使 ffmpeg 完全无输出也能按时检查：
+
+    卡滞阈值 = STALL_FRAMES / 当前帧率，并限制在 [STALL_MIN, STALL_MAX] 秒内
+    尚未出现第一帧时使用 STARTUP_GRACE
+
+判定卡滞或被取消时结束整个进程树 (POSIX 进程组 / Windows taskkill /T)。
+不输出进度的辅助命令 (拼接、截取等) 用 run_command，同样排空两个管道，只是不做卡滞判定。
+Linux 下同时从 /proc 采样进程树的峰值 RSS 与 CPU 时间 (ve_resources)，
+并可为 ffmpeg 设置内存上限。开启 ve_trace 时每次运行记为一个 'ffmpeg' 区间
+(返回码、写出字节数、峰值内存)。
+"""
+
+import io
+import os
+import queue
+import signal
+import threading
+import subprocess
+import time
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+from ve_cache import no_window_kwargs
+from ve_progress import ProgressParser, ProgressSnapshot
+from ve_resources import ProcessSampler, Usage, limit_memory
+from ve_trace import span
+
+logger = logging.getLogger(__name__)
+
+STALL_FRAMES = 120     # 连续这么多帧的预期耗时内没有新帧即判定卡滞
+STALL_MIN = 10.0       # 卡滞阈值下限 (秒)，需大于 -progress 的输出间隔
+STALL_MAX = 300.0      # 卡滞阈值上限 (秒)
+STARTUP_GRACE = 60.0   # 第一帧出现前允许的初始化时间 (秒)
+STDERR_TAIL_BYTES = 64 << 10  # 保留的 stderr 末尾字节数
+READ_CHUNK = 8192      # 读线程单次读取的最大字符数 (没有换行的超长输出也分块读)
+QUEUE_SIZE = 64        # 进度快照队列长度，满时丢弃最旧的快照
+POLL_INTERVAL = 0.25   # 监督循环的检查间隔 (秒)
+KILL_GRACE = 3.0       # 终止进程树后等待退出的时间 (秒)
+
+
+@dataclass
+class SupervisedResult:
+    """一次 ffmpeg 运行的结果"""
+    returncode: Optional[int]
+    snapshot: ProgressSnapshot
+    stalled: bool = False
+    cancelled: bool = False
+    stderr_tail: List[str] = field(default_factory=list)
+    usage: Usage = field(default_factory=Usage)  # 实测资源占用 (仅 Linux)
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.stalled and not self.cancelled
+
+    def stderr_text(self, lines: int = 20) -> str:
+        return "\n".join(self.stderr_tail[-lines:])
+
+
+class StderrRing:
+    """按字节数限长的 stderr 末尾缓冲，超出时丢弃最早的行"""
+
+    def __init__(self, limit: int = STDERR_TAIL_BYTES):
+        self.limit = limit
+        self.dropped = 0   # 已丢弃的行数
+        self._lines: deque = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def append(self, line: str) -> None:
+        line = line.rstrip()
+        if not line:
+            return
+        if len(line) > self.limit:
+            line = line[-self.limit:]
+        with self._lock:
+            self._lines.append(line)
+            self._size += len(line) + 1
+            while self._size > self.limit:
+                self._size -= len(self._lines.popleft()) + 1
+                self.dropped += 1
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            if self.dropped:
+                return [f"... (已省略前 {self.dropped} 行)", *self._lines]
+            return list(self._lines)
+
+
+def stall_timeout(snap: Optional[ProgressSnapshot]) -> float:
+    """按当前帧率计算的卡滞阈值 (秒)"""
+    if snap is None or snap.frame <= 0:
+        return STARTUP_GRACE
+    if snap.fps <= 0 or snap.percent >= 100:
+        # 帧率未知，或已在收尾 (编码器冲刷、写 moov)
+        return STALL_MAX
+    return min(STALL_MAX, max(STALL_MIN, STALL_FRAMES / snap.fps))
+
+
+def _popen_kwargs():
+    """让 ffmpeg 及其子进程处于独立的进程组，便于整体结束"""
+    if os.name == 'nt':
+        kwargs = no_window_kwargs()
+        kwargs['creationflags'] = kwargs.get('creationflags', 0) | \
+            subprocess.CREATE_NEW_PROCESS_GROUP
+        return kwargs
+    return {'start_new_session': True}
+
+
+def kill_tree(proc: subprocess.Popen) -> None:
+    """结束进程及其全部子进程"""
+    if proc.poll() is not None:
+        return
+    try:
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           **no_window_kwargs())
+        else:
+            os.killpg(proc.pid, signal.SIGTERM)
+            try:
+                proc.wait(timeout=KILL_GRACE)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+    except (OSError, ProcessLookupError):
+        proc.kill()
+    try:
+        proc.wait(timeout=KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        logger.warning(f"进程 {proc.pid} 未能在 {KILL_GRACE} 秒内退出")
+
+
+def _read_lines(stream):
+    """逐行读取，单行最多 READ_CHUNK 个字符"""
+    return iter(lambda: stream.readline(READ_CHUNK), '')
+
+
+def _drain_stdout(stream, parser: ProgressParser, snaps: "queue.Queue",
+                  on_line: Optional[Callable[[str], None]] = None) -> None:
+    for line in _read_lines(stream):
+        if on_line:
+            on_line(line)
+        snap = parser.feed(line)
+        if snap is None:
+            continue
+        try:
+            snaps.put_nowait(snap)
+        except queue.Full:
+            # 监督线程跟不上时只保留较新的进度
+            try:
+                snaps.get_nowait()
+            except queue.Empty:
+                pass
+            snaps.put_nowait(snap)
+    stream.close()
+
+
+def _drain_stderr(stream, tail: StderrRing) -> None:
+    for line in _read_lines(stream):
+        tail.append(line)
+    stream.close()
+
+
+def start_process(cmd: List[str], stdin=subprocess.DEVNULL,
+                  stdout=subprocess.DEVNULL) -> Tuple[subprocess.Popen, StderrRing]:
+    """
+    在独立进程组中启动命令 (二进制、无缓冲管道)，stderr 由后台线程排空到 StderrRing
+
+    供自行读写 stdin / stdout 的调用方使用 (如 rawvideo 管道)，结束时用 kill_tree 清理
+    """
+    proc = subprocess.Popen(cmd, stdin=stdin, stdout=stdout, stderr=subprocess.PIPE,
+                            bufsize=0, **_popen_kwargs())
+    tail = StderrRing()
+    stderr = io.TextIOWrapper(proc.stderr, encoding='utf-8', errors='ignore')
+    threading.Thread(target=_drain_stderr, args=(stderr, tail),
+                     name='process-stderr', daemon=True).start()
+    return proc, tail
+
+
+def _supervise(cmd: List[str], total_frames: int,
+               on_progress: Optional[Callable[[ProgressSnapshot], None]],
+               should_stop: Optional[Callable[[], bool]],
+               memory_limit_mb: float, watchdog: bool,
+               on_stdout: Optional[Callable[[str], None]]) -> SupervisedResult:
+    parser = ProgressParser(total_frames)
+    snaps: "queue.Queue[ProgressSnapshot]" = queue.Queue(maxsize=QUEUE_SIZE)
+    tail = StderrRing()
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            stdin=subprocess.DEVNULL, text=True, encoding='utf-8',
+                            errors='ignore', bufsize=1, **_popen_kwargs())
+    limit_memory(proc.pid, memory_limit_mb)
+    sampler = ProcessSampler(proc.pid)
+    readers = [
+        threading.Thread(target=_drain_stdout, args=(proc.stdout, parser, snaps, on_stdout),
+                         name='ffmpeg-stdout', daemon=True),
+        threading.Thread(target=_drain_stderr, args=(proc.stderr, tail),
+                         name='ffmpeg-stderr', daemon=True),
+    ]
+    for t in readers:
+        t.start()
+
+    last: Optional[ProgressSnapshot] = None
+    last_frame = -1
+    last_active = time.monotonic()
+    stalled = cancelled = False
+
+    try:
+        while True:
+            try:
+                snap = snaps.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                snap = None
+            if snap is not None:
+                last = snap
+                if snap.frame != last_frame:
+                    last_frame = snap.frame
+                    last_active = time.monotonic()
+                if on_progress:
+                    on_progress(snap)
+            elif proc.poll() is not None and not readers[0].is_alive() and snaps.empty():
+                # 进程已退出且进度已全部取完
+                break
+
+            sampler.sample()
+            if should_stop and should_stop():
+                cancelled = True
+                kill_tree(proc)
+                break
+            limit = stall_timeout(last)
+            if watchdog and time.monotonic() - last_active > limit:
+                stalled = True
+                logger.warning(f"ffmpeg 已 {limit:.0f} 秒没有新帧 (第 {max(last_frame, 0)} 帧)，"
+                               f"结束进程树 {proc.pid}")
+                kill_tree(proc)
+                break
+    except BaseException:
+        # on_progress / should_stop 抛出异常 (含 KeyboardInterrupt) 时不留下孤儿 ffmpeg
+        kill_tree(proc)
+        raise
+    finally:
+        for t in readers:
+            t.join(timeout=KILL_GRACE)
+        returncode = proc.wait()
+    return SupervisedResult(returncode, last or parser.last, stalled, cancelled, tail.lines(),
+                            sampler.usage)
+
+
+def run_ffmpeg(cmd: List[str], total_frames: int = 0,
+               on_progress: Optional[Callable[[ProgressSnapshot], None]] = None,
+               should_stop: Optional[Callable[[], bool]] = None,
+               memory_limit_mb: float = 0, watchdog: bool = True,
+               on_stdout: Optional[Callable[[str], None]] = None) -> SupervisedResult:
+    """
+    运行带 -progress pipe:1 的 ffmpeg 命令并监督至结束
+
+    Args:
+        cmd: 完整命令行 (须包含 -progress pipe:1)
+        total_frames: 预计总帧数，0 表示未知
+        on_progress: 每个进度快照的回调 (在调用线程中执行)
+        should_stop: 返回 True 时取消任务
+        memory_limit_mb: 大于 0 时为 ffmpeg 设置 RLIMIT_DATA (仅 Linux)
+        watchdog: 是否按帧率判定卡滞 (命令不含 -progress 时须为 False)
+        on_stdout: stdout 每一行的回调 (在读线程中执行)
+
+    Returns:
+        SupervisedResult: 返回码、最后的进度快照、是否卡滞 / 取消、stderr 末尾、资源占用
+    """
+    with span('ffmpeg' if watchdog else 'command', cat='process') as sp:
+        result = _supervise(cmd, total_frames, on_progress, should_stop,
+                            memory_limit_mb, watchdog, on_stdout)
+        sp.status = ('stalled' if result.stalled else
+                     'cancelled' if result.cancelled else result.returncode)
+        sp.set(bytes=result.snapshot.total_size,
+               peak_rss_mb=round(result.usage.peak_rss_mb, 1))
+    return result
+
+
+def run_command(cmd: List[str], should_stop: Optional[Callable[[], bool]] = None,
+                memory_limit_mb: float = 0,
+                on_stdout: Optional[Callable[[str], None]] = None) -> SupervisedResult:
+    """运行不输出进度的命令 (同样排空两个管道、只保留 stderr 末尾，不做卡滞判定)"""
+    return run_ffmpeg(cmd, should_stop=should_stop, memory_limit_mb=memory_limit_mb,
+                      watchdog=False, on_stdout=on_stdout)
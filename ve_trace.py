@@ -0,0 +1,231 @@
+"""
+分阶段耗时追踪
+
+一批视频跑完只知道总耗时，看不出时间花在探测、截取、旋转、前景 ProRes、
+羽化、最终编码还是失败重试上。这里给各阶段加计时区间 (span)：
+
+    with span('final_encode', file=name) as sp:
+        result = run_ffmpeg(cmd, ...)
+        sp.status = result.returncode
+        sp.output(out_path)
+
+每个区间记录墙钟时间、子进程 CPU 时间 (resource.getrusage(RUSAGE_CHILDREN) 的差值，
+仅 POSIX；并发任务的区间互相重叠时，同一段子进程时间会计入所有重叠的区间)、
+写出字节数 (output() 登记的文件在区间结束时的大小，或直接 set(bytes=...))、
+退出状态 (默认 'ok'，区间内抛出异常时为异常类名)。
+
+追踪默认关闭，此时 span() 返回共享的空对象，只多一次函数调用。
+用 enable_tracing(路径) 或环境变量 VE_TRACE=路径 开启；批次结束时 finish_tracing()
+输出各阶段汇总，并写出 Chrome trace JSON (chrome://tracing 或 Perfetto 中打开，
+同一线程内的嵌套区间按层级显示)。
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource
+    HAS_RUSAGE = True
+except ImportError:
+    HAS_RUSAGE = False
+
+logger = logging.getLogger(__name__)
+
+TRACE_ENV = "VE_TRACE"
+
+
+def _children_cpu() -> float:
+    """已结束 (已回收) 子进程累计的用户态 + 内核态 CPU 秒数"""
+    if not HAS_RUSAGE:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _NullSpan:
+    """追踪关闭时使用的空区间"""
+    status: Any = 'ok'
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def set(self, **args) -> None:
+        pass
+
+    def output(self, *paths) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """一个计时区间 (上下文管理器)"""
+
+    def __init__(self, tracer: 'Tracer', name: str, cat: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.status: Any = 'ok'
+        self._outputs: List[Path] = []
+
+    def set(self, **args) -> None:
+        """附加字段 (如 bytes、encoder)，出现在 trace 的 args 中"""
+        self.args.update(args)
+
+    def output(self, *paths) -> None:
+        """登记本阶段写出的文件，区间结束时按文件大小计入 bytes"""
+        self._outputs.extend(Path(p) for p in paths)
+
+    def __enter__(self) -> 'Span':
+        self._cpu = _children_cpu()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        wall = time.perf_counter() - self._start
+        cpu = _children_cpu() - self._cpu
+        if exc_type is not None:
+            self.status = exc_type.__name__
+        written = self.args.pop('bytes', 0)
+        for path in self._outputs:
+            try:
+                written += path.stat().st_size
+            except OSError:
+                pass
+        self.tracer.record(self, wall, cpu, written)
+        return False
+
+
+class Tracer:
+    """收集区间并导出 Chrome trace / 汇总"""
+
+    def __init__(self):
+        self.enabled = False
+        self.path: Optional[Path] = None
+        self._origin = time.perf_counter()
+        self._events: List[Dict[str, Any]] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def enable(self, path=None) -> None:
+        """开启追踪；path 为 Chrome trace 的输出文件 (None 时只输出汇总)"""
+        with self._lock:
+            self.enabled = True
+            self.path = Path(path) if path else None
+            self._origin = time.perf_counter()
+            self._events = []
+            self._threads = {}
+
+    def span(self, name: str, cat: str = 'stage', **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, cat, args)
+
+    def record(self, span: Span, wall: float, cpu: float, written: int) -> None:
+        thread = threading.current_thread()
+        event = {
+            'name': span.name, 'cat': span.cat, 'ph': 'X',
+            'ts': round((span._start - self._origin) * 1e6, 1),
+            'dur': round(wall * 1e6, 1),
+            'pid': os.getpid(), 'tid': thread.ident,
+            'args': {**span.args, 'status': span.status,
+                     'child_cpu_s': round(cpu, 3), 'bytes': written},
+        }
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Chrome trace 事件格式 (含线程名元数据)"""
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        meta = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                 'args': {'name': name}} for tid, name in threads.items()]
+        return {'traceEvents': meta + events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path) -> Path:
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self.chrome_trace()), encoding='utf-8')
+        os.replace(tmp, path)
+        return path
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """按区间名汇总：次数、总 / 平均墙钟时间、子进程 CPU、写出字节数、失败次数"""
+        totals: Dict[str, Dict[str, Any]] = defaultdict(
+            lambda: {'count': 0, 'wall_s': 0.0, 'child_cpu_s': 0.0, 'bytes': 0, 'failed': 0})
+        with self._lock:
+            events = list(self._events)
+        for e in events:
+            t = totals[e['name']]
+            t['count'] += 1
+            t['wall_s'] += e['dur'] / 1e6
+            t['child_cpu_s'] += e['args']['child_cpu_s']
+            t['bytes'] += e['args']['bytes']
+            if e['args']['status'] not in ('ok', 0):
+                t['failed'] += 1
+        rows = [{'name': name, **t, 'mean_s': t['wall_s'] / t['count']}
+                for name, t in totals.items()]
+        return sorted(rows, key=lambda r: r['wall_s'], reverse=True)
+
+    def format_summary(self) -> str:
+        rows = self.summary()
+        if not rows:
+            return "没有记录到任何阶段"
+        lines = [f"{'阶段':<24}{'次数':>6}{'总耗时s':>10}{'平均s':>9}{'子进程CPUs':>12}"
+                 f"{'写出MB':>9}{'失败':>6}"]
+        for r in rows:
+            lines.append(f"{r['name']:<24}{r['count']:>6}{r['wall_s']:>10.2f}{r['mean_s']:>9.2f}"
+                         f"{r['child_cpu_s']:>12.2f}{r['bytes'] / (1 << 20):>9.1f}{r['failed']:>6}")
+        return "\n".join(lines)
+
+    def finish(self) -> Optional[str]:
+        """批次结束：返回汇总文本，并在指定了路径时写出 Chrome trace"""
+        if not self.enabled:
+            return None
+        text = self.format_summary()
+        if self.path is not None:
+            try:
+                self.export(self.path)
+                text += f"\nChrome trace 已写入: {self.path}"
+            except OSError as e:
+                logger.warning(f"无法写出 trace 文件 {self.path}: {e}")
+        return text
+
+
+_tracer = Tracer()
+if os.environ.get(TRACE_ENV):
+    _tracer.enable(os.environ[TRACE_ENV])
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, cat: str = 'stage', **args):
+    """全局追踪器上的计时区间；追踪关闭时返回空对象"""
+    return _tracer.span(name, cat, **args)
+
+
+def enable_tracing(path=None) -> None:
+    _tracer.enable(path)
+
+
+def finish_tracing(log: Optional[logging.Logger] = None) -> Optional[str]:
+    """输出汇总 (写入 log) 并导出 trace，追踪关闭时为空操作"""
+    text = _tracer.finish()
+    if text and log is not None:
+        log.info(f"阶段耗时汇总:\n{text}")
+    return text
@@ -1,139 +1,260 @@
 import os
-import subprocess
 import json
 import logging
-import re
 import sys
+import queue
+import argparse
 from tqdm import tqdm
 
+from ve_cache import get_probe_cache, video_stream
+from ve_crop import detect_crop
+from ve_encoders import encoder_args, global_args, pick_encoder, upload_outputs
+from ve_locate import locate_ffmpeg
+from ve_filtergraph import (FAST_BG_FACTOR, WallpaperLayout, build_graph,
+                            build_multi_graph)
+from ve_progress import estimate_total_frames
+from ve_rawpipe import HAS_NUMPY, render_rawpipe
+from ve_resources import Admission, Demand, ResourceModel
+from ve_scheduler import JobScheduler
+from ve_segment import render_segmented
+from ve_supervisor import run_ffmpeg
+from ve_trace import enable_tracing, finish_tracing, span
+
 # 配置日誌
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - [%(levelname)s] - %(message)s')
 logger = logging.getLogger("VideoEngine_V2")
 
 
+# 輸出比例 (標籤, 寬/高)
+RATIOS = [('9x20', 9/20), ('5x11', 5/11)]
+
+
 class VideoWallpaperProductionEngine:
-    def __init__(self):
+    def __init__(self, single_pass=True, max_workers=None, bg_downscale=1, segments=1,
+                 mem_budget=None, rlimit=False, rawpipe=False, autocrop=True):
+        self.single_pass = single_pass  # 單次解碼同時輸出全部比例
+        self.rawpipe = rawpipe  # 用 NumPy 在 rawvideo 管道中合成 (每個比例一個解碼進程)
+        self.autocrop = autocrop  # 合成前檢測並裁掉源影片的黑邊
+        self.segments = segments  # >1 時長影片按關鍵幀分段並行渲染
+        self.mem_budget = mem_budget  # 並發任務的內存預算 (MB), None 為可用內存的 80%
+        self.rlimit = rlimit  # 是否按實測 VmData 峰值為每個 ffmpeg 設置內存上限
+        self.resources = None
+        self.max_workers = max_workers  # 並發任務數, None 為按編碼器自動計算
+        self.bg_downscale = bg_downscale  # >1 時背景先縮小再模糊 (快速背景)
+        self.scheduler = None
+        self.encoder = 'h264_nvenc'  # run() 中按實際探測結果替換
+        self._bar_rows = queue.Queue()  # 並發時每個 tqdm 進度條佔一行
         self.ffmpeg_path = "ffmpeg.exe"
         self.ffprobe_path = "ffprobe.exe"
         self._find_ffmpeg_components()
 
     def _find_ffmpeg_components(self):
-        """需求0: 遍歷目錄尋找 ffmpeg 組件"""
+        """需求0: 定位 ffmpeg 組件 (按順序查找, 結果緩存, 不再遍歷整個目錄)"""
         logger.info("正在尋找 FFmpeg 組件...")
-        search_root = os.path.dirname(os.path.abspath(__file__))
-        for root, dirs, files in os.walk(search_root):
-            if "ffmpeg.exe" in files:
-                self.ffmpeg_path = os.path.join(root, "ffmpeg.exe")
-            if "ffprobe.exe" in files:
-                self.ffprobe_path = os.path.join(root, "ffprobe.exe")
+        paths = locate_ffmpeg(os.path.dirname(os.path.abspath(__file__)))
+        if paths.ffmpeg:
+            self.ffmpeg_path, self.ffprobe_path = paths.ffmpeg, paths.ffprobe
         logger.info(
             f"組件路徑: FFmpeg={self.ffmpeg_path}, FFprobe={self.ffprobe_path}")
 
     def get_video_meta(self, path):
         """獲取元數據"""
         try:
-            cmd = [self.ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
-                   '-show_entries', 'stream=width,height,nb_frames', '-of', 'json', path]
-            res = subprocess.check_output(cmd).decode('utf-8')
-            v_data = json.loads(res)['streams'][0]
-            frames = v_data.get('nb_frames')
-            return int(v_data['width']), int(v_data['height']), int(frames) if frames and frames != 'N/A' else 0
+            probe = get_probe_cache().probe(path, self.ffprobe_path)
+            v_data = video_stream(probe)
+            # nb_frames 缺失時 (MKV/WebM) 按時長 × 幀率估算或逐包計數
+            frames = estimate_total_frames(path, probe, self.ffprobe_path)
+            return int(v_data['width']), int(v_data['height']), frames
         except Exception as e:
             logger.error(f"獲取元數據失敗: {path}, 錯誤: {e}")
             return None
 
-    def build_complex_filter(self, rotate, w, h, target_h):
-        """需求 1-6: 構建濾鏡鏈"""
-        # 數值確保偶數
-        sw, sh = (w // 2) * 2, (h // 2) * 2
-        sth = (target_h // 2) * 2
-        y_offset = (sth - sh) // 2
-
-        # 旋轉邏輯 (需求1)
-        trans = "transpose=1" if rotate else "copy"
-
-        # 濾鏡流程 (需求4, 5):
-        # [bg] 軌道1: 放大、裁切、高斯模糊
-        # [mask] 軌道2預處理: 生成 30px 收縮羽化遮罩
-        # [fg_feathered] 合併羽化
-        filter_str = (
-            # 準備原始流
-            f"[0:v]{trans},setsar=1[fg_raw];"
-            # 需求4: 軌道1 背景處理
-            f"[fg_raw]split=2[fg_for_bg][fg_for_main];"
-            f"[fg_for_bg]scale={sw}:{sth}:force_original_aspect_ratio=increase,crop={sw}:{sth},gblur=sigma=20[bg];"
-            # 需求5: 軌道2 臨時視頻3 (收縮羽化)
-            f"color=c=white:s={sw}x{sh}[m_base];"
-            f"[m_base]drawbox=x=0:y=0:w={sw}:h=30:t=fill:c=black,"       # 上邊界
-            f"drawbox=x=0:y={sh-30}:w={sw}:h=30:t=fill:c=black,"    # 下邊界
-            f"drawbox=x=0:y=0:w=30:h={sh}:t=fill:c=black,"       # 左邊界
-            f"drawbox=x={sw-30}:y=0:w=30:h={sh}:t=fill:c=black,"    # 右邊界
-            f"boxblur=30:1,format=gray[mask_feathered];"
-            # 前景與遮罩融合 (使用 yuva420p 保留透明度)
-            f"[fg_for_main]format=yuva420p[fg_alpha];"
-            f"[fg_alpha][mask_feathered]alphamerge[fg_feathered];"
-            # 需求5: 居中疊加並修正 overlay 語法
-            f"[bg][fg_feathered]overlay=x=0:y={y_offset}:shortest=1:format=auto,format=yuv420p[outv]"
-        )
-        return filter_str
-
-    def process_file(self, input_path):
+    def build_output_args(self, map_label, out_path):
+        """單個輸出的完整參數: 視頻 + 原音軌"""
+        return [*self.video_args(map_label),
+                '-map', '0:a?', '-c:a', 'copy',  # 保持音頻
+                out_path]
+
+    def video_args(self, map_label):
+        """需求6 & 7: GPU 加速 (NVENC) + VBR 10M 碼率; 無 NVENC 時用探測出的編碼器"""
+        if self.encoder != 'h264_nvenc':
+            return ['-map', map_label, *encoder_args(self.encoder)]
+        return [
+            '-map', map_label,
+            '-c:v', 'h264_nvenc',  # GPU 加速編碼
+            '-rc:v', 'vbr',       # 可變動態碼率 (需求6)
+            '-cq:v', '24',        # 質量控制
+            '-b:v', '10M',        # 目標碼率
+            '-maxrate:v', '15M',
+            '-bufsize:v', '20M',
+            '-preset', 'p4',      # 兼顧速度與質量
+            '-tune', 'hq',
+        ]
+
+    def filter_args(self, graph):
+        """濾鏡圖參數與輸出標籤 (VAAPI 需在末尾 hwupload)"""
+        filter_str, labels = upload_outputs(graph.graph, graph.outputs, self.encoder)
+        return ['-filter_complex', filter_str], labels
+
+    def variant(self):
+        """資源記錄的濾鏡圖變體"""
+        mode = 'rawpipe' if self.rawpipe else 'single' if self.single_pass else 'ratio'
+        return f"wallpaper-{mode}-{self.encoder}-bg{self.bg_downscale}"
+
+    def run_ffmpeg(self, cmd, total_f, desc, job=None, size=None):
+        """執行 FFmpeg 並以 tqdm 顯示幀進度 (佔用一個編碼器並發名額)"""
+        row = self._bar_rows.get()
+        try:
+            with self.scheduler.encoder_slot(self.encoder), \
+                    tqdm(total=total_f, unit='f', desc=desc, position=row, leave=False) as pbar:
+                last_f = 0
+
+                def on_progress(snap):
+                    nonlocal last_f
+                    pbar.update(snap.frame - last_f)
+                    pbar.set_postfix_str(snap.describe(), refresh=False)
+                    last_f = snap.frame
+                    if job:
+                        job.update(snap.frame)
+
+                # 讀線程排空輸出, 按幀率判定卡死並結束進程樹;
+                # 可選按 VmData 實測峰值限制內存 (尚無記錄時不限)
+                limit = 0
+                if self.rlimit and size:
+                    limit = self.resources.memory_limit(self.variant(), *size)
+                result = run_ffmpeg(cmd, total_f, on_progress,
+                                    should_stop=self.scheduler.cancelled.is_set,
+                                    memory_limit_mb=limit)
+                if result.ok and size:
+                    self.resources.record(self.variant(), *size, result.usage)
+                if result.stalled:
+                    logger.error(f"FFmpeg 卡滯已強制結束: {desc}")
+                elif not result.ok and not result.cancelled:
+                    logger.error(
+                        f"FFmpeg 錯誤 (返回值 {result.returncode}):\n{result.stderr_text()}")
+                return result.ok
+        finally:
+            self._bar_rows.put(row)
+
+    def process_file(self, input_path, job=None):
+        with span('video', cat='video', file=os.path.basename(input_path)) as sp:
+            success = self.render_file(input_path, job)
+            sp.status = 'ok' if success else 'failed'
+        return success
+
+    def render_file(self, input_path, job=None):
         meta = self.get_video_meta(input_path)
         if not meta:
-            return
+            return False
         ow, oh, total_f = meta
+        if job:
+            job.update(0, total_f)
+
+        # 黑邊只按關鍵幀抽樣檢測, 結果隨探測緩存保存; 前景按裁剪後的畫面計算
+        crop = None
+        if self.autocrop:
+            with span('cropdetect'):
+                crop = detect_crop(input_path, self.ffmpeg_path, self.ffprobe_path)
 
         # 需求1: 比例大於 1:1 則旋轉 (保證寬 < 高)
-        rotate = ow > oh
-        w, h = (oh, ow) if rotate else (ow, oh)
+        rotate = crop.w > crop.h if crop else ow > oh
+        out_name = os.path.basename(input_path)
 
-        # 需求2: 計算目標畫幅
-        for label, ratio in [('9x20', 9/20), ('5x11', 5/11)]:
-            target_h = int(w / ratio)
+        # 需求2: 目標畫幅 (濾鏡圖由 ve_filtergraph 統一構建, 同分辨率只計算一次)
+        targets = []
+        for label, ratio in RATIOS:
             os.makedirs(f"output/{label}", exist_ok=True)
-            out_name = os.path.basename(input_path)
-            out_path = os.path.abspath(f"output/{label}/{out_name}")
-
-            filter_complex = self.build_complex_filter(rotate, w, h, target_h)
-
-            # 需求6 & 7: GPU 加速 (NVENC) + VBR 10M 碼率
-            cmd = [
-                self.ffmpeg_path, '-y', '-progress', 'pipe:1', '-loglevel', 'error',
-                '-i', input_path,
-                '-filter_complex', filter_complex,
-                '-map', '[outv]',
-                '-c:v', 'h264_nvenc',  # GPU 加速編碼
-                '-rc:v', 'vbr',       # 可變動態碼率 (需求6)
-                '-cq:v', '24',        # 質量控制
-                '-b:v', '10M',        # 目標碼率
-                '-maxrate:v', '15M',
-                '-bufsize:v', '20M',
-                '-preset', 'p4',      # 兼顧速度與質量
-                '-tune', 'hq',
-                '-map', '0:a?', '-c:a', 'copy',  # 保持音頻
-                out_path
-            ]
+            layout = WallpaperLayout(ow, oh, rotate=rotate, ratio=ratio,
+                                     bg_downscale=self.bg_downscale,
+                                     crop=tuple(crop) if crop else None)
+            targets.append((label, layout,
+                            os.path.abspath(f"output/{label}/{out_name}")))
+
+        head = [self.ffmpeg_path, '-y', '-progress', 'pipe:1', '-loglevel', 'error',
+                *global_args(self.encoder), '-i', input_path]
+
+        if self.rawpipe:
+            success = True
+            for label, layout, out_path in targets:
+                logger.info(f">>> 處理中: {out_name} | 目標: {label} (rawvideo 合成)")
+                success &= self.run_rawpipe(input_path, layout, out_path, total_f,
+                                            f"{out_name} {label}", job)
+            return success
+
+        if self.segments > 1 and self.single_pass:
+            done = self.run_segmented(input_path, targets, total_f, job)
+            if done or self.scheduler.cancelled.is_set():
+                return done
+            logger.warning(f"分段渲染未通過, 改為整段渲染: {out_name}")
+
+        if self.single_pass:
+            # 單次解碼: 一個進程寫出全部比例
+            graph = build_multi_graph(tuple(layout for _, layout, _ in targets))
+            filter_args, out_labels = self.filter_args(graph)
+            cmd = head + filter_args
+            for out_label, (_, _, out_path) in zip(out_labels, targets):
+                cmd += self.build_output_args(out_label, out_path)
+            labels = "+".join(label for label, _, _ in targets)
+            logger.info(f">>> 處理中: {out_name} | 目標: {labels} (單次解碼)")
+            return self.run_ffmpeg(cmd, total_f, f"{out_name} {labels}", job, (ow, oh))
+
+        success = True
+        for label, layout, out_path in targets:
+            filter_args, out_labels = self.filter_args(build_graph(layout))
+            cmd = head + filter_args + self.build_output_args(out_labels[0], out_path)
 
             logger.info(f">>> 處理中: {out_name} | 目標: {label}")
-            with tqdm(total=total_f, unit='f', desc=label) as pbar:
-                proc = subprocess.Popen(
-                    cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                last_f = 0
-                while True:
-                    line = proc.stdout.readline()
-                    if not line and proc.poll() is not None:
-                        break
-                    m = re.search(r'frame=(\d+)', line)
-                    if m:
-                        curr_f = int(m.group(1))
-                        pbar.update(curr_f - last_f)
-                        last_f = curr_f
-
-                _, stderr = proc.communicate()
-                if proc.returncode != 0:
-                    logger.error(
-                        f"FFmpeg 錯誤 (返回值 {proc.returncode}):\n{stderr}")
+            success &= self.run_ffmpeg(cmd, total_f, f"{out_name} {label}", job, (ow, oh))
+        return success
+
+    def run_segmented(self, input_path, targets, total_f, job=None):
+        """按關鍵幀切成多段並行渲染, 無損拼接後校驗幀數與音畫同步"""
+        graph = build_multi_graph(tuple(layout for _, layout, _ in targets))
+        filter_str, out_labels = upload_outputs(graph.graph, graph.outputs, self.encoder)
+        desc = f"{os.path.basename(input_path)} x{self.segments}"
+        logger.info(f">>> 分段處理中: {desc}")
+        row = self._bar_rows.get()
+        try:
+            with tqdm(total=total_f, unit='f', desc=desc, position=row, leave=False) as pbar:
+                def on_progress(frames):
+                    pbar.n = frames
+                    pbar.refresh()
+                    if job:
+                        job.update(frames)
+
+                return render_segmented(
+                    input_path, filter_str, out_labels, [p for _, _, p in targets],
+                    self.video_args, self.ffmpeg_path, self.ffprobe_path,
+                    segments=self.segments, pre_args=global_args(self.encoder),
+                    encoder_slot=lambda: self.scheduler.encoder_slot(self.encoder),
+                    on_progress=on_progress, should_stop=self.scheduler.cancelled.is_set)
+        except Exception as e:
+            logger.error(f"分段渲染失敗: {e}")
+            return False
+        finally:
+            self._bar_rows.put(row)
+
+    def run_rawpipe(self, input_path, layout, out_path, total_f, desc, job=None):
+        """解碼 -> NumPy 羽化合成 -> 編碼 三段重疊執行 (佔用一個編碼器並發名額)"""
+        row = self._bar_rows.get()
+        try:
+            with self.scheduler.encoder_slot(self.encoder), \
+                    tqdm(total=total_f, unit='f', desc=desc, position=row, leave=False) as pbar:
+                def on_progress(frames):
+                    pbar.update(frames - pbar.n)
+                    if job:
+                        job.update(frames)
+
+                return render_rawpipe(input_path, out_path, layout, self.video_args,
+                                      self.encoder, self.ffmpeg_path, self.ffprobe_path,
+                                      on_progress=on_progress,
+                                      should_stop=self.scheduler.cancelled.is_set)
+        except Exception as e:
+            logger.error(f"rawvideo 合成失敗: {e}")
+            return False
+        finally:
+            self._bar_rows.put(row)
 
     def run(self):
         # 遍歷當前目錄下的所有影片
@@ -143,12 +264,70 @@ class VideoWallpaperProductionEngine:
             logger.warning("目錄中未找到影片文件。")
             return
 
-        for f in files:
-            self.process_file(os.path.abspath(f))
+        # 編碼器能力只探測一次 (按 ffmpeg 文件緩存), 沒有可用顯卡時直接用 CPU
+        self.encoder = pick_encoder(self.ffmpeg_path)
+        logger.info(f"編碼器: {self.encoder}")
+        if self.rawpipe and not HAS_NUMPY:
+            logger.warning("未安裝 NumPy, 改用濾鏡圖合成")
+            self.rawpipe = False
+
+        # 按歷史實測的內存 / CPU 佔用預測每個影片的需求, 放得下時才開始
+        self.resources = ResourceModel()
+        probes = get_probe_cache().probe_many(files, self.ffprobe_path)
+
+        # 多個影片並發渲染, 硬件編碼會話數由調度器限流
+        with JobScheduler(max_workers=self.max_workers,
+                          admission=Admission(self.mem_budget)) as scheduler:
+            self.scheduler = scheduler
+            for row in range(scheduler.max_workers):
+                self._bar_rows.put(row)
+            logger.info(f"並發任務數: {scheduler.max_workers}")
+            for f in files:
+                v_data = video_stream(probes.get(f, {})) or {}
+                demand = self.resources.predict(self.variant(), int(v_data.get('width', 0)),
+                                                int(v_data.get('height', 0)))
+                if self.segments > 1 and self.single_pass:
+                    # 分段渲染同時啟動 N 個 ffmpeg, 每段的佔用與整段相當
+                    demand = Demand(demand.mem_mb * self.segments, demand.cores * self.segments)
+                scheduler.submit(f, lambda job, path: self.process_file(path, job),
+                                 os.path.abspath(f), demand=demand)
+            scheduler.wait()
         logger.info("✅ 所有任務已完成。")
+        finish_tracing(logger)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="批量製作手機豎屏動態壁紙")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="同時渲染的任務數 (默認按編碼器並發上限自動計算)")
+    parser.add_argument('--fast-bg', type=int, nargs='?', const=FAST_BG_FACTOR,
+                        default=1, metavar='N',
+                        help=f"快速背景: 背景縮小到 1/N 再模糊 (不填 N 時為 {FAST_BG_FACTOR})")
+    parser.add_argument('--segments', type=int, default=1, metavar='N',
+                        help="單個長影片按關鍵幀切成 N 段並行渲染 (默認不分段)")
+    parser.add_argument('--mem-budget', type=int, default=None, metavar='MB',
+                        help="並發任務的內存預算 (默認為可用內存的 80%%, 0 為不限)")
+    parser.add_argument('--rlimit', action='store_true',
+                        help="按實測 VmData 峰值為每個 ffmpeg 進程設置內存上限 (僅 Linux, 首次運行不限)")
+    parser.add_argument('--no-autocrop', dest='autocrop', action='store_false',
+                        help="不檢測源影片的黑邊")
+    parser.add_argument('--rawpipe', action='store_true',
+                        help="在 Python 中用 NumPy 合成前景 (需安裝 numpy)")
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help="記錄各階段耗時, 結束時輸出匯總並寫出 Chrome trace JSON")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
     # 執行檢查並運行
-    engine = VideoWallpaperProductionEngine()
+    args = parse_args()
+    if args.trace:
+        enable_tracing(args.trace)
+    engine = VideoWallpaperProductionEngine(max_workers=args.jobs,
+                                           bg_downscale=args.fast_bg,
+                                           segments=args.segments,
+                                           mem_budget=args.mem_budget,
+                                           rlimit=args.rlimit,
+                                           rawpipe=args.rawpipe,
+                                           autocrop=args.autocrop)
     engine.run()
@@ -1,13 +1,21 @@
 import os
-import subprocess
-import json
 import logging
-import re
 import sys
 import time
+import argparse
 from pathlib import Path
 from tqdm import tqdm
 
+from ve_cache import get_probe_cache, video_stream
+from ve_encoders import encoder_args, global_args, pick_encoder, upload_outputs
+from ve_locate import locate_ffmpeg
+from ve_filtergraph import (FAST_BG_FACTOR, WallpaperLayout, build_graph,
+                            build_multi_graph)
+from ve_progress import estimate_total_frames
+from ve_scheduler import JobScheduler
+from ve_supervisor import run_ffmpeg
+from ve_trace import enable_tracing, finish_tracing, span
+
 # ==========================================
 # 1. 视觉增强库引入 (Rich Library)
 # ==========================================
@@ -32,8 +40,21 @@ logging.basicConfig(
 logger = logging.getLogger("VideoEngine")
 
 
+# 输出比例 (标签, 宽/高)
+RATIOS = [('9x20', 9/20), ('5x11', 5/11)]
+
+
 class UltimateVideoEngine:
-    def __init__(self):
+    def __init__(self, single_pass=True, max_workers=None, bg_downscale=1):
+        # 单次解码模式：一个 ffmpeg 进程同时输出全部比例
+        self.single_pass = single_pass
+        # 并发任务数，None 为按编码器并发上限自动计算
+        self.max_workers = max_workers
+        # 快速背景：>1 时背景先缩小到 1/N 再模糊，最后放大回画布
+        self.bg_downscale = bg_downscale
+        self.scheduler = None
+        self.encoder = 'h264_nvenc'  # start() 中按实际探测结果替换
+        self.progress = None  # 并发任务共用的 Rich 进度面板
         # 默认组件名称，将在初始化中动态更新
         self.ffmpeg_path = "ffmpeg.exe"
         self.ffprobe_path = "ffprobe.exe"
@@ -43,21 +64,10 @@ class UltimateVideoEngine:
     # 2. 组件路径搜索 (需求 0)
     # ==========================================
     def _find_components(self):
-        """递归搜索当前目录及子目录，寻找 FFmpeg 诊断文件中指定的路径"""
-        search_root = Path(".").resolve()
-        diag_file = search_root / "ffmpeg_full_diagnostics.json"
-
-        if diag_file.exists():
-            with open(diag_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # 严格按照诊断文件规范提取路径
-                self.ffmpeg_path = data['components']['ffmpeg']['path']
-                self.ffprobe_path = data['components']['ffprobe']['path']
-        else:
-            # 备选方案：如果 JSON 不存在，在当前目录下递归查找可执行文件
-            for p in search_root.rglob("ffmpeg.exe"):
-                self.ffmpeg_path = str(p)
-                break
+        """优先使用 FFmpeg 诊断文件中指定的路径，其次 ./ffmpeg/bin、PATH、限深扫描 (结果缓存)"""
+        paths = locate_ffmpeg(Path(".").resolve())
+        if paths.ffmpeg:
+            self.ffmpeg_path, self.ffprobe_path = paths.ffmpeg, paths.ffprobe
 
         if HAS_RICH:
             rprint(Panel(
@@ -69,136 +79,146 @@ class UltimateVideoEngine:
     def get_video_meta(self, path):
         """利用 ffprobe 获取视频的宽高和总帧数"""
         try:
-            cmd = [self.ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
-                   '-show_entries', 'stream=width,height,nb_frames', '-of', 'json', path]
-            res = subprocess.check_output(cmd).decode('utf-8')
-            v_data = json.loads(res)['streams'][0]
-            frames = v_data.get('nb_frames')
+            probe = get_probe_cache().probe(path, self.ffprobe_path)
+            v_data = video_stream(probe)
+            # nb_frames 缺失时 (MKV/WebM) 按时长 × 帧率估算或逐包计数
+            frames = estimate_total_frames(path, probe, self.ffprobe_path)
             # 宽高必须是偶数才能被大多数编码器识别
-            return int(v_data['width']), int(v_data['height']), int(frames) if frames and frames != 'N/A' else 0
+            return int(v_data['width']), int(v_data['height']), frames
         except:
             return None
 
     # ==========================================
-    # 4. FFmpeg 核心滤镜链构建 (关键逻辑)
+    # 4. 任务分发与 GPU 编码执行
     # ==========================================
-    def build_filter(self, rotate, w, h, target_h):
+    def build_output_args(self, map_label, out_path):
         """
-        构建复杂的 FilterGraph 以实现背景模糊与内缩羽化
-        rotate: 是否需要 90 度顺时针旋转
-        w, h: 旋转后的视频宽高
-        target_h: 目标画幅总高度
+        单个输出文件的参数 (需求 6 & 7: GPU 加速配置)
+        使用 h264_nvenc (NVIDIA 显卡加速)
+        rc:v vbr -> 启用可变动态码率
+        b:v 10M -> 目标平均码率
+        没有可用 NVENC 时使用 ve_encoders 探测出的编码器
         """
-        # 强制偶数化处理，防止 FFmpeg 报错
-        sw, sh = (w // 2) * 2, (h // 2) * 2
-        sth = (target_h // 2) * 2
-        y_offset = (sth - sh) // 2  # 计算前景居中的垂直偏移
-
-        # 需求 1: 旋转处理
-        trans = "transpose=1" if rotate else "copy"
-
-        # 滤镜链详解：
-        # [raw]: 旋转处理后的原始流
-        # [bg]: 轨道 1 - 放大 -> 裁剪 -> 高斯模糊 (20)
-        # [mask]: 轨道 2 预处理 - 创建纯色画布 -> 绘制 30px 黑边 -> 盒状模糊(羽化)
-        # [fg_final]: 前景合并 - 使用 alphamerge 将遮罩应用到视频上
-        # [outv]: 最终叠加 - overlay 必须开启 format=auto 才能支持 Alpha 通道渲染
-        filters = (
-            f"[0:v]{trans},setsar=1[raw];"
-            f"[raw]split=2[bg_src][fg_src];"
-            f"[bg_src]scale={sw}:{sth}:force_original_aspect_ratio=increase,crop={sw}:{sth},gblur=sigma=20[bg];"
-            f"color=c=white:s={sw}x{sh}[m_base];"
-            f"[m_base]drawbox=x=0:y=0:w={sw}:h=30:t=fill:c=black,"  # 上边羽化区
-            f"drawbox=x=0:y={sh-30}:w={sw}:h=30:t=fill:c=black,"  # 下边羽化区
-            f"drawbox=x=0:y=0:w=30:h={sh}:t=fill:c=black,"       # 左边羽化区
-            f"drawbox=x={sw-30}:y=0:w=30:h={sh}:t=fill:c=black,"  # 右边羽化区
-            f"boxblur=30:1,format=gray[mask];"
-            f"[fg_src]format=yuva420p[fg_alpha];"
-            f"[fg_alpha][mask]alphamerge[fg_final];"
-            f"[bg][fg_final]overlay=x=0:y={y_offset}:shortest=1:format=auto,format=yuv420p[outv]"
-        )
-        return filters
+        if self.encoder != 'h264_nvenc':
+            return ['-map', map_label, *encoder_args(self.encoder),
+                    '-map', '0:a?', '-c:a', 'copy', str(out_path)]
+        return [
+            '-map', map_label,
+            '-c:v', 'h264_nvenc', '-rc:v', 'vbr', '-b:v', '10M', '-maxrate:v', '15M',
+            '-preset', 'p4', '-tune', 'hq',
+            '-map', '0:a?', '-c:a', 'copy',  # 复制原音轨，不重新编码
+            str(out_path)
+        ]
 
-    # ==========================================
-    # 5. 任务分发与 GPU 编码执行
-    # ==========================================
-    def process_task(self, video_path):
+    def filter_args(self, graph):
+        """滤镜图参数与输出标签 (VAAPI 需在末尾 hwupload)"""
+        filter_str, labels = upload_outputs(graph.graph, graph.outputs, self.encoder)
+        return ['-filter_complex', filter_str], labels
+
+    def process_task(self, video_path, job=None):
         meta = self.get_video_meta(str(video_path))
         if not meta:
-            return
+            return False
         ow, oh, total_f = meta
+        if job:
+            job.update(0, total_f)
 
         # 需求 1: 比例判断 (大于 1:1 则旋转)
         rotate = ow > oh
-        w, h = (oh, ow) if rotate else (ow, oh)
 
-        # 需求 2: 处理两个目标比例
-        for label, ratio in [('9x20', 9/20), ('5x11', 5/11)]:
-            th = int(w / ratio)
+        # 需求 2: 处理两个目标比例 (滤镜图由 ve_filtergraph 统一构建并缓存)
+        targets = []
+        for label, ratio in RATIOS:
             out_dir = Path(f"output/{label}")
             out_dir.mkdir(parents=True, exist_ok=True)
-            out_path = out_dir / video_path.name
-
-            filter_str = self.build_filter(rotate, w, h, th)
-
-            # 需求 6 & 7: GPU 加速配置
-            # 使用 h264_nvenc (NVIDIA 显卡加速)
-            # rc:v vbr -> 启用可变动态码率
-            # b:v 10M -> 目标平均码率
-            cmd = [
-                self.ffmpeg_path, '-y', '-progress', 'pipe:1', '-loglevel', 'error',
-                '-i', str(video_path),
-                '-filter_complex', filter_str,
-                '-map', '[outv]',
-                '-c:v', 'h264_nvenc', '-rc:v', 'vbr', '-b:v', '10M', '-maxrate:v', '15M',
-                '-preset', 'p4', '-tune', 'hq',
-                '-map', '0:a?', '-c:a', 'copy',  # 复制原音轨，不重新编码
-                str(out_path)
-            ]
-
-            self.run_with_progress(
-                cmd, total_f, f"[{label}] {video_path.name}")
+            layout = WallpaperLayout(ow, oh, rotate=rotate, ratio=ratio,
+                                     bg_downscale=self.bg_downscale)
+            targets.append((label, layout,
+                            out_dir / video_path.name))
+
+        head = [self.ffmpeg_path, '-y', '-progress', 'pipe:1', '-loglevel', 'error',
+                *global_args(self.encoder), '-i', str(video_path)]
+
+        if self.single_pass:
+            # 单次解码：一次解码 + 旋转，同一进程写出全部比例
+            graph = build_multi_graph(tuple(layout for _, layout, _ in targets))
+            filter_args, out_labels = self.filter_args(graph)
+            cmd = head + filter_args
+            for out_label, (_, _, out_path) in zip(out_labels, targets):
+                cmd += self.build_output_args(out_label, out_path)
+            labels = "+".join(label for label, _, _ in targets)
+            return self.run_with_progress(
+                cmd, total_f, f"[{labels}] {video_path.name}", job)
+
+        success = True
+        for label, layout, out_path in targets:
+            filter_args, out_labels = self.filter_args(build_graph(layout))
+            cmd = head + filter_args + self.build_output_args(out_labels[0], out_path)
+
+            success &= self.run_with_progress(
+                cmd, total_f, f"[{label}] {video_path.name}", job)
+        return success
 
     # ==========================================
-    # 6. 装饰性进度条逻辑
+    # 5. 装饰性进度条逻辑
     # ==========================================
-    def run_with_progress(self, cmd, total_frames, description):
-        """实时捕获 FFmpeg stdout 管道中的 frame 字段更新进度条"""
-        if HAS_RICH:
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                BarColumn(bar_width=None),
-                TaskProgressColumn(),
-                TimeRemainingColumn(),
-                console=console
-            ) as progress:
-                task = progress.add_task(description, total=total_frames)
-                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
-                last_f = 0
-                while True:
-                    line = proc.stdout.readline()
-                    if not line and proc.poll() is not None:
-                        break
-                    m = re.search(r'frame=(\d+)', line)
-                    if m:
-                        curr_f = int(m.group(1))
-                        progress.update(task, advance=curr_f - last_f)
-                        last_f = curr_f
+    def run_with_progress(self, cmd, total_frames, description, job=None):
+        """由 ve_supervisor 监督 FFmpeg 并实时更新进度条 (占用一个编码器并发名额)"""
+        with self.scheduler.encoder_slot(self.encoder):
+            if self.progress is not None:
+                # 并发任务共用 start() 中创建的 Rich 进度面板，每个任务一行
+                task = self.progress.add_task(description, total=total_frames or None)
+                advance = lambda n, info: self.progress.update(
+                    task, advance=n, description=f"{description} [dim]{info}[/dim]")
+            else:
+                # 备选：标准 tqdm 进度条
+                pbar = tqdm(total=total_frames, desc=description, unit='f',
+                            position=job.job_id % self.scheduler.max_workers if job else 0,
+                            leave=False)
+
+                def advance(n, info):
+                    pbar.update(n)
+                    pbar.set_postfix_str(info, refresh=False)
+
+            last_f = 0
+
+            def on_progress(snap):
+                nonlocal last_f
+                advance(snap.frame - last_f, snap.describe())
+                last_f = snap.frame
+                if job:
+                    job.update(snap.frame)
+
+            # 读线程排空输出，按帧率判定卡死并结束进程树
+            try:
+                result = run_ffmpeg(cmd, total_frames, on_progress,
+                                    should_stop=self.scheduler.cancelled.is_set)
+            finally:
+                if self.progress is not None:
+                    self.progress.remove_task(task)
+                else:
+                    pbar.close()
+
+            if result.stalled:
+                logger.error(f"FFmpeg 卡滞已强制结束: {description}")
+            elif not result.ok and not result.cancelled:
+                logger.error(
+                    f"FFmpeg 错误 (返回值 {result.returncode}):\n{result.stderr_text()}")
+            return result.ok
+
+    def process_job(self, job, video_path):
+        """调度器任务：渲染单个视频并打印耗时"""
+        start_time = time.time()
+        with span('video', cat='video', file=video_path.name) as sp:
+            success = self.process_task(video_path, job)
+            sp.status = 'ok' if success else 'failed'
+        elapsed = time.time() - start_time
+        if success:
+            rprint(
+                f"[bold green]✅ 任务完成:[/bold green] {video_path.name} [dim](耗时: {elapsed:.1f}s)[/dim]")
         else:
-            # 备选：标准 tqdm 进度条
-            with tqdm(total=total_frames, desc=description, unit='f') as pbar:
-                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
-                last_f = 0
-                while True:
-                    line = proc.stdout.readline()
-                    if not line and proc.poll() is not None:
-                        break
-                    m = re.search(r'frame=(\d+)', line)
-                    if m:
-                        curr_f = int(m.group(1))
-                        pbar.update(curr_f - last_f)
-                        last_f = curr_f
+            rprint(f"[bold red]❌ 任务失败:[/bold red] {video_path.name}")
+        return success
 
     def start(self):
         """自动扫描当前目录并启动引擎"""
@@ -210,20 +230,55 @@ class UltimateVideoEngine:
             rprint("[bold red]❌ 未在当前目录发现视频文件。[/bold red]")
             return
 
-        rprint(
-            f"[bold cyan]🚀 发现 {len(video_files)} 个任务，正在启动 GPU 加速引擎...[/bold cyan]\n")
+        # 编码器能力只探测一次 (按 ffmpeg 文件缓存)，没有可用显卡时直接使用 CPU
+        self.encoder = pick_encoder(self.ffmpeg_path)
 
-        for v in video_files:
-            start_time = time.time()
-            self.process_task(v)
-            elapsed = time.time() - start_time
+        with JobScheduler(max_workers=self.max_workers) as scheduler:
+            self.scheduler = scheduler
             rprint(
-                f"[bold green]✅ 任务完成:[/bold green] {v.name} [dim](耗时: {elapsed:.1f}s)[/dim]")
+                f"[bold cyan]🚀 发现 {len(video_files)} 个任务，并发 {scheduler.max_workers}，"
+                f"编码器 {self.encoder}，正在启动引擎...[/bold cyan]\n")
+
+            if HAS_RICH:
+                self.progress = Progress(
+                    SpinnerColumn(),
+                    TextColumn("[progress.description]{task.description}"),
+                    BarColumn(bar_width=None),
+                    TaskProgressColumn(),
+                    TimeRemainingColumn(),
+                    console=console
+                )
+                self.progress.start()
+            try:
+                for v in video_files:
+                    scheduler.submit(v.name, self.process_job, v)
+                scheduler.wait()
+            finally:
+                if self.progress is not None:
+                    self.progress.stop()
+                    self.progress = None
+        finish_tracing(logger)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="批量制作手机竖屏动态壁纸 (GPU 加速)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="同时渲染的任务数 (默认按编码器并发上限自动计算)")
+    parser.add_argument('--fast-bg', type=int, nargs='?', const=FAST_BG_FACTOR,
+                        default=1, metavar='N',
+                        help=f"快速背景：背景缩小到 1/N 再模糊 (不填 N 时为 {FAST_BG_FACTOR})")
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help="记录各阶段耗时，结束时输出汇总并写出 Chrome trace JSON")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
     try:
-        engine = UltimateVideoEngine()
+        args = parse_args()
+        if args.trace:
+            enable_tracing(args.trace)
+        engine = UltimateVideoEngine(max_workers=args.jobs,
+                                     bg_downscale=args.fast_bg)
         engine.start()
         rprint("\n[bold reverse green] ✨ 全部视频批量处理完毕！ ✨ [/bold reverse green]")
     except KeyboardInterrupt: